@@ -0,0 +1,99 @@
+import sys
+import copy
+import numpy as np
+import torch
+
+sys.path.append('../')
+from models import FNN4d, Adam, LpLoss, UnitGaussianNormalizer
+
+# Optimizer state and convergence of Adam with the full state, the factored
+# second moment (factored=True) and the factored second moment with a bfloat16
+# first moment (exp_avg_dtype=torch.bfloat16), for FNN4d of the crack problem
+# (eq4d/crack.py: 3 layers, width 32, modes 12, 12, 12, 6).
+#
+# The state is counted after training (its size does not change). Convergence
+# is the relative L2 training loss of n_steps steps from the same initial
+# weights, on the crack data when the directory of dataset_uniform{1,2,3}.mat
+# is given, otherwise on the output of a second randomly initialized FNN4d on a
+# 24^3 x 12 grid.
+#
+# usage: python adam_memory.py [n_steps] [k_max] [crack data directory]
+#        k_max defaults to 12 (6 in time, 1.9GB of parameters); smaller k_max fit machines with less memory
+
+torch.manual_seed(0)
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+n_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+k_max = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+data_dir = sys.argv[3] if len(sys.argv) > 3 else None
+batch_size = 2
+n_fno_layers, d_f = 3, 32
+
+variants = [
+    ("full",             dict()),
+    ("factored",         dict(factored=True)),
+    ("factored + bf16",  dict(factored=True, exp_avg_dtype=torch.bfloat16)),
+]
+
+
+def fno():
+    return FNN4d([k_max] * n_fno_layers, [k_max] * n_fno_layers, [k_max] * n_fno_layers, [k_max // 2] * n_fno_layers,
+                 fc_dim=d_f, layers=[d_f] * (n_fno_layers + 1), in_dim=5, out_dim=1, act="gelu", pad_ratio=0.05).to(device)
+
+
+def crack_data(data_dir, n_train=160):
+    # phi(:, 0) and the coordinates -> phi(:, 1:end), as eq4d/crack.py with FNO_dim = 4
+    import scipy.io as sio
+    phi = np.vstack([sio.loadmat(data_dir + "/dataset_uniform" + str(i) + ".mat")["phi_uniform"] for i in [1, 2, 3]])
+    nq, nt = 41, phi.shape[2]
+    phi = phi[:n_train].reshape((n_train, nq, nq, nq, nt), order="F")
+    xx = np.linspace(-0.1, 0.1, nq)
+    yq, xq, zq = np.meshgrid(xx, xx, xx)
+    coord = np.zeros((nq, nq, nq, nt - 1, 4))
+    for i in range(nt - 1):
+        coord[..., i, 0], coord[..., i, 1], coord[..., i, 2], coord[..., i, 3] = xq, yq, zq, (i + 1) / nt
+    x = np.concatenate((np.tile(phi[..., 0:1], (1, 1, 1, 1, nt - 1))[..., np.newaxis],
+                        np.tile(coord, (n_train, 1, 1, 1, 1, 1))), axis=-1)
+    x = torch.from_numpy(x.astype(np.float32))
+    y = torch.from_numpy(phi[..., 1:nt, np.newaxis].astype(np.float32))
+    return UnitGaussianNormalizer(x).encode(x), UnitGaussianNormalizer(y).encode(y)
+
+
+def state_bytes(optimizer):
+    n = 0
+    for state in optimizer.state.values():
+        for value in state.values():
+            for t in (value if isinstance(value, list) else [value]):
+                if isinstance(t, torch.Tensor):
+                    n += t.numel() * t.element_size()
+    return n
+
+
+model = fno()
+param_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+
+if data_dir is not None:
+    x, y = crack_data(data_dir)
+else:
+    x = torch.randn(16, 24, 24, 24, 12, 5)
+    with torch.no_grad():
+        y = torch.cat([fno()(x[i:i+batch_size].to(device)).cpu() for i in range(0, x.shape[0], batch_size)])
+
+myloss = LpLoss(d=1, p=2, size_average=True)
+print("parameters : %.1fMB" % (param_bytes / 2**20))
+print("%-16s %12s %12s %12s %12s" % ("variant", "state", "loss 0", "loss n/2", "loss n"))
+for name, options in variants:
+    student = copy.deepcopy(model)
+    optimizer = Adam(student.parameters(), lr=1e-3, weight_decay=1e-4, **options)
+    generator = torch.Generator().manual_seed(0)
+    losses = []
+    for step in range(n_steps):
+        index = torch.randint(x.shape[0], (batch_size,), generator=generator)
+        xb, yb = x[index].to(device), y[index].to(device)
+        optimizer.zero_grad()
+        loss = myloss(student(xb).view(batch_size, -1), yb.view(batch_size, -1))
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.item())
+    print("%-16s %10.1fMB %12.4f %12.4f %12.4f" % (name, state_bytes(optimizer) / 2**20,
+                                                 losses[0], np.mean(losses[n_steps//2 - 5:n_steps//2 + 5]), np.mean(losses[-10:])))
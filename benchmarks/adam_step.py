@@ -0,0 +1,66 @@
+import sys
+import copy
+import torch
+from timeit import default_timer
+
+sys.path.append('../')
+from models import FNN1d, FNN2d, FNN3d, FNN4d, Adam
+
+# Time of one Adam step, python loop over the parameters (foreach=False) and
+# multi-tensor torch._foreach_* kernels (foreach=True), for FNN1d-4d settings of
+# the sweep scripts (eq1d: k_max 16-128, d_f 16-128, 3-5 layers; eq4d/crack.py:
+# modes 6, width 32). Gradients are random, both optimizers start from the same
+# weights and must give the same update.
+#
+# usage: python adam_step.py [n_repeat]
+
+torch.manual_seed(0)
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+n_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+cases = [
+    # name, model class, width, number of fourier layers, modes per axis
+    ("1d k16 d16",   FNN1d, 16,  3, (16,)),
+    ("1d k64 d64",   FNN1d, 64,  4, (64,)),
+    ("1d k128 d128", FNN1d, 128, 5, (128,)),
+    ("2d k16 d32",   FNN2d, 32,  4, (16, 16)),
+    ("3d k12 d32",   FNN3d, 32,  4, (12, 12, 12)),
+    ("4d crack",     FNN4d, 32,  3, (6, 6, 6, 6)),
+]
+
+
+def sync():
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def timing(optimizer):
+    # one warm up step (state initialization), then the average over n_repeat steps
+    for i in range(n_repeat + 1):
+        if i == 1:
+            sync()
+            start = default_timer()
+        optimizer.step()
+    sync()
+    return (default_timer() - start) / n_repeat
+
+
+print("%-14s %8s %10s %10s %12s %8s" % ("case", "tensors", "params", "loop", "foreach", "speedup"))
+for name, Model, width, n_layers, modes in cases:
+    kwargs = dict(layers=[width] * (n_layers + 1), fc_dim=width, in_dim=1 + len(modes), out_dim=1, pad_ratio=0.05)
+    model = Model(*[[m] * n_layers for m in modes], **kwargs).to(device)
+    for p in model.parameters():
+        p.grad = torch.randn_like(p)
+    models = [model, copy.deepcopy(model)]
+
+    times = []
+    for model, foreach in zip(models, [False, True]):
+        times.append(timing(Adam(model.parameters(), lr=1e-3, weight_decay=1e-4, foreach=foreach)))
+
+    for p, q in zip(models[0].parameters(), models[1].parameters()):
+        assert torch.allclose(p, q, rtol=1e-4, atol=1e-6), name + " : loop and foreach updates differ"
+
+    n_tensors = len(list(models[0].parameters()))
+    n_params = sum(p.numel() for p in models[0].parameters())
+    print("%-14s %8d %10d %8.2fms %10.2fms %7.2fx" % (name, n_tensors, n_params, 1e3*times[0], 1e3*times[1], times[0]/times[1]))
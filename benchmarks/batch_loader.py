@@ -0,0 +1,36 @@
+import sys
+import torch
+from timeit import default_timer
+
+sys.path.append('../')
+from models import TensorBatchLoader
+
+# One epoch of batches of the 1D sweeps (16384 samples of 1024 points, input
+# (a(x), x), output u(x), batch size 64) with torch's DataLoader over a
+# TensorDataset and with TensorBatchLoader, shuffled (training) and in order
+# (test), in samples per second. The batches are only fetched, no model runs.
+#
+# usage: python batch_loader.py [n_samples] [n_points]
+
+torch.manual_seed(0)
+
+n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 16384
+n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+batch_size = 64
+
+x = torch.randn(n_samples, n_points, 2)
+y = torch.randn(n_samples, n_points, 1)
+
+
+def timing(loader):
+    start = default_timer()
+    for xb, yb in loader:
+        pass
+    return default_timer() - start
+
+
+print("%-10s %16s %18s %8s" % ("shuffle", "DataLoader", "TensorBatchLoader", "speedup"))
+for shuffle in [True, False]:
+    times = [timing(torch.utils.data.DataLoader(torch.utils.data.TensorDataset(x, y), batch_size=batch_size, shuffle=shuffle)),
+             timing(TensorBatchLoader(x, y, batch_size=batch_size, shuffle=shuffle))]
+    print("%-10s %14.0f/s %16.0f/s %7.1fx" % (shuffle, n_samples / times[0], n_samples / times[1], times[0] / times[1]))
@@ -0,0 +1,74 @@
+import sys
+import torch
+from timeit import default_timer
+
+sys.path.append('../')
+from models import FNN1d, FNN2d, FNN3d, FNN4d
+
+# Throughput of FNN1d-4d with channels first activations (permutes around the
+# Fourier layers, ws as Conv1d over a view) and channels last activations
+# (channels_last=True: FFTs over the spatial axes of (batch, x, ..., channel),
+# ws as Linear, no permute), in samples per second for forward and forward +
+# backward. Both models share the same weights.
+#
+# usage: python channels_last.py [n_repeat] [dim ...]
+#        e.g. python channels_last.py 3 1d 2d
+
+torch.manual_seed(0)
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+n_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+names = sys.argv[2:]
+
+cases = [
+    # name, model class, batch size, width, grid, modes per axis
+    ("1d", FNN1d, 64, 64, (4096,),          (16,)),
+    ("2d", FNN2d, 16, 32, (128, 128),       (16, 16)),
+    ("3d",  FNN3d, 2, 32, (41, 41, 41),     (12, 12, 12)),
+    ("4d",  FNN4d, 2, 32, (41, 41, 41, 15), (12, 12, 12, 6)),
+]
+
+
+def sync():
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def timing(model, x, backward):
+    # one warm up call, then the average over n_repeat calls
+    for i in range(n_repeat + 1):
+        if i == 1:
+            sync()
+            start = default_timer()
+        out = model(x)
+        if backward:
+            out.sum().backward()
+    sync()
+    return (default_timer() - start) / n_repeat
+
+
+print("%-4s %-8s %16s %16s %8s" % ("dim", "pass", "channels first", "channels last", "speedup"))
+for name, Model, batch_size, width, grid, modes in cases:
+    if names and name not in names:
+        continue
+    n_layers = 3
+    kwargs = dict(layers=[width] * (n_layers + 1), fc_dim=width, in_dim=1 + len(grid), out_dim=1, pad_ratio=0.05)
+    mode_args = [[m] * n_layers for m in modes]
+    models = [Model(*mode_args, channels_last=channels_last, **kwargs).to(device) for channels_last in [False, True]]
+    models[1].load_state_dict(models[0].state_dict())
+
+    x = torch.randn(batch_size, *grid, 1 + len(grid), device=device)
+    with torch.no_grad():
+        err = (models[0](x) - models[1](x)).abs().max().item()
+    assert err < 1e-4, name + " : channels first and channels last outputs differ"
+
+    for backward in [False, True]:
+        times = []
+        for model in models:
+            if backward:
+                times.append(timing(model, x, True))
+            else:
+                with torch.no_grad():
+                    times.append(timing(model, x, False))
+        print("%-4s %-8s %12.1f/s %12.1f/s %7.2fx" % (name, "fwd+bwd" if backward else "fwd",
+                                                      batch_size / times[0], batch_size / times[1], times[0] / times[1]))
@@ -0,0 +1,76 @@
+import sys
+import resource
+import multiprocessing as mp
+import torch
+
+sys.path.append('../')
+from models import construct_model
+
+# Peak memory of one training step (forward + backward) of FNN4d on the crack
+# problem (41^3 points, 16 time steps, eq4d/crack.py) for each activation
+# checkpointing setting of the Fourier layers (config['model']['checkpoint']).
+#
+# Every setting runs in a fresh process. On GPU the peak is the allocator peak,
+# on CPU the growth of the peak resident set size over the state before the
+# step (model, input and torch itself excluded).
+#
+# usage: python checkpoint_memory.py [batch_size] [k_max]
+#        k_max defaults to 12 (6 in time, 1.9GB of parameters); smaller k_max fit machines with less memory
+
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+k_max = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+grid = (41, 41, 41, 16)
+n_fno_layers, d_f = 3, 32
+
+settings = [
+    # checkpoint, lean
+    (None,   False),
+    ([0],    False),
+    ([0, 1], False),
+    ('all',  False),
+    (None,   True),
+    ('all',  True),
+]
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def step(checkpoint, lean, queue):
+    torch.manual_seed(0)
+    config = {"model": {"model": "FNO", "dim": 4, "modes": [k_max] * n_fno_layers, "modes4": [k_max // 2] * n_fno_layers,
+                        "fc_dim": d_f, "layers": [d_f] * (n_fno_layers + 1),
+                        "in_dim": 1 + len(grid), "out_dim": 1, "act": "gelu", "pad_ratio": 0.05,
+                        "checkpoint": checkpoint, "lean": lean}}
+    model = construct_model(config)
+    device = next(model.parameters()).device
+    x = torch.randn(batch_size, *grid, 1 + len(grid), device=device)
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+        start = torch.cuda.memory_allocated(device)
+        model(x).sum().backward()
+        queue.put(torch.cuda.max_memory_allocated(device) - start)
+    else:
+        start = rss()
+        model(x).sum().backward()
+        # ru_maxrss is in kilobytes on Linux
+        queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start)
+
+
+if __name__ == '__main__':
+    ctx = mp.get_context('spawn')
+    print("batch_size = %d, k_max = %d" % (batch_size, k_max))
+    print("%-12s %-6s %12s" % ("checkpoint", "lean", "peak"))
+    for checkpoint, lean in settings:
+        queue = ctx.Queue()
+        process = ctx.Process(target=step, args=(checkpoint, lean, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print("%-12s %-6s %12s" % (checkpoint, lean, "failed"))
+            continue
+        peak = queue.get()
+        print("%-12s %-6s %10.1fMB" % (checkpoint, lean, peak / 2**20))
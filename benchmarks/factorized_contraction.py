@@ -0,0 +1,75 @@
+import sys
+import torch
+from timeit import default_timer
+
+sys.path.append('../')
+from models.core import FactorizedSpectralConv1d, FactorizedSpectralConv2d, FactorizedSpectralConv3d
+
+# Dense reconstruction (implementation='reconstructed') vs. contraction with the
+# CP/Tucker factors (implementation='factorized') of the factorized spectral layers,
+# over the rank of the factorization.
+#
+# The layers are jointly factorized over 4 Fourier layers, as in FactorizedFNO1d/2d/3d;
+# the 3d case uses the shapes of the crack problem (43 points per axis after padding,
+# width 32, k_max = 12).
+#
+# usage: python factorized_contraction.py [n_repeat]
+
+torch.manual_seed(0)
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+n_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+ranks = [0.05, 0.1, 0.25, 0.5, 1.0]
+cases = [
+    # name, layer class, batch size, width, grid, modes
+    ("1d",       FactorizedSpectralConv1d, 64, 64, (4300,),      (16,)),
+    ("2d",       FactorizedSpectralConv2d, 16, 32, (128, 128),   (16, 16)),
+    ("3d crack", FactorizedSpectralConv3d,  2, 32, (43, 43, 43), (12, 12, 12)),
+]
+
+
+def sync():
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def timing(layer, x, backward):
+    # one warm up call, then the average over n_repeat calls
+    for i in range(n_repeat + 1):
+        if i == 1:
+            sync()
+            start = default_timer()
+        out = layer(x, 1)
+        if backward:
+            out.sum().backward()
+    sync()
+    return (default_timer() - start) / n_repeat
+
+
+print("%-10s %-8s %6s %-8s %14s %12s %8s" % ("case", "factor.", "rank", "pass", "reconstructed", "factorized", "speedup"))
+for name, Layer, batch_size, width, grid, modes in cases:
+    x = torch.randn(batch_size, width, *grid, device=device, requires_grad=True)
+    for factorization in ['cp', 'tucker']:
+        for rank in ranks:
+            layer = Layer(width, width, *modes, n_layers=4, rank=rank, factorization=factorization).to(device)
+
+            with torch.no_grad():
+                layer.implementation = 'reconstructed'
+                ref = layer(x, 1)
+                layer.implementation = 'factorized'
+                err = (layer(x, 1) - ref).abs().max().item()
+            assert err < 1e-4 * ref.abs().max().item(), name + " : factorized and reconstructed outputs differ"
+
+            for backward in [False, True]:
+                times = []
+                for implementation in ['reconstructed', 'factorized']:
+                    layer.implementation = implementation
+                    if backward:
+                        times.append(timing(layer, x, True))
+                    else:
+                        with torch.no_grad():
+                            times.append(timing(layer, x, False))
+                print("%-10s %-8s %6.2f %-8s %12.2fms %10.2fms %7.2fx" % (name, factorization, rank,
+                                                                          "fwd+bwd" if backward else "fwd",
+                                                                          1e3*times[0], 1e3*times[1], times[0]/times[1]))
@@ -0,0 +1,53 @@
+import sys
+import torch
+from timeit import default_timer
+
+sys.path.append('../')
+from models.utils import get_pad_nums
+
+# rfftn + irfftn time of the padded grids with pad_policy = 'ratio' (floor(pad_ratio * n)
+# points) and 'fast' (rounded up to the next 2^a 3^b 5^c 7^d length), for the eq1d
+# sweeps (4096 points) and the crack problem (41^3 points, 15 time steps), pad_ratio 0.05.
+#
+# usage: python fft_lengths.py [n_repeat]
+
+torch.manual_seed(0)
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+n_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+pad_ratio = 0.05
+
+cases = [
+    # name, batch size x width, grid
+    ("eq1d 1024",  64 * 64, (1024,)),
+    ("eq1d 4096",  64 * 64, (4096,)),
+    ("crack 3d",    2 * 32, (41, 41, 41)),
+    ("crack 4d",    2 * 32, (41, 41, 41, 15)),
+]
+
+
+def sync():
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def timing(x):
+    # one warm up call, then the average over n_repeat calls
+    dims = list(range(1, x.dim()))
+    for i in range(n_repeat + 1):
+        if i == 1:
+            sync()
+            start = default_timer()
+        torch.fft.irfftn(torch.fft.rfftn(x, dim=dims), s=x.shape[1:], dim=dims)
+    sync()
+    return (default_timer() - start) / n_repeat
+
+
+print("%-10s %-18s %-18s %10s %10s %8s" % ("case", "ratio grid", "fast grid", "ratio", "fast", "speedup"))
+for name, rows, grid in cases:
+    times, grids = [], []
+    for pad_policy in ['ratio', 'fast']:
+        padded = tuple(n + p for n, p in zip(grid, get_pad_nums(grid, pad_ratio, pad_policy)))
+        grids.append("x".join(str(n) for n in padded))
+        times.append(timing(torch.randn(rows, *padded, device=device)))
+    print("%-10s %-18s %-18s %8.2fms %8.2fms %7.2fx" % (name, grids[0], grids[1], 1e3*times[0], 1e3*times[1], times[0]/times[1]))
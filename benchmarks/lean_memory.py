@@ -0,0 +1,59 @@
+import sys
+import torch
+
+sys.path.append('../')
+from models import construct_model
+
+# Memory kept for backward by FNN4d on the crack problem (41^3 points, 16 time
+# steps, eq4d/crack.py) with the plain (lean=False) and the memory-lean
+# (lean=True) Fourier layers.
+#
+# The tensors autograd saves are counted with saved_tensors_hooks, each storage
+# once, so the numbers are exact and the same on CPU and GPU.
+#
+# usage: python lean_memory.py [batch_size ...]
+
+torch.manual_seed(0)
+
+batch_sizes = [int(b) for b in sys.argv[1:]] or [1, 2, 4]
+grid = (41, 41, 41, 16)
+n_fno_layers, k_max, d_f = 3, 12, 32
+
+
+class SavedTensors(object):
+    def __init__(self):
+        self.storages = {}
+
+    def pack(self, t):
+        storage = t.untyped_storage()
+        self.storages[storage.data_ptr()] = storage.nbytes()
+        return t
+
+    def unpack(self, t):
+        return t
+
+    @property
+    def nbytes(self):
+        return sum(self.storages.values())
+
+
+def saved_bytes(model, x):
+    saved = SavedTensors()
+    with torch.autograd.graph.saved_tensors_hooks(saved.pack, saved.unpack):
+        out = model(x)
+    out.sum().backward()
+    return saved.nbytes
+
+
+print("%-6s %14s %14s %8s" % ("batch", "lean=False", "lean=True", "ratio"))
+for batch_size in batch_sizes:
+    x = torch.randn(batch_size, *grid, 1 + len(grid))
+    nbytes = []
+    for lean in [False, True]:
+        config = {"model": {"model": "FNO", "dim": 4, "modes": [k_max] * n_fno_layers, "modes4": [6] * n_fno_layers,
+                            "fc_dim": d_f, "layers": [d_f] * (n_fno_layers + 1),
+                            "in_dim": 1 + len(grid), "out_dim": 1, "act": "gelu", "pad_ratio": 0.05,
+                            "lean": lean}}
+        model = construct_model(config).cpu()
+        nbytes.append(saved_bytes(model, x))
+    print("%-6d %12.1fMB %12.1fMB %7.2fx" % (batch_size, nbytes[0] / 2**20, nbytes[1] / 2**20, nbytes[0] / nbytes[1]))
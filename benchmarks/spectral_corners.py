@@ -0,0 +1,70 @@
+import sys
+import torch
+from timeit import default_timer
+
+sys.path.append('../')
+from models.basics import SpectralConv1d, SpectralConv2d, SpectralConv3d, SpectralConv4d
+
+# Per-corner (fused=False) vs. gather-contract-scatter (fused=True) spectral layers.
+#
+# The shapes follow the sweep scripts: eq1d with 4096 points (pad_ratio 0.05),
+# and the crack problem (eq4d/crack.py) with 41 points per spatial axis and 15
+# time steps, padded by 5%, width 32 and k_max = 12 (6 in time).
+#
+# usage: python spectral_corners.py [n_repeat]
+
+torch.manual_seed(0)
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+n_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+cases = [
+    # name, layer class, batch size, width, grid, modes
+    ("1d eq1d",     SpectralConv1d, 64, 64, (4300,),          (16,)),
+    ("2d",          SpectralConv2d, 16, 32, (128, 128),       (16, 16)),
+    ("3d crack",    SpectralConv3d,  2, 32, (43, 43, 43),     (12, 12, 12)),
+    ("4d crack",    SpectralConv4d,  2, 32, (43, 43, 43, 15), (12, 12, 12, 6)),
+]
+
+
+def sync():
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def timing(layer, x, backward):
+    # one warm up call, then the average over n_repeat calls
+    for i in range(n_repeat + 1):
+        if i == 1:
+            sync()
+            start = default_timer()
+        out = layer(x)
+        if backward:
+            out.sum().backward()
+    sync()
+    return (default_timer() - start) / n_repeat
+
+
+print("%-10s %-10s %12s %12s %8s" % ("case", "pass", "per-corner", "fused", "speedup"))
+for name, Layer, batch_size, width, grid, modes in cases:
+    layer = Layer(width, width, *modes).to(device)
+    x = torch.randn(batch_size, width, *grid, device=device, requires_grad=True)
+
+    with torch.no_grad():
+        layer.fused = False
+        ref = layer(x)
+        layer.fused = True
+        err = (layer(x) - ref).abs().max().item()
+    assert err < 1e-4 * ref.abs().max().item(), name + " : fused and per-corner outputs differ"
+
+    for backward in [False, True]:
+        times = []
+        for fused in [False, True]:
+            layer.fused = fused
+            if backward:
+                times.append(timing(layer, x, True))
+            else:
+                with torch.no_grad():
+                    times.append(timing(layer, x, False))
+        print("%-10s %-10s %10.2fms %10.2fms %7.2fx" % (name, "fwd+bwd" if backward else "fwd",
+                                                         1e3*times[0], 1e3*times[1], times[0]/times[1]))
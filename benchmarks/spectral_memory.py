@@ -0,0 +1,99 @@
+import sys
+import resource
+import multiprocessing as mp
+import torch
+
+sys.path.append('../')
+from models.basics import SpectralConv1d, SpectralConv2d, SpectralConv3d, SpectralConv4d
+
+# Peak memory of one training step (forward + backward) of a spectral layer,
+# per-corner (fused=False) vs. gather-contract-scatter (fused=True) with each
+# contraction backend, on the shapes of spectral_corners.py.
+#
+# saved : bytes saved for backward that are not the weights or the input
+#         themselves (copies of the weights show up here)
+# peak  : on GPU the allocator peak, on CPU the growth of the peak resident set
+#         size over the state before the step (layer, input and torch excluded)
+#
+# Every setting runs in a fresh process.
+#
+# usage: python spectral_memory.py [width] [case ...]
+#        width defaults to 32 (crack); the 4d crack layer needs about 4 GB with width 32
+
+width = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+names = sys.argv[2:]
+
+cases = [
+    # name, layer class, batch size, grid, modes
+    ("1d eq1d",     SpectralConv1d, 64, (4300,),          (16,)),
+    ("2d",          SpectralConv2d, 16, (128, 128),       (16, 16)),
+    ("3d crack",    SpectralConv3d,  2, (43, 43, 43),     (12, 12, 12)),
+    ("4d crack",    SpectralConv4d,  2, (43, 43, 43, 15), (12, 12, 12, 6)),
+]
+
+settings = [
+    # fused, contraction
+    (False, 'einsum'),
+    (True,  'einsum'),
+    (True,  'bmm'),
+    (True,  'gauss'),
+]
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def step(case, fused, contraction, queue):
+    torch.manual_seed(0)
+    name, Layer, batch_size, grid, modes = case
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    layer = Layer(width, width, *modes, fused=fused, contraction=contraction).to(device)
+    x = torch.randn(batch_size, width, *grid, device=device, requires_grad=True)
+    # load the FFT and GEMM kernels on a tiny layer first, they would count as the peak otherwise
+    tiny = Layer(2, 2, *[1] * len(modes), fused=fused, contraction=contraction).to(device)
+    tiny(torch.randn(1, 2, *[4] * len(modes), device=device, requires_grad=True)).sum().backward()
+
+    own = {t.untyped_storage().data_ptr() for t in list(layer.parameters()) + [x]}
+    saved = {}
+    def pack(t):
+        storage = t.untyped_storage()
+        if storage.data_ptr() not in own:
+            saved[storage.data_ptr()] = storage.nbytes()
+        return t
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+        start = torch.cuda.memory_allocated(device)
+    else:
+        start = rss()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        out = layer(x)
+    out.sum().backward()
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated(device) - start
+    else:
+        # ru_maxrss is in kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start
+    queue.put((sum(saved.values()), peak))
+
+
+if __name__ == '__main__':
+    ctx = mp.get_context('spawn')
+    print("width = %d" % width)
+    print("%-10s %-8s %-8s %12s %12s" % ("case", "fused", "backend", "saved", "peak"))
+    for case in cases:
+        if names and case[0].split()[0] not in names:
+            continue
+        for fused, contraction in settings:
+            queue = ctx.Queue()
+            process = ctx.Process(target=step, args=(case, fused, contraction, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print("%-10s %-8s %-8s %12s" % (case[0], fused, contraction if fused else '-', "failed"))
+                continue
+            saved, peak = queue.get()
+            print("%-10s %-8s %-8s %10.1fMB %10.1fMB" % (case[0], fused, contraction if fused else '-',
+                                                       saved / 2**20, peak / 2**20))
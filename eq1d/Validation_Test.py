@@ -8,7 +8,7 @@ np.random.seed(0)
 
 
 sys.path.append('../')
-from models import FNN1d, FNN1d_train, FNN1d_cost, UnitGaussianNormalizer, LpLoss
+from models import FNN1d, FNN_cost, UnitGaussianNormalizer, LpMetrics, normalizer_from_state
 
 
 def test(x_train, y_train, x_test, y_test, model_prefix, config, downsample_ratio, n_fno_layers, k_max, d_f):
@@ -30,36 +30,50 @@ def test(x_train, y_train, x_test, y_test, model_prefix, config, downsample_rati
     test_l2_losses =[]
     
     
+    # models with grid_channels generate the grid themselves
+    n_grid = len(getattr(model, 'grid_channels', None) or ())
+    if n_grid > 0:
+        x_train, x_test = x_train[..., :-n_grid], x_test[..., :-n_grid]
+
+    # models trained with fold_normalizer map raw inputs to raw outputs
+    normalization = normalization and getattr(model, 'x_scale', None) is None and getattr(model, 'y_scale', None) is None
+    
     if normalization:
-        x_normalizer = UnitGaussianNormalizer(x_train, dim=dim)
+        states = getattr(model, 'normalizer_states', None)
+        if states is not None and states['x'] is not None and states['y'] is not None:
+            # the statistics the model was trained with, recorded by FNN_train
+            x_normalizer, y_normalizer = normalizer_from_state(states['x']), normalizer_from_state(states['y'])
+        else:
+            x_normalizer = UnitGaussianNormalizer(x_train, dim=dim)
+            y_normalizer = UnitGaussianNormalizer(y_train, dim=dim)
+
         x_train = x_normalizer.encode(x_train)
         x_test = x_normalizer.encode(x_test)
         x_normalizer.to(device)
 
-        y_normalizer = UnitGaussianNormalizer(y_train, dim=dim)
         y_train = y_normalizer.encode(y_train)
         y_test = y_normalizer.encode(y_test)
         y_normalizer.to(device)
 
 
 
-    myloss = LpLoss(d=1, p=2, size_average=False)
+    # per-sample errors stay on the device until the whole test set is done
+    metrics = LpMetrics(d=1, p=2, device=device, per_sample=True)
     
-    test_l2 = np.zeros(n_test)
-    test_rel_l2 = np.zeros(n_test)
-    
-    for i in range(n_test):
-        x, y = x_test[i:i+1,:, :], y_test[i:i+1,:, :]
-        x, y = x.to(device), y.to(device)
-        
-        out = model(x) #.reshape(1,  -1)
+    with torch.no_grad():
+        for i in range(n_test):
+            x, y = x_test[i:i+1,:, :], y_test[i:i+1,:, :]
+            x, y = x.to(device), y.to(device)
+            
+            out = model(x) #.reshape(1,  -1)
+
+            if normalization:
+                out = y_normalizer.decode(out)
+                y = y_normalizer.decode(y)
 
-        if normalization:
-            out = y_normalizer.decode(out)
-            y = y_normalizer.decode(y)
+            metrics.update(out.view(1,-1), y.view(1,-1))
 
-        test_rel_l2[i] = myloss(out.view(1,-1), y.view(1,-1)).item()
-        test_l2[i] = myloss.abs(out.view(1,-1), y.view(1,-1)).item()
+    test_rel_l2, test_l2 = metrics.errors()
 
     test_l2_mean, test_l2_cov = np.mean(test_l2), np.cov(test_l2)
     test_rel_l2_mean, test_rel_l2_cov = np.mean(test_rel_l2), np.cov(test_rel_l2)
@@ -133,7 +147,7 @@ for n_train in n_data_array:
 
                         
                         data_analysis[i_data_analysis, 4*i_test_set:4*(i_test_set+1)] = test(x_train, y_train, x_test, y_test, model_prefix, config, downsample_ratio, n_fno_layers, k_max, d_f)
-                        cost = FNN1d_cost(x_test.shape[1], config)
+                        cost = FNN_cost(x_test.shape[1], config, 1)
     
                     data_analysis[i_data_analysis, 4*n_test_sets:4*n_test_sets+6] =  n_train, downsample_ratio, n_fno_layers, k_max, d_f, cost
                     i_data_analysis += 1
@@ -213,7 +227,7 @@ for n_train in n_data_array:
 
                         
                         data_analysis[i_data_analysis, 4*i_test_set:4*(i_test_set+1)] = test(x_train, y_train, x_test, y_test, model_prefix, config, downsample_ratio, n_fno_layers, k_max, d_f)
-                        cost = FNN1d_cost(x_test.shape[1], config)
+                        cost = FNN_cost(x_test.shape[1], config, 1)
     
                     data_analysis[i_data_analysis, 4*n_test_sets:4*n_test_sets+6] =  n_train, downsample_ratio, n_fno_layers, k_max, d_f, cost
                     i_data_analysis += 1
@@ -8,23 +8,16 @@ np.random.seed(0)
 
 
 sys.path.append('../')
-from models import FNN1d, FNN_train
+from models import FNN1d, FNN_train, cached_fields, cached_normalizer
 
 prefix = "/central/groups/esm/dzhuang/cost-accuracy-data/"
 
 N_chunk = 16
-chunk_size, Ne = np.load(prefix+"KS_fs_1.npy").shape
-KS_input = np.zeros((chunk_size*N_chunk, Ne+1))
-KS_output = np.zeros((chunk_size*N_chunk, Ne+1))
-
-for i in range(N_chunk):
-    KS_input[chunk_size*i:chunk_size*(i+1), 0:Ne] = np.load(prefix+"KS_fs_"+str(i+1)+".npy")
-    KS_output[chunk_size*i:chunk_size*(i+1), 0:Ne] = np.load(prefix+"KS_auto_correlation_"+str(i+1)+".npy")
-
-KS_input[:, Ne] = KS_input[:, 0]
-KS_output[:, Ne] = KS_output[:, 0]
-
-print(KS_output.shape)
+# float32 training arrays, built once from the memory mapped chunks by the first job that needs them,
+# the periodic point Ne is the copy of point 0
+cache_dir = prefix+"cache/"
+KS_input = [prefix+"KS_fs_"+str(i+1)+".npy" for i in range(N_chunk)]
+KS_output = [prefix+"KS_auto_correlation_"+str(i+1)+".npy" for i in range(N_chunk)]
 
 
 
@@ -84,20 +77,15 @@ for n_data in n_data_array:
                         n_train = n_data
                          
                         
-                        if GRID_OR_NOT:
-                            x_train = torch.from_numpy(np.stack((KS_input[0:n_train, 0::downsample_ratio], np.tile(grid, (n_train,1))), axis=-1).astype(np.float32))
-                            x_test = torch.from_numpy(np.stack((KS_input[-n_test:, 0::downsample_ratio], np.tile(grid, (n_test,1))), axis=-1).astype(np.float32))
-                            in_dim = 2
-                        else:
-                            x_train = torch.from_numpy(KS_input[0:n_train, 0::downsample_ratio, np.newaxis].astype(np.float32))
-                            x_test = torch.from_numpy(KS_input[-n_test:, 0::downsample_ratio, np.newaxis].astype(np.float32))
-                            in_dim = 1
+                        x_train = torch.from_numpy(cached_fields(cache_dir, [KS_input], 0, n_train, downsample_ratio, periodic=True))
+                        x_test = torch.from_numpy(cached_fields(cache_dir, [KS_input], -n_test, None, downsample_ratio, periodic=True))
+                        # the model adds the grid channel itself
+                        grid_channels = [[0, L]] if GRID_OR_NOT else None
+                        in_dim = 2 if GRID_OR_NOT else 1
     
-                        #x_train = torch.from_numpy(np.stack((KS_input[0:n_train, 0::downsample_ratio], np.tile(grid, (n_train,1))), axis=-1).astype(np.float32))
-                        y_train = torch.from_numpy(KS_output[0:n_train, 0::downsample_ratio, np.newaxis].astype(np.float32))
+                        y_train = torch.from_numpy(cached_fields(cache_dir, [KS_output], 0, n_train, downsample_ratio, periodic=True))
                         # x_train, y_train are [n_data, n_x, n_channel] arrays
-                        #x_test = torch.from_numpy(np.stack((KS_input[-n_test:, 0::downsample_ratio], np.tile(grid, (n_test,1))), axis=-1).astype(np.float32))
-                        y_test = torch.from_numpy(KS_output[-n_test:, 0::downsample_ratio, np.newaxis].astype(np.float32))
+                        y_test = torch.from_numpy(cached_fields(cache_dir, [KS_output], -n_test, None, downsample_ratio, periodic=True))
                         # x_test, y_test are [n_data, n_x, n_channel] arrays
 
 
@@ -113,13 +101,20 @@ for n_data in n_data_array:
 
                         
 
+                        # statistics of the training set, computed once and shared by all the jobs
+                        x_normalizer = cached_normalizer(cache_dir, [KS_input], 0, n_train, downsample_ratio, periodic=True, dim=normalization_dim,
+                                                         grid_channels=grid_channels)
+                        y_normalizer = cached_normalizer(cache_dir, [KS_output], 0, n_train, downsample_ratio, periodic=True, dim=normalization_dim)
+
                         config = {"model" : {"modes": modes, "fc_dim": fc_dim, "layers": layers, "in_dim": in_dim,
-                                             "out_dim":out_dim, "act": act, "pad_ratio":pad_ratio},
+                                             "out_dim":out_dim, "act": act, "pad_ratio":pad_ratio,
+                                             "grid_channels": grid_channels},
                                   "train" : {"base_lr": base_lr, "weight_decay": weight_decay, "epochs": epochs,
                                              "scheduler": scheduler, "milestones": milestones, 
                                              "scheduler_gamma":scheduler_gamma, "batch_size": batch_size,
                                              "normalization_x": normalization_x,"normalization_y": normalization_y,
-                                             "normalization_dim": normalization_dim}}
+                                             "normalization_dim": normalization_dim,
+                                             "x_normalizer": x_normalizer, "y_normalizer": y_normalizer}}
 
                         train_rel_l2_losses, test_rel_l2_losses, test_l2_losses, cost = FNN_train(x_train, y_train, x_test, y_test, config, save_model_name=prefix+"models/KS_FNO_"+str(i_train_repeat)+"_"+setup_info)
                         
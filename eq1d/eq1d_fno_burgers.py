@@ -8,24 +8,16 @@ np.random.seed(0)
 
 
 sys.path.append('../')
-from models import FNN1d, FNN_train
+from models import FNN1d, FNN_train, cached_fields, cached_normalizer
 
 prefix = "/central/groups/esm/dzhuang/cost-accuracy-data/"
 
 N_chunk = 16
 
-chunk_size, Np = np.load(prefix+"burgers_us_1.npy").shape
-print("chunk_size, Np = ", chunk_size, Np)
-Ne = Np - 1
-burgers_input = np.zeros((chunk_size*N_chunk, Ne+1))
-burgers_output = np.zeros((chunk_size*N_chunk, Ne+1))
-
-for i in range(N_chunk):
-    burgers_input[chunk_size*i:chunk_size*(i+1), :] = np.load(prefix+"burgers_u0s_"+str(i+1)+".npy")
-    burgers_output[chunk_size*i:chunk_size*(i+1), :] = np.load(prefix+"burgers_us_"+str(i+1)+".npy")
-
-
-print(burgers_output.shape)
+# float32 training arrays, built once from the chunks by the first job that needs them
+cache_dir = prefix+"cache/"
+burgers_input = [prefix+"burgers_u0s_"+str(i+1)+".npy" for i in range(N_chunk)]
+burgers_output = [prefix+"burgers_us_"+str(i+1)+".npy" for i in range(N_chunk)]
 
 
 
@@ -84,15 +76,15 @@ for n_data in n_data_array:
                         n_train = n_data
                          
                         # x_train = torch.from_numpy(np.stack((burgers_input[0:n_train, 0::downsample_ratio], np.tile(grid, (n_train,1))), axis=-1).astype(np.float32))
-                        x_train = torch.from_numpy(burgers_input[0:n_train, 0::downsample_ratio, np.newaxis].astype(np.float32))
+                        x_train = torch.from_numpy(cached_fields(cache_dir, [burgers_input], 0, n_train, downsample_ratio))
 
 
 
-                        y_train = torch.from_numpy(burgers_output[0:n_train, 0::downsample_ratio, np.newaxis].astype(np.float32))
+                        y_train = torch.from_numpy(cached_fields(cache_dir, [burgers_output], 0, n_train, downsample_ratio))
                         # x_train, y_train are [n_data, n_x, n_channel] arrays
                         # x_test = torch.from_numpy(np.stack((burgers_input[-n_test:, 0::downsample_ratio], np.tile(grid, (n_test,1))), axis=-1).astype(np.float32))
-                        x_test = torch.from_numpy(burgers_input[-n_test:, 0::downsample_ratio, np.newaxis].astype(np.float32))
-                        y_test = torch.from_numpy(burgers_output[-n_test:, 0::downsample_ratio, np.newaxis].astype(np.float32))
+                        x_test = torch.from_numpy(cached_fields(cache_dir, [burgers_input], -n_test, None, downsample_ratio))
+                        y_test = torch.from_numpy(cached_fields(cache_dir, [burgers_output], -n_test, None, downsample_ratio))
                         # x_test, y_test are [n_data, n_x, n_channel] arrays
 
 
@@ -109,13 +101,18 @@ for n_data in n_data_array:
 
                         
 
+                        # statistics of the training set, computed once and shared by all the jobs
+                        x_normalizer = cached_normalizer(cache_dir, [burgers_input], 0, n_train, downsample_ratio, dim=normalization_dim)
+                        y_normalizer = cached_normalizer(cache_dir, [burgers_output], 0, n_train, downsample_ratio, dim=normalization_dim)
+
                         config = {"model" : {"modes": modes, "fc_dim": fc_dim, "layers": layers, "in_dim": in_dim,
                                              "out_dim":out_dim, "act": act, "pad_ratio":pad_ratio},
                                   "train" : {"base_lr": base_lr, "weight_decay": weight_decay, "epochs": epochs,
                                              "scheduler": scheduler, "milestones": milestones, 
                                              "scheduler_gamma":scheduler_gamma, "batch_size": batch_size,
                                              "normalization_x": normalization_x,"normalization_y": normalization_y,
-                                             "normalization_dim": normalization_dim}}
+                                             "normalization_dim": normalization_dim,
+                                             "x_normalizer": x_normalizer, "y_normalizer": y_normalizer}}
 
                         train_rel_l2_losses, test_rel_l2_losses, test_l2_losses, cost = FNN_train(x_train, y_train, x_test, y_test, config, save_model_name=prefix+"models/burgers_FNO_"+str(i_train_repeat)+"_"+setup_info)
                         
@@ -7,11 +7,13 @@ torch.manual_seed(0)
 np.random.seed(0)
 
 sys.path.append('../')
-from models import FNN1d, FNN_train
+from models import FNN1d, FNN_train, cached_fields, cached_normalizer
 prefix = "/central/groups/esm/dzhuang/cost-accuracy-data/"
-heat_u0s    = np.load(prefix+"heat_u0.npy")
-heat_fs     = np.load(prefix+"heat_f.npy")
-heat_us_ref = np.load(prefix+"heat_u.npy")
+# float32 training arrays, built once by the first job that needs them
+cache_dir = prefix+"cache/"
+heat_u0s    = prefix+"heat_u0.npy"
+heat_fs     = prefix+"heat_f.npy"
+heat_us_ref = prefix+"heat_u.npy"
 
 
 
@@ -63,10 +65,10 @@ for n_data in n_data_array:
                         grid = np.linspace(0, L, Ne+1)
                         M = 2**15
                         n_train = n_test = n_data
-                        x_train = torch.from_numpy(np.stack((heat_u0s[0:n_train, 0::downsample_ratio], heat_fs[0:n_train, 0::downsample_ratio], np.tile(grid, (n_train,1))), axis=-1).astype(np.float32))
-                        y_train = torch.from_numpy(heat_us_ref[0:n_train, 0::downsample_ratio, np.newaxis].astype(np.float32))
-                        x_test = torch.from_numpy(np.stack((heat_u0s[M//2:M//2+n_test, 0::downsample_ratio], heat_fs[M//2:M//2+n_test, 0::downsample_ratio], np.tile(grid, (n_test,1))), axis=-1).astype(np.float32))
-                        y_test = torch.from_numpy(heat_us_ref[M//2:M//2+n_test, 0::downsample_ratio, np.newaxis].astype(np.float32))
+                        x_train = torch.from_numpy(cached_fields(cache_dir, [heat_u0s, heat_fs], 0, n_train, downsample_ratio))
+                        y_train = torch.from_numpy(cached_fields(cache_dir, [heat_us_ref], 0, n_train, downsample_ratio))
+                        x_test = torch.from_numpy(cached_fields(cache_dir, [heat_u0s, heat_fs], M//2, M//2+n_test, downsample_ratio))
+                        y_test = torch.from_numpy(cached_fields(cache_dir, [heat_us_ref], M//2, M//2+n_test, downsample_ratio))
 
                         # x_test, y_test are [n_data, n_x, n_channel] arrays
 
@@ -84,13 +86,20 @@ for n_data in n_data_array:
 
                         
 
+                        # statistics of the training set, computed once and shared by all the jobs
+                        x_normalizer = cached_normalizer(cache_dir, [heat_u0s, heat_fs], 0, n_train, downsample_ratio, dim=normalization_dim,
+                                                         grid_channels=[[0, L]])
+                        y_normalizer = cached_normalizer(cache_dir, [heat_us_ref], 0, n_train, downsample_ratio, dim=normalization_dim)
+
                         config = {"model" : {"modes": modes, "fc_dim": fc_dim, "layers": layers, "in_dim": in_dim,
-                                             "out_dim":out_dim, "act": act, "pad_ratio":pad_ratio},
+                                             "out_dim":out_dim, "act": act, "pad_ratio":pad_ratio,
+                                             "grid_channels": [[0, L]]},
                                   "train" : {"base_lr": base_lr, "weight_decay": weight_decay, "epochs": epochs,
                                              "scheduler": scheduler, "milestones": milestones, 
                                              "scheduler_gamma":scheduler_gamma, "batch_size": batch_size,
                                              "normalization_x": normalization_x,"normalization_y": normalization_y,
-                                             "normalization_dim": normalization_dim}}
+                                             "normalization_dim": normalization_dim,
+                                             "x_normalizer": x_normalizer, "y_normalizer": y_normalizer}}
                         
                         
 
@@ -38,10 +38,6 @@ dataset2 = sio.loadmat(pref + "dataset_uniform2.mat")
 dataset3 = sio.loadmat(pref + "dataset_uniform3.mat")
 
 nq = 41
-xx = np.linspace(-0.1, 0.1, nq)
-yy = np.linspace(-0.1, 0.1, nq)
-zz = np.linspace(-0.1, 0.1, nq)
-[yq,xq,zq] = np.meshgrid(xx,yy,zz)
 
 
 # In[4]:
@@ -53,20 +49,17 @@ T = 1.0
 nt = phi.shape[2]
 phi_data = phi.reshape((ndata, nq, nq, nq, nt), order="F")
 
-coord_data  = np.zeros((nq, nq, nq, nt, 4),  dtype="float64")
-for i in range(nt):
-    coord_data[:,:,:,i,0] = xq
-    coord_data[:,:,:,i,1] = yq
-    coord_data[:,:,:,i,2] = zq
-    coord_data[:,:,:,i,3] = i/nt * T
-    
+# the coordinates x, y, z in [-0.1, 0.1] (and t = i/nt * T, i = 1, ..., nt-1) are generated
+# by the model (grid_channels), the data only stores phi
+grid_channels = [[-0.1, 0.1]] * 3
 
 if FNO_dim == 3:
-    input_data = np.concatenate((phi_data[:, :, :, :, 0:1], np.tile(coord_data[:, :, :, 0, 0:3], (ndata,1,1,1,1))), axis=-1)
+    input_data = phi_data[:, :, :, :, 0:1]
     output_data = phi_data[:, :, :, :, nt-1:nt]
 elif FNO_dim == 4:
-    input_data = np.concatenate((np.tile(phi_data[:, :, :, :, 0:1], (1,1,1,1,nt-1))[..., np.newaxis], np.tile(coord_data[:, :, :, 1:nt, :], (ndata,1,1,1,1,1))), axis=-1)
+    input_data = np.tile(phi_data[:, :, :, :, 0:1], (1,1,1,1,nt-1))[..., np.newaxis]
     output_data = phi_data[:, :, :, :, 1:nt, np.newaxis]
+    grid_channels += [[1/nt * T, (nt-1)/nt * T]]
   
 
 
@@ -121,7 +114,7 @@ normalization_y = True
 normalization_dim = []
 
 
-config = {"model" : {"modes": modes, "modes4": modes4, "fc_dim": fc_dim, "layers": layers, "in_dim": in_dim, "out_dim":out_dim, "act": act, "pad_ratio":pad_ratio},
+config = {"model" : {"modes": modes, "modes4": modes4, "fc_dim": fc_dim, "layers": layers, "in_dim": in_dim, "out_dim":out_dim, "act": act, "pad_ratio":pad_ratio, "grid_channels": grid_channels},
           "train" : {"base_lr": base_lr, "weight_decay": weight_decay, "epochs": epochs, "scheduler": scheduler, "milestones": milestones, "scheduler_gamma": scheduler_gamma, "batch_size": batch_size, 
                     "normalization_x": normalization_x,"normalization_y": normalization_y, "normalization_dim": normalization_dim}}
 
@@ -3,8 +3,12 @@ from .fourier1d import FNN1d
 from .fourier2d import FNN2d
 from .fourier3d import FNN3d
 from .fourier4d import FNN4d
-from .train import FNN_train, FNN_cost,  construct_model
+from .train import FNN_train, FNN_cost,  construct_model, probe_batch_size
 from .utils import count_params, compute_1dFourier_bases, compute_2dFourier_bases
 from .adam import Adam
-from .losses import LpLoss
-from .normalizer import UnitGaussianNormalizer
\ No newline at end of file
+from .losses import LpLoss, LpMetrics
+from .normalizer import UnitGaussianNormalizer, StreamingGaussianNormalizer, normalizer_from_state
+from .data import TensorBatchLoader, Prefetcher, ChunkedDataset
+from .cache import cached_fields, cached_normalizer
+from .spectral import set_contraction
+from .checkpoint import CheckpointWriter, latest_checkpoint
\ No newline at end of file
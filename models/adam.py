@@ -51,6 +51,137 @@ def adam(params: List[Tensor],
         param.addcdiv_(exp_avg, denom, value=-step_size)
 
 
+def _multi_tensor_adam(params: List[Tensor],
+                       grads: List[Tensor],
+                       exp_avgs: List[Tensor],
+                       exp_avg_sqs: List[Tensor],
+                       max_exp_avg_sqs: List[Tensor],
+                       state_steps: List[int],
+                       *,
+                       amsgrad: bool,
+                       beta1: float,
+                       beta2: float,
+                       lr: float,
+                       weight_decay: float,
+                       eps: float):
+    r"""Multi-tensor (torch._foreach_*) version of :func:`adam`, same update.
+    Weight decay and the first moment are elementwise linear, so they run on
+    real views of all parameters, real and complex, in one call each. The
+    second moment of a complex parameter is |grad|^2, shared by its real and
+    imaginary parts, so the second moment and the parameter update run on
+    the tensors themselves, one call per (device, dtype).
+    """
+    if len(params) == 0:
+        return
+
+    def real(tensors):
+        return [torch.view_as_real(t) if t.is_complex() else t for t in tensors]
+
+    if weight_decay != 0:
+        grads_real = torch._foreach_add(real(grads), real(params), alpha=weight_decay)
+        grads = [torch.view_as_complex(g) if p.is_complex() else g for g, p in zip(grads_real, params)]
+    else:
+        grads_real = real(grads)
+
+    # Decay the first moment running average coefficient
+    exp_avgs_real = real(exp_avgs)
+    torch._foreach_mul_(exp_avgs_real, beta1)
+    torch._foreach_add_(exp_avgs_real, grads_real, alpha=1 - beta1)
+
+    groups = {}
+    for i, param in enumerate(params):
+        groups.setdefault((param.device, param.dtype), []).append(i)
+
+    for indices in groups.values():
+        group_params = [params[i] for i in indices]
+        group_grads = [grads[i] for i in indices]
+        group_exp_avgs = [exp_avgs[i] for i in indices]
+        group_exp_avg_sqs = [exp_avg_sqs[i] for i in indices]
+        bias_correction1 = [1 - beta1 ** state_steps[i] for i in indices]
+        bias_correction2 = [1 - beta2 ** state_steps[i] for i in indices]
+
+        # Decay the second moment running average coefficient
+        torch._foreach_mul_(group_exp_avg_sqs, beta2)
+        torch._foreach_addcmul_(group_exp_avg_sqs, group_grads, [g.conj() for g in group_grads], value=1 - beta2)
+        if amsgrad:
+            # Maintains the maximum of all 2nd moment running avg. till now
+            for i in indices:
+                torch.maximum(max_exp_avg_sqs[i], exp_avg_sqs[i], out=max_exp_avg_sqs[i])
+            denom = torch._foreach_sqrt([max_exp_avg_sqs[i] for i in indices])
+        else:
+            denom = torch._foreach_sqrt(group_exp_avg_sqs)
+        torch._foreach_div_(denom, [math.sqrt(bc) for bc in bias_correction2])
+        torch._foreach_add_(denom, eps)
+
+        torch._foreach_addcdiv_(group_params, group_exp_avgs, denom, [-lr / bc for bc in bias_correction1])
+
+
+def _reduced_adam(params: List[Tensor],
+                  grads: List[Tensor],
+                  exp_avgs: List[Tensor],
+                  exp_avg_sqs: List[Tensor],
+                  exp_avg_sq_factors: List[List[Tensor]],
+                  state_steps: List[int],
+                  *,
+                  beta1: float,
+                  beta2: float,
+                  lr: float,
+                  weight_decay: float,
+                  eps: float):
+    r"""Adam with the memory-reduced state of :class:`Adam` (factored, exp_avg_dtype).
+    exp_avgs are real views (..., 2) of complex moments, possibly in a lower
+    precision; the update runs in the precision of the gradient. The second
+    moment |grad|^2 is real. A parameter with factors keeps, for every axis k,
+    the running mean r_k of |grad|^2 over all other axes, and the second
+    moment is rebuilt as the rank one product S prod_k (r_k / S), S the mean
+    of |grad|^2 (Adafactor's row/column estimate for matrices); otherwise
+    exp_avg_sqs holds the full (real) second moment.
+    """
+    for i, param in enumerate(params):
+
+        grad = grads[i]
+        step = state_steps[i]
+
+        bias_correction1 = 1 - beta1 ** step
+        bias_correction2 = 1 - beta2 ** step
+
+        if weight_decay != 0:
+            grad = grad.add(param, alpha=weight_decay)
+
+        param_real = torch.view_as_real(param) if param.is_complex() else param
+        grad_real = torch.view_as_real(grad) if grad.is_complex() else grad
+
+        # Decay the first moment running average coefficient, in the precision of the gradient
+        exp_avg = exp_avgs[i].to(grad_real.dtype)
+        exp_avg.mul_(beta1).add_(grad_real, alpha=1 - beta1)
+        if exp_avg is not exp_avgs[i]:
+            exp_avgs[i].copy_(exp_avg)
+
+        # |grad|^2, the tiny offset keeps the factors of a zero gradient positive
+        grad_sq = grad.abs().square_().add_(1e-30) if grad.is_complex() else grad.square().add_(1e-30)
+        factors = exp_avg_sq_factors[i]
+        if factors:
+            for k, factor in enumerate(factors):
+                factor.mul_(beta2).add_(grad_sq.mean([j for j in range(grad_sq.dim()) if j != k]), alpha=1 - beta2)
+            mean = factors[0].mean()
+            exp_avg_sq = mean.expand(grad_sq.shape)
+            for k, factor in enumerate(factors):
+                shape = [1] * grad_sq.dim()
+                shape[k] = -1
+                exp_avg_sq = exp_avg_sq * (factor / mean).view(shape)
+        else:
+            exp_avg_sq = exp_avg_sqs[i]
+            exp_avg_sq.mul_(beta2).add_(grad_sq, alpha=1 - beta2)
+
+        denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(eps)
+        if param.is_complex():
+            denom = denom.unsqueeze(-1)
+
+        step_size = lr / bias_correction1
+
+        param_real.addcdiv_(exp_avg, denom, value=-step_size)
+
+
 class Adam(Optimizer):
     r"""Implements Adam algorithm.
     It has been proposed in `Adam: A Method for Stochastic Optimization`_.
@@ -68,6 +199,16 @@ class Adam(Optimizer):
         amsgrad (boolean, optional): whether to use the AMSGrad variant of this
             algorithm from the paper `On the Convergence of Adam and Beyond`_
             (default: False)
+        foreach (boolean, optional): whether to update all parameters of a
+            group with multi-tensor torch._foreach_* kernels instead of a
+            python loop over the parameters (default: False)
+        factored (boolean, optional): whether to store the second moment of
+            parameters with two or more axes as one factor per axis (the
+            running means of |grad|^2 over the other axes) instead of a
+            tensor of the size of the parameter (default: False)
+        exp_avg_dtype (torch.dtype, optional): storage dtype of the first
+            moment, e.g. torch.bfloat16; complex moments are stored as real
+            views (default: None, the dtype of the parameter)
     .. _Adam\: A Method for Stochastic Optimization:
         https://arxiv.org/abs/1412.6980
     .. _Decoupled Weight Decay Regularization:
@@ -77,7 +218,7 @@ class Adam(Optimizer):
     """
 
     def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8,
-                 weight_decay=0, amsgrad=False):
+                 weight_decay=0, amsgrad=False, foreach=False, factored=False, exp_avg_dtype=None):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
         if not 0.0 <= eps:
@@ -88,14 +229,20 @@ class Adam(Optimizer):
             raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
         if not 0.0 <= weight_decay:
             raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if (factored or exp_avg_dtype is not None) and (amsgrad or foreach):
+            raise ValueError("factored and exp_avg_dtype support neither amsgrad nor foreach")
         defaults = dict(lr=lr, betas=betas, eps=eps,
-                        weight_decay=weight_decay, amsgrad=amsgrad)
+                        weight_decay=weight_decay, amsgrad=amsgrad, foreach=foreach,
+                        factored=factored, exp_avg_dtype=exp_avg_dtype)
         super(Adam, self).__init__(params, defaults)
 
     def __setstate__(self, state):
         super(Adam, self).__setstate__(state)
         for group in self.param_groups:
             group.setdefault('amsgrad', False)
+            group.setdefault('foreach', False)
+            group.setdefault('factored', False)
+            group.setdefault('exp_avg_dtype', None)
 
     @torch.no_grad()
     def step(self, closure=None):
@@ -115,8 +262,10 @@ class Adam(Optimizer):
             exp_avgs = []
             exp_avg_sqs = []
             max_exp_avg_sqs = []
+            exp_avg_sq_factors = []
             state_steps = []
             beta1, beta2 = group['betas']
+            reduced = group['factored'] or group['exp_avg_dtype'] is not None
 
             for p in group['params']:
                 if p.grad is not None:
@@ -127,7 +276,19 @@ class Adam(Optimizer):
 
                     state = self.state[p]
                     # Lazy state initialization
-                    if len(state) == 0:
+                    if len(state) == 0 and reduced:
+                        state['step'] = 0
+                        p_real = torch.view_as_real(p) if p.is_complex() else p
+                        # Exponential moving average of gradient values, as real view
+                        state['exp_avg'] = torch.zeros_like(p_real, dtype=group['exp_avg_dtype'] or p_real.dtype)
+                        # Exponential moving average of squared gradient values, real, full or one factor per axis
+                        if group['factored'] and p.dim() >= 2:
+                            state['exp_avg_sq'] = None
+                            state['exp_avg_sq_factors'] = [p_real.new_zeros(n) for n in p.shape]
+                        else:
+                            state['exp_avg_sq'] = torch.zeros_like(p_real[..., 0] if p.is_complex() else p_real)
+                            state['exp_avg_sq_factors'] = []
+                    elif len(state) == 0:
                         state['step'] = 0
                         # Exponential moving average of gradient values
                         state['exp_avg'] = torch.zeros_like(p, memory_format=torch.preserve_format)
@@ -137,8 +298,14 @@ class Adam(Optimizer):
                             # Maintains max of all exp. moving avg. of sq. grad. values
                             state['max_exp_avg_sq'] = torch.zeros_like(p, memory_format=torch.preserve_format)
 
+                    if reduced and group['exp_avg_dtype'] is not None and state['exp_avg'].dtype != group['exp_avg_dtype']:
+                        # load_state_dict casts the state to the dtype of real parameters
+                        state['exp_avg'] = state['exp_avg'].to(group['exp_avg_dtype'])
+
                     exp_avgs.append(state['exp_avg'])
                     exp_avg_sqs.append(state['exp_avg_sq'])
+                    if reduced:
+                        exp_avg_sq_factors.append(state['exp_avg_sq_factors'])
 
                     if group['amsgrad']:
                         max_exp_avg_sqs.append(state['max_exp_avg_sq'])
@@ -148,16 +315,31 @@ class Adam(Optimizer):
                     # record the step after step update
                     state_steps.append(state['step'])
 
-            adam(params_with_grad,
-                 grads,
-                 exp_avgs,
-                 exp_avg_sqs,
-                 max_exp_avg_sqs,
-                 state_steps,
-                 amsgrad=group['amsgrad'],
-                 beta1=beta1,
-                 beta2=beta2,
-                 lr=group['lr'],
-                 weight_decay=group['weight_decay'],
-                 eps=group['eps'])
+            if reduced:
+                _reduced_adam(params_with_grad,
+                              grads,
+                              exp_avgs,
+                              exp_avg_sqs,
+                              exp_avg_sq_factors,
+                              state_steps,
+                              beta1=beta1,
+                              beta2=beta2,
+                              lr=group['lr'],
+                              weight_decay=group['weight_decay'],
+                              eps=group['eps'])
+                continue
+
+            update = _multi_tensor_adam if group['foreach'] else adam
+            update(params_with_grad,
+                   grads,
+                   exp_avgs,
+                   exp_avg_sqs,
+                   max_exp_avg_sqs,
+                   state_steps,
+                   amsgrad=group['amsgrad'],
+                   beta1=beta1,
+                   beta2=beta2,
+                   lr=group['lr'],
+                   weight_decay=group['weight_decay'],
+                   eps=group['eps'])
         return loss
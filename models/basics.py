@@ -2,6 +2,8 @@ import numpy as np
 
 import torch
 import torch.nn as nn
+from .spectral import spectral_mul, workspace, choose_transform, dft_mul, contract, lean_spectral, \
+    spatial_dims, spatial_sizes, channels_first, spectrum_shape, pack_weights, corner_weights
 
 
 @torch.jit.script
@@ -28,13 +30,87 @@ def compl_mul4d(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
     # (batch, in_channel, x,y,t ), (in_channel, out_channel, x,y,t) -> (batch, out_channel, x,y,t)
     res = torch.einsum("bixyzt,ioxyzt->boxyzt", a, b)
     return res
+
+
+################################################################
+# fourier layers
+################################################################
+
+
+class _SpectralConv(nn.Module):
+    # class-level defaults, so that modules pickled before an option existed still run
+    fused = True
+    contraction = 'einsum'
+    lean = False
+    channels_last = False
+
+    # The weights are one mode-major parameter (2*m_1 * ... * 2*m_{d-1} * m_d, in_channel, out_channel),
+    # in the layout of the gathered corners (see spectral.pack_weights), the corner weights
+    # weights1, weights2, ... (in_channel, out_channel, m_1, ..., m_d) are views of it.
+
+    def _corner_names(self):
+        return ['weights%d' % (k + 1) for k in range(2 ** (self.ndim - 1))]
+
+    def __getattr__(self, name):
+        # weights1, weights2, ...: views of the corners of weights
+        if name[:7] == 'weights' and name[7:].isdigit() and 'weights' in self.__dict__.get('_parameters', {}):
+            corners = corner_weights(self._parameters['weights'], self.modes)
+            if 0 < int(name[7:]) <= len(corners):
+                return corners[int(name[7:]) - 1]
+        return super().__getattr__(name)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # state_dicts saved with one parameter per corner
+        names = [prefix + name for name in self._corner_names()]
+        if prefix + 'weights' not in state_dict and all(name in state_dict for name in names):
+            state_dict[prefix + 'weights'] = pack_weights([state_dict.pop(name) for name in names], self.modes, mode_major=True)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def __setstate__(self, state):
+        # modules pickled with one parameter per corner
+        super().__setstate__(state)
+        names = self._corner_names()
+        if names[0] in self._parameters:
+            corners = [self._parameters.pop(name).data for name in names]
+            self.weights = nn.Parameter(pack_weights(corners, self.modes, mode_major=True))
+
+    @property
+    def modes(self):
+        return tuple(getattr(self, 'modes%d' % (k + 1)) for k in range(self.ndim))
+
+    def _spectral(self, x, weights, modes):
+        # x: (batch, in_channel, n_1, ..., n_d), or (batch, n_1, ..., n_d, in_channel) if self.channels_last
+        channels_last = self.channels_last
+        if self.lean and torch.is_grad_enabled():
+            # save only the retained input modes for backward (see spectral.lean_spectral)
+            return lean_spectral(x, modes, lambda block: contract(block, weights, modes, self.contraction), [weights],
+                                 channels_last=channels_last)
+
+        dims, sizes = spatial_dims(x, channels_last), spatial_sizes(x, channels_last)
+        # Compute Fourier coeffcients up to factor of e^(- something constant)
+        x_ft = torch.fft.rfftn(x, dim=dims)
+
+        # Multiply relevant Fourier modes, the high modes of the cached out_ft stay zero
+        out_ft = workspace.zeros(spectrum_shape(x.shape[0], self.out_channels, sizes, channels_last),
+                                 torch.cfloat, x.device, modes, channels_last=channels_last)
+        spectral_mul(channels_first(x_ft, channels_last), weights, modes, channels_first(out_ft, channels_last),
+                     fused=self.fused, contraction=self.contraction)
+
+        # Return to physical space
+        return torch.fft.irfftn(out_ft, s=sizes, dim=dims)
+
+
 ################################################################
 # 1d fourier layer
 ################################################################
 
 
-class SpectralConv1d(nn.Module):
-    def __init__(self, in_channels, out_channels, modes1):
+class SpectralConv1d(_SpectralConv):
+    ndim = 1
+    # default for modules pickled before the option existed
+    transform = 'fft'
+
+    def __init__(self, in_channels, out_channels, modes1, fused=True, contraction='einsum', transform='fft', lean=False, channels_last=False):
         super(SpectralConv1d, self).__init__()
 
         """
@@ -45,109 +121,86 @@ class SpectralConv1d(nn.Module):
         self.out_channels = out_channels
         # Number of Fourier modes to multiply, at most floor(N/2) + 1
         self.modes1 = modes1
+        # gather all corners and contract them in one kernel, contraction = einsum, bmm, gauss or auto
+        # (see spectral.spectral_mul)
+        self.fused = fused
+        self.contraction = contraction
+        # keep only the retained modes of the input for backward (see spectral.lean_spectral)
+        self.lean = lean
+        # (batch, x, channel) inputs and outputs instead of (batch, channel, x)
+        self.channels_last = channels_last
+        # fft, dft (truncated DFT matrices, see spectral.dft_mul) or auto
+        self.transform = transform
 
         self.scale = (1 / (in_channels*out_channels))
-        self.weights1 = nn.Parameter(
-            self.scale * torch.rand(in_channels, out_channels, self.modes1, dtype=torch.cfloat))
+        self.weights = nn.Parameter(
+            self.scale * torch.rand(self.modes1, in_channels, out_channels, dtype=torch.cfloat))
 
     def forward(self, x):
-        batchsize = x.shape[0]
-        # Compute Fourier coeffcients up to factor of e^(- something constant)
-        x_ft = torch.fft.rfftn(x, dim=[2])
-
-        # Multiply relevant Fourier modes
-        out_ft = torch.zeros(batchsize, self.in_channels, x.size(-1)//2 + 1, device=x.device, dtype=torch.cfloat)
-    
-        out_ft[:, :, :self.modes1] = compl_mul1d(x_ft[:, :, :self.modes1], self.weights1)
-
-        # Return to physical space
-        x = torch.fft.irfftn(out_ft, s=[x.size(-1)], dim=[2])
-        return x
+        # the truncated DFT matrices act on the last axis, i.e. channels first only
+        if not self.channels_last and \
+                choose_transform(self.transform, x.size(-1), self.modes1, x.shape[0]*self.in_channels) == 'dft':
+            return dft_mul(x, self.weights, self.modes, contraction=self.contraction)
+        return self._spectral(x, self.weights, self.modes)
 
 ################################################################
 # 2d fourier layer
 ################################################################
 
 
-class SpectralConv2d(nn.Module):
-    def __init__(self, in_channels, out_channels, modes1, modes2):
+class SpectralConv2d(_SpectralConv):
+    ndim = 2
+
+    def __init__(self, in_channels, out_channels, modes1, modes2, fused=True, contraction='einsum', lean=False, channels_last=False):
         super(SpectralConv2d, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
         # Number of Fourier modes to multiply, at most floor(N/2) + 1
         self.modes1 = modes1
         self.modes2 = modes2
+        self.fused = fused
+        self.contraction = contraction
+        self.lean = lean
+        self.channels_last = channels_last
 
         self.scale = (1 / (in_channels * out_channels))
-        self.weights1 = nn.Parameter(
-            self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, dtype=torch.cfloat))
-        self.weights2 = nn.Parameter(
-            self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, dtype=torch.cfloat))
+        self.weights = nn.Parameter(
+            self.scale * torch.rand(2 * self.modes1 * self.modes2, in_channels, out_channels, dtype=torch.cfloat))
 
     def forward(self, x, gridy=None):
-        batchsize = x.shape[0]
-        size1 = x.shape[-2]
-        size2 = x.shape[-1]
-        # Compute Fourier coeffcients up to factor of e^(- something constant)
-        x_ft = torch.fft.rfftn(x, dim=[2, 3])
+        return self._spectral(x, self.weights, self.modes)
 
 
-        # Multiply relevant Fourier modes
-        out_ft = torch.zeros(batchsize, self.out_channels, x.size(-2), x.size(-1) // 2 + 1, device=x.device,
-                             dtype=torch.cfloat)
-        out_ft[:, :, :self.modes1, :self.modes2] = \
-            compl_mul2d(x_ft[:, :, :self.modes1, :self.modes2], self.weights1)
-        out_ft[:, :, -self.modes1:, :self.modes2] = \
-            compl_mul2d(x_ft[:, :, -self.modes1:, :self.modes2], self.weights2)
-
-        # Return to physical space
-        x = torch.fft.irfftn(out_ft, s=(x.size(-2), x.size(-1)), dim=[2, 3])
-        return x
-
 
+class SpectralConv3d(_SpectralConv):
+    ndim = 3
 
-class SpectralConv3d(nn.Module):
-    def __init__(self, in_channels, out_channels, modes1, modes2, modes3):
+    def __init__(self, in_channels, out_channels, modes1, modes2, modes3, fused=True, contraction='einsum', lean=False, channels_last=False):
         super(SpectralConv3d, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
         self.modes1 = modes1  #Number of Fourier modes to multiply, at most floor(N/2) + 1
         self.modes2 = modes2
         self.modes3 = modes3
+        self.fused = fused
+        self.contraction = contraction
+        self.lean = lean
+        self.channels_last = channels_last
 
         self.scale = (1 / (in_channels * out_channels))
-        self.weights1 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, dtype=torch.cfloat))
-        self.weights2 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, dtype=torch.cfloat))
-        self.weights3 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, dtype=torch.cfloat))
-        self.weights4 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, dtype=torch.cfloat))
+        self.weights = nn.Parameter(self.scale * torch.rand(4 * self.modes1 * self.modes2 * self.modes3, in_channels, out_channels, dtype=torch.cfloat))
 
     def forward(self, x):
-        batchsize = x.shape[0]
-        # Compute Fourier coeffcients up to factor of e^(- something constant)
-        x_ft = torch.fft.rfftn(x, dim=[2,3,4])
-        
-        # Multiply relevant Fourier modes
-        out_ft = torch.zeros(batchsize, self.out_channels, x.size(2), x.size(3), x.size(4)//2 + 1, device=x.device, dtype=torch.cfloat)
-        
-        out_ft[:, :, :self.modes1, :self.modes2, :self.modes3] = \
-            compl_mul3d(x_ft[:, :, :self.modes1, :self.modes2, :self.modes3], self.weights1)
-        out_ft[:, :, -self.modes1:, :self.modes2, :self.modes3] = \
-            compl_mul3d(x_ft[:, :, -self.modes1:, :self.modes2, :self.modes3], self.weights2)
-        out_ft[:, :, :self.modes1, -self.modes2:, :self.modes3] = \
-            compl_mul3d(x_ft[:, :, :self.modes1, -self.modes2:, :self.modes3], self.weights3)
-        out_ft[:, :, -self.modes1:, -self.modes2:, :self.modes3] = \
-            compl_mul3d(x_ft[:, :, -self.modes1:, -self.modes2:, :self.modes3], self.weights4)
-
-        #Return to physical space
-        x = torch.fft.irfftn(out_ft, s=(x.size(2), x.size(3), x.size(4)), dim=[2,3,4])
-        return x
+        return self._spectral(x, self.weights, self.modes)
 
 
     
     
     
-class SpectralConv4d(nn.Module):
-    def __init__(self, in_channels, out_channels, modes1, modes2, modes3, modes4):
+class SpectralConv4d(_SpectralConv):
+    ndim = 4
+
+    def __init__(self, in_channels, out_channels, modes1, modes2, modes3, modes4, fused=True, contraction='einsum', lean=False, channels_last=False):
         super(SpectralConv4d, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
@@ -155,43 +208,16 @@ class SpectralConv4d(nn.Module):
         self.modes2 = modes2
         self.modes3 = modes3
         self.modes4 = modes4
+        self.fused = fused
+        self.contraction = contraction
+        self.lean = lean
+        self.channels_last = channels_last
 
         self.scale = (1 / (in_channels * out_channels))
-        self.weights1 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
-        self.weights2 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
-        self.weights3 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
-        self.weights4 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
-        self.weights5 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
-        self.weights6 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
-        self.weights7 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
-        self.weights8 = nn.Parameter(self.scale * torch.rand(in_channels, out_channels, self.modes1, self.modes2, self.modes3, self.modes4, dtype=torch.cfloat))
+        self.weights = nn.Parameter(self.scale * torch.rand(8 * self.modes1 * self.modes2 * self.modes3 * self.modes4, in_channels, out_channels, dtype=torch.cfloat))
 
     def forward(self, x):
-        batchsize = x.shape[0]
-        # Compute Fourier coeffcients up to factor of e^(- something constant)
-        x_ft = torch.fft.rfftn(x, dim=[2,3,4,5])
-        # Multiply relevant Fourier modes
-        out_ft = torch.zeros(batchsize, self.out_channels, x.size(2), x.size(3), x.size(4), x.size(5)//2 + 1, device=x.device, dtype=torch.cfloat)
-        out_ft[:, :, :self.modes1, :self.modes2, :self.modes3, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, :self.modes1, :self.modes2, :self.modes3, :self.modes4], self.weights1)
-        out_ft[:, :, -self.modes1:, :self.modes2, :self.modes3, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, -self.modes1:, :self.modes2, :self.modes3, :self.modes4], self.weights2)
-        out_ft[:, :, :self.modes1, -self.modes2:, :self.modes3, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, :self.modes1, -self.modes2:, :self.modes3, :self.modes4], self.weights3)
-        out_ft[:, :, :self.modes1, :self.modes2, -self.modes3:, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, :self.modes1, :self.modes2, -self.modes3:, :self.modes4], self.weights4)
-        out_ft[:, :, -self.modes1:, -self.modes2:, :self.modes3, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, -self.modes1:, -self.modes2:, :self.modes3, :self.modes4], self.weights5)
-        out_ft[:, :, -self.modes1:, :self.modes2, -self.modes3:, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, -self.modes1:, :self.modes2, -self.modes3:, :self.modes4], self.weights6)
-        out_ft[:, :, :self.modes1, -self.modes2:, -self.modes3:, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, :self.modes1, -self.modes2:, -self.modes3:, :self.modes4], self.weights7)
-        out_ft[:, :, -self.modes1:, -self.modes2:, -self.modes3:, :self.modes4] = \
-            compl_mul4d(x_ft[:, :, -self.modes1:, -self.modes2:, -self.modes3:, :self.modes4], self.weights8)        
-
-        #Return to physical space
-        x = torch.fft.irfftn(out_ft, s=(x.size(2), x.size(3), x.size(4), x.size(5)), dim=[2,3,4,5])
-        return x
+        return self._spectral(x, self.weights, self.modes)
 
     
     
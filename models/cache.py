@@ -0,0 +1,107 @@
+import os
+import json
+import fcntl
+import hashlib
+import numpy as np
+
+from .checkpoint import atomic_write
+from .data import ChunkedDataset
+from .normalizer import StreamingGaussianNormalizer
+
+
+def file_hash(path, cache_dir):
+    '''
+    sha256 of the content of path, remembered in cache_dir for the (size, mtime) of the file,
+    so a source is hashed again only after it changed. Concurrent jobs wait on a lock file
+    while one of them hashes the source, and then read its memo.
+    '''
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    memo = os.path.join(cache_dir, "hash_" + hashlib.sha256(path.encode()).hexdigest()[:32] + ".json")
+
+    def remembered():
+        if os.path.exists(memo):
+            with open(memo) as f:
+                entry = json.load(f)
+            if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                return entry['sha256']
+        return None
+
+    sha256 = remembered()
+    if sha256 is not None:
+        return sha256
+    with open(memo + ".lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # hashed by another job while this one waited for the lock
+        sha256 = remembered()
+        if sha256 is not None:
+            return sha256
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**24), b''):
+                sha256.update(block)
+        entry = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+        atomic_write(memo, lambda f: f.write(json.dumps(entry).encode()))
+    return entry['sha256']
+
+
+def _digest(cache_dir, fields, start, stop, downsample, periodic, **options):
+    # key of the array of cached_fields (and of what is computed from it, options)
+    os.makedirs(cache_dir, exist_ok=True)
+    fields = [[field] if isinstance(field, str) else list(field) for field in fields]
+    key = {'sources': [[file_hash(f, cache_dir) for f in field] for field in fields],
+           'start': start, 'stop': stop, 'downsample': downsample, 'periodic': periodic}
+    key.update(options)
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def cached_fields(cache_dir, fields, start=None, stop=None, downsample=1, periodic=False):
+    '''
+    float32 array (n_samples, n_x, n_channel) of the fields stacked as channels, computed once
+    and memory-mapped from cache_dir afterwards.
+
+    fields: list of sources, each a .npy file or a list of .npy chunk files of (n_samples, n_points)
+    arrays (see ChunkedDataset, periodic repeats the first point at the end). The samples
+    start:stop are kept, and every downsample-th point. The grid coordinates are not stored,
+    the models generate them (grid_channels).
+
+    The cache file is named by the sha256 of the sources and of these options. Concurrent jobs
+    asking for the same array wait on a lock file while one of them builds it, the array is
+    written to a private file and renamed, so a cache file is always complete.
+    '''
+    path = os.path.join(cache_dir, "fields_" + _digest(cache_dir, fields, start, stop, downsample, periodic) + ".npy")
+
+    if not os.path.exists(path):
+        with open(path + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # built by another job while this one waited for the lock
+            if not os.path.exists(path):
+                fields = [[field] if isinstance(field, str) else list(field) for field in fields]
+                channels = [ChunkedDataset(field, periodic=periodic).select(start, stop, downsample).numpy()
+                            for field in fields]
+                x = np.ascontiguousarray(np.stack(channels, axis=-1))
+                atomic_write(path, lambda f: np.save(f, x))
+
+    # copy on write: writable (torch.from_numpy), the cache file itself is never modified
+    return np.load(path, mmap_mode='c')
+
+
+def cached_normalizer(cache_dir, fields, start=None, stop=None, downsample=1, periodic=False, dim=[], eps=1.0e-5,
+                      grid_channels=None):
+    '''
+    StreamingGaussianNormalizer of the array cached_fields(cache_dir, fields, start, stop, downsample, periodic),
+    fitted batch by batch on its memory map the first time and loaded from cache_dir afterwards, so every
+    sweep job (and the validation) with the same training set shares the same statistics.
+    grid_channels: the grid of the model is fitted with the fields (StreamingGaussianNormalizer.fit)
+    '''
+    options = {'dim': list(dim), 'eps': eps}
+    if grid_channels is not None:
+        options['grid_channels'] = [list(c) for c in grid_channels]
+    path = os.path.join(cache_dir, "normalizer_" + _digest(cache_dir, fields, start, stop, downsample, periodic, **options) + ".pt")
+    if not os.path.exists(path):
+        x = cached_fields(cache_dir, fields, start, stop, downsample, periodic)
+        with open(path + ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                StreamingGaussianNormalizer(dim=dim, eps=eps).fit(x, grid_channels=grid_channels).save(path)
+    return StreamingGaussianNormalizer.load(path)
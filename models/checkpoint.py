@@ -0,0 +1,126 @@
+import glob
+import os
+import queue
+import random
+import re
+import threading
+import uuid
+import numpy as np
+import torch
+
+
+def to_cpu(state):
+    '''
+    copy of a (nested) state with every tensor copied to host memory, so the
+    training can keep updating the originals while the copy is written
+    '''
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    elif isinstance(state, dict):
+        return {k: to_cpu(v) for k, v in state.items()}
+    elif isinstance(state, (list, tuple)):
+        return type(state)(to_cpu(v) for v in state)
+    return state
+
+
+def get_rng_state():
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def checkpoint_name(prefix, ep):
+    return prefix + "_ep" + str(ep) + ".ckpt"
+
+
+def list_checkpoints(prefix):
+    # checkpoints written with this prefix, oldest epoch first
+    pattern = re.compile(re.escape(prefix) + r"_ep(\d+)\.ckpt$")
+    found = []
+    for name in glob.glob(glob.escape(prefix) + "_ep*.ckpt"):
+        match = pattern.match(name)
+        if match:
+            found.append((int(match.group(1)), name))
+    return [name for ep, name in sorted(found)]
+
+
+def latest_checkpoint(prefix):
+    checkpoints = list_checkpoints(prefix)
+    return checkpoints[-1] if checkpoints else None
+
+
+def atomic_write(path, write):
+    # write(f) into a temporary file, then rename it over path: readers see either the previous
+    # file or the complete new one, never a partial write; the temporary file is private to the
+    # process, so concurrent writers never share one
+    tmp = path + "." + str(os.getpid()) + "." + uuid.uuid4().hex + ".tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def atomic_save(state, path):
+    atomic_write(path, lambda f: torch.save(state, f))
+
+
+class CheckpointWriter(object):
+    """
+    Training checkpoints written from a background thread.
+
+    save() copies the state to host memory (the only part on the training
+    thread) and queues it; the worker writes it to <prefix>_ep<epoch>.ckpt
+    with an atomic rename and removes all but the keep_last newest
+    checkpoints of the prefix. Errors of the worker are raised by the next
+    save() or by close().
+    """
+    def __init__(self, prefix, keep_last=3):
+        assert keep_last > 0
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, ep, state):
+        if self.error is not None:
+            raise self.error
+        self._queue.put((ep, to_cpu(state)))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    ep, state = item
+                    atomic_save(state, checkpoint_name(self.prefix, ep))
+                    for name in list_checkpoints(self.prefix)[:-self.keep_last]:
+                        os.remove(name)
+            except Exception as e:
+                self.error = e
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        # wait for the queued checkpoints
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
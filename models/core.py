@@ -1,6 +1,14 @@
+import string
+import threading
+import weakref
+from collections import OrderedDict
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import tltorch
+from .spectral import workspace, gather_modes, scatter_modes, contract, lean_spectral, _block_corner_order, \
+    spatial_dims, spatial_sizes, channels_first, spectrum_shape
 
 
 @torch.jit.script
@@ -21,10 +29,183 @@ def contract_3D(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
     return res
 
 
+################################################################
+# contraction against the factors
+################################################################
+#
+# The joint weight W has shape (n_layers * n_corners, in_channel, out_channel, m_1, ..., m_d).
+# Instead of rebuilding W (in_channel * out_channel * modes entries) for every forward,
+# the gathered block (batch, in_channel, 2*m_1, ..., m_d) is contracted with the factors:
+#
+# CP     : W = sum_r w_r A_0[n, r] A_i[i, r] A_o[o, r] A_1[x_1, r] ... A_d[x_d, r]
+#          project the input channels onto the rank, scale by the (rank, modes) tensor
+#          of the corner and mode factors, expand to the output channels
+# Tucker : W = G x_0 A_0 x_i A_i x_o A_o x_1 A_1 ... x_d A_d
+#          contract the core with the corner and mode factors first, into a
+#          (rank_i, rank_o, modes) tensor, then project onto rank_i, mix and expand with A_o
+
+
+IMPLEMENTATIONS = ['reconstructed', 'factorized']
+
+
+def _mode_equation(ndim):
+    # letters of the corner bits and of the mode axes, interleaved as in the block
+    # (2, m_1, ..., 2, m_{d-1}, m_d)
+    bits = string.ascii_uppercase[:ndim - 1]
+    axes = string.ascii_lowercase[:ndim]
+    block = ''.join(b + a for b, a in zip(bits, axes)) + axes[-1]
+    return bits, axes, block
+
+
+def _corner_factor(factor, first, ndim):
+    # rows of the corner factor for the corners of this layer, in block order
+    # (low/high, ..., low/high) -> (2, ..., 2, rank)
+    order = [first + c for c in _block_corner_order(ndim)]
+    return factor[order].reshape((2,) * (ndim - 1) + (factor.shape[-1],))
+
+
+def contract_cp(block, cp, first, modes):
+    """(batch, in_channel, 2*m_1, ..., m_d) block x CP weight -> (batch, out_channel, 2*m_1, ..., m_d)"""
+    ndim = len(modes)
+    batchsize, in_channels = block.shape[:2]
+    factors = [cp.factors[k] for k in range(len(cp.factors))]
+    bits, axes, block_axes = _mode_equation(ndim)
+    # (rank, 2, m_1, ..., m_d): corner and mode factors, with the CP weights folded into the corner
+    corner = _corner_factor(factors[0] * cp.weights, first, ndim)
+    eq = bits + 'r,' + ','.join(a + 'r' for a in axes) + '->r' + block_axes
+    scaling = torch.einsum(eq, corner, *factors[3:]).reshape(corner.shape[-1], -1)
+
+    x = block.reshape(batchsize, in_channels, -1)
+    x = torch.einsum('bin,ir->brn', x, factors[1]) * scaling
+    out = torch.einsum('brn,or->bon', x, factors[2])
+    return out.reshape((batchsize, out.shape[1]) + tuple(block.shape[2:]))
+
+
+def contract_tucker(block, tucker, first, modes):
+    """(batch, in_channel, 2*m_1, ..., m_d) block x Tucker weight -> (batch, out_channel, 2*m_1, ..., m_d)"""
+    ndim = len(modes)
+    batchsize, in_channels = block.shape[:2]
+    factors = [tucker.factors[k] for k in range(len(tucker.factors))]
+    bits, axes, block_axes = _mode_equation(ndim)
+    core_axes = string.ascii_lowercase[-ndim:]
+    # (rank_i, rank_o, 2, m_1, ..., m_d): core x corner factor x mode factors
+    corner = _corner_factor(factors[0], first, ndim)
+    eq = 'Zst' + core_axes + ',' + bits + 'Z,' + ','.join(a + r for a, r in zip(axes, core_axes)) + '->st' + block_axes
+    core = torch.einsum(eq, tucker.core, corner, *factors[3:])
+    core = core.reshape(core.shape[0], core.shape[1], -1)
+
+    x = block.reshape(batchsize, in_channels, -1)
+    x = torch.einsum('bin,is->bsn', x, factors[1])
+    x = torch.einsum('bsn,stn->btn', x, core)
+    out = torch.einsum('btn,ot->bon', x, factors[2])
+    return out.reshape((batchsize, out.shape[1]) + tuple(block.shape[2:]))
+
+
+def contract_factorized(block, weight, first, modes):
+    """spectral.contract with the corners first, first+1, ... of a CP or Tucker weight,
+    contracted with its factors, without building the dense weight"""
+    if isinstance(weight, tltorch.CPTensor):
+        return contract_cp(block, weight, first, modes)
+    if isinstance(weight, tltorch.TuckerTensor):
+        return contract_tucker(block, weight, first, modes)
+    raise ValueError(f'{type(weight).__name__} can not be contracted with its factors')
+
+
+def supports_factorized(weight):
+    return isinstance(weight, (tltorch.CPTensor, tltorch.TuckerTensor))
+
+
+def weight_parameters(weight):
+    # the dense nn.Parameter, or the factors of a tltorch FactorizedTensor
+    return [weight] if isinstance(weight, nn.Parameter) else list(weight.parameters())
+
+
+################################################################
+# eval-mode cache of reconstructed weights
+################################################################
+
+
+class WeightCache(object):
+    """
+    Dense weights rebuilt from the factors, reused across evaluation calls.
+
+    In eval mode with gradients disabled, the weights of a layer only change
+    when its factors are updated in place (optimizer step, load_state_dict, to),
+    so a reconstructed weight is stored with the (data pointer, version counter)
+    of every factor and rebuilt as soon as one of them differs. train() and
+    eval() of a factorized layer drop its entries. Entries are evicted least
+    recently used first once max_bytes is exceeded, weights larger than
+    max_bytes are never cached, so max_bytes=0 disables the cache.
+    """
+    def __init__(self, max_bytes=2**30):
+        self.max_bytes = max_bytes
+        self._weights = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _versions(module):
+        return tuple((p.data_ptr(), p._version) for p in module.weight.parameters())
+
+    def get(self, module, index, build):
+        if module.training or torch.is_grad_enabled():
+            return build()
+
+        key = (weakref.ref(module), index)
+        versions = self._versions(module)
+        with self._lock:
+            entry = self._weights.pop(key, None)
+            if entry is not None:
+                if entry[0] == versions:
+                    self._weights[key] = entry
+                    return entry[1]
+                self._nbytes -= entry[1].numel() * entry[1].element_size()
+
+        weight = build()
+        nbytes = weight.numel() * weight.element_size()
+        if nbytes > self.max_bytes:
+            return weight
+        with self._lock:
+            while self._weights and self._nbytes + nbytes > self.max_bytes:
+                _, (_, old) = self._weights.popitem(last=False)
+                self._nbytes -= old.numel() * old.element_size()
+            self._weights[key] = (versions, weight)
+            self._nbytes += nbytes
+        return weight
+
+    def drop(self, module):
+        """Remove the entries of a module, and those of modules that no longer exist"""
+        ref = weakref.ref(module)
+        with self._lock:
+            for key in [key for key in self._weights if key[0] == ref or key[0]() is None]:
+                _, weight = self._weights.pop(key)
+                self._nbytes -= weight.numel() * weight.element_size()
+
+    def clear(self):
+        with self._lock:
+            self._weights.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+
+# shared by all factorized spectral layers
+weight_cache = WeightCache()
+
+
 class FactorizedSpectralConv3d(nn.Module):
+    # defaults for modules pickled before the options existed
+    contraction = 'einsum'
+    implementation = 'reconstructed'
+    lean = False
+    channels_last = False
+
     def __init__(self, in_channels, out_channels, modes_height, modes_width, modes_depth, n_layers=1, bias=True, scale='auto',
                  fft_norm='backward', mlp=False,
-                 rank=0.5, factorization='cp', fixed_rank_modes=None, decomposition_kwargs=dict(), **kwargs):
+                 rank=0.5, factorization='cp', fixed_rank_modes=None, decomposition_kwargs=dict(), contraction='einsum', implementation='reconstructed', lean=False, channels_last=False,
+                 **kwargs):
         super().__init__()
 
         self.in_channels = in_channels
@@ -36,6 +217,17 @@ class FactorizedSpectralConv3d(nn.Module):
         self.factorization = factorization
         self.n_layers = n_layers
         self.fft_norm = fft_norm
+        # channel mixing backend: einsum, bmm, gauss or auto (see spectral.contract)
+        self.contraction = contraction
+        # reconstructed: rebuild the dense weight, factorized: contract with the CP/Tucker factors
+        # (other factorizations are always reconstructed)
+        if implementation not in IMPLEMENTATIONS:
+            raise ValueError(f'{implementation} is not supported')
+        self.implementation = implementation
+        # keep only the retained modes of the input for backward (see spectral.lean_spectral)
+        self.lean = lean
+        # (batch, x, ..., channel) inputs and outputs instead of (batch, channel, x, ...)
+        self.channels_last = channels_last
         if mlp:
             raise NotImplementedError()
         else:
@@ -72,7 +264,8 @@ class FactorizedSpectralConv3d(nn.Module):
         corner of the Fourier coefficient (top=0 or bottom=1) -- corresponding to lower frequencies
         and complex_index (real=0 or imaginary=1)
         """
-        return self.weight()[4*layer_index + corner_index, :, :, :, :, :].to_tensor().contiguous()
+        return weight_cache.get(self, (layer_index, corner_index),
+                                lambda: self.weight()[4*layer_index + corner_index, :, :, :, :, :].to_tensor().contiguous())
 
     def _get_weight_dense(self, layer_index, corner_index):
         """Get the weights corresponding to a particular layer,
@@ -81,38 +274,59 @@ class FactorizedSpectralConv3d(nn.Module):
         """
         return self.weight[4*layer_index + corner_index, :, :, :, :, :]
 
+    def _mix(self, block, indices, modes):
+        # (batch, in_channel, retained modes) block of layer indices -> (batch, out_channel, retained modes)
+        if self.implementation == 'factorized' and supports_factorized(self.weight):
+            return contract_factorized(block, self.weight, 4*indices, modes)
+        return contract(block, [self._get_weight(indices, k) for k in range(4)], modes, self.contraction)
+
     def forward(self, x, indices=0):
         with torch.autocast(device_type='cuda', enabled=False):
-            batchsize, channels, height, width, depth = x.shape
+            # (batch, channel, height, width, depth), or (batch, height, width, depth, channel) if channels_last
+            channels_last = self.channels_last
+            sizes = spatial_sizes(x, channels_last)
             dtype = x.dtype
             # out_fft = torch.zeros(x.shape, device=x.device) 
 
-            #Compute Fourier coeffcients 
-            x = torch.fft.rfftn(x.float(), norm=self.fft_norm, dim=[-3, -2, -1])
+            modes = (self.modes_height, self.modes_width, self.modes_depth)
+            mix = lambda block: self._mix(block, indices, modes)
 
-            # Multiply relevant Fourier modes        
-            # x = torch.view_as_real(x)
-            # The output will be of size (batch_size, self.out_channels, x.size(-2), x.size(-1)//2 + 1)
-            out_fft = torch.zeros([batchsize, self.out_channels,  height, width, depth//2 + 1], device=x.device, dtype=torch.cfloat)
+            if self.lean and torch.is_grad_enabled():
+                # save only the retained modes for backward (see spectral.lean_spectral)
+                x = lean_spectral(x.float(), modes, mix, weight_parameters(self.weight), norm=self.fft_norm,
+                                  channels_last=channels_last).type(dtype)
+            else:
+                #Compute Fourier coeffcients 
+                dims = spatial_dims(x, channels_last)
+                x = torch.fft.rfftn(x.float(), norm=self.fft_norm, dim=dims)
 
-            out_fft[:, :, :self.modes_height, :self.modes_width, :self.modes_depth] = contract_3D(
-                x[:, :, :self.modes_height, :self.modes_width, :self.modes_depth], self._get_weight(indices, 0))
-            out_fft[:, :, -self.modes_height:, :self.modes_width, :self.modes_depth] = contract_3D(
-                x[:, :, -self.modes_height:, :self.modes_width, :self.modes_depth], self._get_weight(indices, 1))
-            out_fft[:, :, self.modes_height:, -self.modes_width:, :self.modes_depth] = contract_3D(
-                x[:, :, self.modes_height:, -self.modes_width:, :self.modes_depth], self._get_weight(indices, 2))
-            out_fft[:, :, -self.modes_height:, -self.modes_width:, :self.modes_depth] = contract_3D(
-                x[:, :, -self.modes_height:, -self.modes_width:, :self.modes_depth], self._get_weight(indices, 3))
+                # Multiply relevant Fourier modes        
+                # x = torch.view_as_real(x)
+                # The output will be of size (batch_size, self.out_channels, x.size(-2), x.size(-1)//2 + 1)
+                out_fft = workspace.zeros(spectrum_shape(x.shape[0], self.out_channels, sizes, channels_last), torch.cfloat,
+                                          x.device, modes, channels_last=channels_last)
+                scatter_modes(channels_first(out_fft, channels_last), mix(gather_modes(channels_first(x, channels_last), modes)), modes)
 
-            # out_size = (int(height*super_res), int(width*super_res))
-            x = torch.fft.irfftn(out_fft, s=(height, width, depth), norm=self.fft_norm).type(dtype) #(x.size(-2), x.size(-1))) +
-            x = x + self.bias
+                # out_size = (int(height*super_res), int(width*super_res))
+                x = torch.fft.irfftn(out_fft, s=sizes, dim=dims, norm=self.fft_norm).type(dtype) #(x.size(-2), x.size(-1))) +
+            x = x + self._bias()
 
         if self.mlp is not None:
             x = self.mlp(x)
 
         return x
 
+    def _bias(self):
+        # the bias broadcasts against (batch, channel, ...) outputs, flatten it for channels last ones
+        if self.channels_last and torch.is_tensor(self.bias):
+            return self.bias.view(-1)
+        return self.bias
+
+    def train(self, mode=True):
+        # the cached weights are only valid for one eval phase
+        weight_cache.drop(self)
+        return super().train(mode)
+
     def get_conv(self, indices):
         """Returns a sub-convolutional layer from the joint parametrize main-convolution
         The parametrization of sub-convolutional layers is shared with the main one.
@@ -127,9 +341,16 @@ class FactorizedSpectralConv3d(nn.Module):
 
 
 class FactorizedSpectralConv2d(nn.Module):
+    # defaults for modules pickled before the options existed
+    contraction = 'einsum'
+    implementation = 'reconstructed'
+    lean = False
+    channels_last = False
+
     def __init__(self, in_channels, out_channels, modes_height, modes_width, n_layers=1, bias=True, scale='auto',
                  fft_norm='backward',
-                 rank=0.5, factorization='cp', fixed_rank_modes=None, decomposition_kwargs=dict(), **kwargs):
+                 rank=0.5, factorization='cp', fixed_rank_modes=None, decomposition_kwargs=dict(), contraction='einsum', implementation='reconstructed', lean=False, channels_last=False,
+                 **kwargs):
         super().__init__()
 
         self.in_channels = in_channels
@@ -140,6 +361,17 @@ class FactorizedSpectralConv2d(nn.Module):
         self.factorization = factorization
         self.n_layers = n_layers
         self.fft_norm = fft_norm
+        # channel mixing backend: einsum, bmm, gauss or auto (see spectral.contract)
+        self.contraction = contraction
+        # reconstructed: rebuild the dense weight, factorized: contract with the CP/Tucker factors
+        # (other factorizations are always reconstructed)
+        if implementation not in IMPLEMENTATIONS:
+            raise ValueError(f'{implementation} is not supported')
+        self.implementation = implementation
+        # keep only the retained modes of the input for backward (see spectral.lean_spectral)
+        self.lean = lean
+        # (batch, x, ..., channel) inputs and outputs instead of (batch, channel, x, ...)
+        self.channels_last = channels_last
 
         if scale == 'auto':
             scale = (1 / (in_channels * out_channels))
@@ -172,7 +404,8 @@ class FactorizedSpectralConv2d(nn.Module):
         corner of the Fourier coefficient (top=0 or bottom=1) -- corresponding to lower frequencies
         and complex_index (real=0 or imaginary=1)
         """
-        return self.weight()[2*layer_index + corner_index, :, :, :, : ].to_tensor().contiguous()
+        return weight_cache.get(self, (layer_index, corner_index),
+                                lambda: self.weight()[2*layer_index + corner_index, :, :, :, : ].to_tensor().contiguous())
 
     def _get_weight_dense(self, layer_index, corner_index):
         """Get the weights corresponding to a particular layer,
@@ -181,29 +414,57 @@ class FactorizedSpectralConv2d(nn.Module):
         """
         return self.weight[2*layer_index + corner_index, :, :, :, :]
 
+    def _mix(self, block, indices, modes):
+        # (batch, in_channel, retained modes) block of layer indices -> (batch, out_channel, retained modes)
+        if self.implementation == 'factorized' and supports_factorized(self.weight):
+            return contract_factorized(block, self.weight, 2*indices, modes)
+        return contract(block, [self._get_weight(indices, k) for k in range(2)], modes, self.contraction)
+
     def forward(self, x, indices=0, super_res=1):
         with torch.autocast(device_type='cuda', enabled=False):
-            batchsize, channels, height, width = x.shape
+            # (batch, channel, height, width), or (batch, height, width, channel) if channels_last
+            channels_last = self.channels_last
+            height, width = spatial_sizes(x, channels_last)
             dtype = x.dtype
             # out_fft = torch.zeros(x.shape, device=x.device) 
 
+            modes = (self.modes_height, self.modes_width)
+            mix = lambda block: self._mix(block, indices, modes)
+
+            if self.lean and super_res == 1 and torch.is_grad_enabled():
+                # save only the retained modes for backward (see spectral.lean_spectral)
+                x = lean_spectral(x.float(), modes, mix, weight_parameters(self.weight), norm=self.fft_norm,
+                                  channels_last=channels_last).type(dtype)
+                return x + self._bias()
+
             #Compute Fourier coeffcients 
-            x = torch.fft.rfft2(x.float(), norm=self.fft_norm)
+            dims = spatial_dims(x, channels_last)
+            x = torch.fft.rfft2(x.float(), norm=self.fft_norm, dim=dims)
 
             # Multiply relevant Fourier modes        
             # x = torch.view_as_real(x)
             # The output will be of size (batch_size, self.out_channels, x.size(-2), x.size(-1)//2 + 1)
-            out_fft = torch.zeros([batchsize, self.out_channels,  height, width//2 + 1], device=x.device, dtype=torch.cfloat)
+            out_fft = workspace.zeros(spectrum_shape(x.shape[0], self.out_channels, (height, width), channels_last), torch.cfloat,
+                                      x.device, modes, channels_last=channels_last)
 
-            # upper block (truncate high freq)
-            out_fft[:, :, :self.modes_height, :self.modes_width:super_res] = contract_2D(x[:, :, :self.modes_height, :self.modes_width], self._get_weight(indices, 0))
-            # Lower block    
-            out_fft[:, :, -self.modes_height:, :self.modes_width:super_res] = contract_2D(x[:, :, -self.modes_height:, :self.modes_width], self._get_weight(indices, 1))
+            # upper (truncate high freq) and lower blocks
+            scatter_modes(channels_first(out_fft, channels_last), mix(gather_modes(channels_first(x, channels_last), modes)), modes)
 
             out_size = (int(height*super_res), int(width*super_res))
-            x = torch.fft.irfft2(out_fft, s=out_size, norm=self.fft_norm).type(dtype) #(x.size(-2), x.size(-1)))
+            x = torch.fft.irfft2(out_fft, s=out_size, dim=dims, norm=self.fft_norm).type(dtype) #(x.size(-2), x.size(-1)))
+
+            return x + self._bias()
 
-            return x + self.bias
+    def _bias(self):
+        # the bias broadcasts against (batch, channel, ...) outputs, flatten it for channels last ones
+        if self.channels_last and torch.is_tensor(self.bias):
+            return self.bias.view(-1)
+        return self.bias
+
+    def train(self, mode=True):
+        # the cached weights are only valid for one eval phase
+        weight_cache.drop(self)
+        return super().train(mode)
 
     def get_conv(self, indices):
         """Returns a sub-convolutional layer from the joint parametrize main-convolution
@@ -236,9 +497,16 @@ class SubConv(nn.Module):
 
 
 class FactorizedSpectralConv1d(nn.Module):
+    # defaults for modules pickled before the options existed
+    contraction = 'einsum'
+    implementation = 'reconstructed'
+    lean = False
+    channels_last = False
+
     def __init__(self, in_channels, out_channels, modes, n_layers=1, 
                  bias=True, scale='auto', fft_norm='forward', rank=0.5, 
-                 factorization='tucker', fixed_rank_modes=None, decomposition_kwargs=dict()):
+                 factorization='tucker', fixed_rank_modes=None, decomposition_kwargs=dict(), contraction='einsum',
+                 implementation='reconstructed', lean=False, channels_last=False):
         super().__init__()
 
         #Joint factorization only works for the same in and out channels
@@ -252,6 +520,17 @@ class FactorizedSpectralConv1d(nn.Module):
         self.factorization = factorization
         self.n_layers = n_layers
         self.fft_norm = fft_norm
+        # channel mixing backend: einsum, bmm, gauss or auto (see spectral.contract)
+        self.contraction = contraction
+        # reconstructed: rebuild the dense weight, factorized: contract with the CP/Tucker factors
+        # (other factorizations are always reconstructed)
+        if implementation not in IMPLEMENTATIONS:
+            raise ValueError(f'{implementation} is not supported')
+        self.implementation = implementation
+        # keep only the retained modes of the input for backward (see spectral.lean_spectral)
+        self.lean = lean
+        # (batch, x, ..., channel) inputs and outputs instead of (batch, channel, x, ...)
+        self.channels_last = channels_last
 
         if scale == 'auto':
             scale = (1 / (in_channels * out_channels))
@@ -281,30 +560,61 @@ class FactorizedSpectralConv1d(nn.Module):
 
     def _get_weight_factorized(self, layer_index):
         #Get the weights corresponding to a particular layer
-        return self.weight()[layer_index, :, :, : ].to_tensor().contiguous()
+        return weight_cache.get(self, layer_index,
+                                lambda: self.weight()[layer_index, :, :, : ].to_tensor().contiguous())
 
     def _get_weight_dense(self, layer_index):
         #Get the weights corresponding to a particular layer
         return self.weight[layer_index, :, :, :]
 
+    def _mix(self, block, indices, modes):
+        # (batch, in_channel, retained modes) block of layer indices -> (batch, out_channel, retained modes)
+        if self.implementation == 'factorized' and supports_factorized(self.weight):
+            return contract_factorized(block, self.weight, indices, modes)
+        return contract(block, [self._get_weight(indices)], modes, self.contraction)
+
     def forward(self, x, indices=0, s=None):
-        batchsize, channels, width = x.shape
+        # (batch, channel, width), or (batch, width, channel) if channels_last
+        channels_last = self.channels_last
+        width, = spatial_sizes(x, channels_last)
         dtype = x.dtype
         
         if s is None:
             s = width
 
+        modes = (self.modes,)
+        mix = lambda block: self._mix(block, indices, modes)
+
+        if self.lean and s == width and torch.is_grad_enabled():
+            # save only the retained modes for backward (see spectral.lean_spectral)
+            x = lean_spectral(x, modes, mix, weight_parameters(self.weight), norm=self.fft_norm,
+                              channels_last=channels_last).type(dtype)
+            return x + self._bias()
+
         #Compute Fourier coeffcients 
-        x = torch.fft.rfft(x, norm=self.fft_norm)
+        dim = spatial_dims(x, channels_last)[0]
+        x = torch.fft.rfft(x, norm=self.fft_norm, dim=dim)
 
         # Multiply relevant Fourier modes        
-        out_fft = torch.zeros([batchsize, self.out_channels,  width//2 + 1], device=x.device, dtype=torch.cfloat)
-        out_fft[:, :, :self.modes] = contract_1D(x[:, :, :self.modes], self._get_weight(indices))
+        out_fft = workspace.zeros(spectrum_shape(x.shape[0], self.out_channels, (width,), channels_last), torch.cfloat,
+                                  x.device, modes, channels_last=channels_last)
+        scatter_modes(channels_first(out_fft, channels_last), mix(gather_modes(channels_first(x, channels_last), modes)), modes)
 
         #Return to physical space
-        x = torch.fft.irfft(out_fft, n=s, norm=self.fft_norm).type(dtype)
+        x = torch.fft.irfft(out_fft, n=s, dim=dim, norm=self.fft_norm).type(dtype)
+
+        return x + self._bias()
 
-        return x + self.bias
+    def _bias(self):
+        # the bias broadcasts against (batch, channel, ...) outputs, flatten it for channels last ones
+        if self.channels_last and torch.is_tensor(self.bias):
+            return self.bias.view(-1)
+        return self.bias
+
+    def train(self, mode=True):
+        # the cached weights are only valid for one eval phase
+        weight_cache.drop(self)
+        return super().train(mode)
 
     def get_conv(self, indices):
         """Returns a sub-convolutional layer from the joint parametrize main-convolution
@@ -321,9 +631,13 @@ class FactorizedSpectralConv1d(nn.Module):
 
 
 class JointFactorizedSpectralConv1d(nn.Module):
+    # default for modules pickled before the option existed
+    channels_last = False
+
     def __init__(self, modes, width, n_layers=1, joint_factorization=True, in_channels=2, scale='auto',
                  non_linearity=nn.GELU, rank=1.0, factorization='tucker', bias=True,
-                 fixed_rank_modes=False, fft_norm='forward', decomposition_kwargs=dict()):
+                 fixed_rank_modes=False, fft_norm='forward', decomposition_kwargs=dict(), implementation='reconstructed',
+                 channels_last=False):
         super().__init__()
 
         if isinstance(modes, int):
@@ -357,6 +671,8 @@ class JointFactorizedSpectralConv1d(nn.Module):
         self.fixed_rank_modes = fixed_rank_modes
         self.decomposition_kwargs = decomposition_kwargs
         self.fft_norm = fft_norm
+        # (batch, x, channel) activations, the linears being applied as Linear
+        self.channels_last = channels_last
     
         if joint_factorization:
             self.convs = FactorizedSpectralConv1d(self.in_channels, self.width[0], self.modes[0],
@@ -367,7 +683,9 @@ class JointFactorizedSpectralConv1d(nn.Module):
                                                   rank=self.rank,
                                                   factorization=self.factorization,
                                                   fixed_rank_modes=self.fixed_rank_modes,
-                                                  decomposition_kwargs=decomposition_kwargs)
+                                                  decomposition_kwargs=decomposition_kwargs,
+                                                  implementation=implementation,
+                                                  channels_last=channels_last)
         else:
             self.convs = nn.ModuleList([FactorizedSpectralConv1d(self.width[j], self.width[j+1], self.modes[j],
                                                                  n_layers=1,
@@ -377,7 +695,9 @@ class JointFactorizedSpectralConv1d(nn.Module):
                                                                  rank=self.rank,
                                                                  factorization=self.factorization,
                                                                  fixed_rank_modes=self.fixed_rank_modes,
-                                                                 decomposition_kwargs=decomposition_kwargs) for j in range(self.n_layers)])
+                                                                 decomposition_kwargs=decomposition_kwargs,
+                                                  implementation=implementation,
+                                                  channels_last=channels_last) for j in range(self.n_layers)])
 
         self.linears = nn.ModuleList([nn.Conv1d(self.width[j], self.width[j+1], 1) for j in range(self.n_layers)])
         
@@ -393,12 +713,16 @@ class JointFactorizedSpectralConv1d(nn.Module):
             x1 = self.convs[j](x, s=s[j])
 
             #Fourier interpolation
+            dim = 1 if self.channels_last else -1
             if s[j] is not None:
-                x2 = torch.fft.irfft(torch.fft.rfft(x, norm=self.fft_norm), n=s[j], norm=self.fft_norm)
+                x2 = torch.fft.irfft(torch.fft.rfft(x, norm=self.fft_norm, dim=dim), n=s[j], norm=self.fft_norm, dim=dim)
             else:
                 x2 = x
             
-            x2 = self.linears[j](x2)
+            if self.channels_last:
+                x2 = F.linear(x2, self.linears[j].weight.squeeze(-1), self.linears[j].bias)
+            else:
+                x2 = self.linears[j](x2)
 
             x = x1 + x2
 
@@ -0,0 +1,206 @@
+import math
+import numpy as np
+import torch
+from collections import deque
+from itertools import islice
+from timeit import default_timer
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TensorBatchLoader(object):
+    """
+    Batches of in-memory tensors, in place of
+        DataLoader(TensorDataset(*tensors), batch_size=batch_size, shuffle=shuffle)
+
+    DataLoader fetches every sample with its own __getitem__ and stacks them.
+    Here a shuffled epoch draws one random permutation and gathers each batch
+    with a single index_select per tensor; without shuffling the batches are
+    slices (views) of the tensors, no copy at all.
+
+    With num_replicas > 1 the loader yields the shard of rank. Shuffled, every
+    rank draws the same permutation (seeded with seed + epoch, see set_epoch),
+    pads it to a multiple of num_replicas and takes every num_replicas-th
+    sample, so all ranks run the same number of batches, as DistributedSampler.
+    Unshuffled (evaluation), rank gets a contiguous slice, nothing is repeated.
+    """
+    def __init__(self, *tensors, batch_size=1, shuffle=False, drop_last=False, generator=None,
+                 num_replicas=1, rank=0, seed=0):
+        if len(set(t.shape[0] for t in tensors)) != 1:
+            raise ValueError('all tensors must have the same number of samples')
+        self.tensors = tensors
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.n_total = tensors[0].shape[0]
+        self.n_samples = self.n_total
+        if num_replicas > 1 and shuffle:
+            self.n_samples = math.ceil(self.n_total / num_replicas)
+        elif num_replicas > 1:
+            chunk = math.ceil(self.n_total / num_replicas)
+            start, end = min(rank*chunk, self.n_total), min((rank+1)*chunk, self.n_total)
+            self.tensors = tuple(t[start:end] for t in tensors)
+            self.n_samples = end - start
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n_samples // self.batch_size
+        return math.ceil(self.n_samples / self.batch_size)
+
+    def _permutation(self):
+        # shuffled sample order of the epoch (of the shard of rank)
+        if self.num_replicas > 1:
+            perm = torch.randperm(self.n_total, generator=torch.Generator().manual_seed(self.seed + self.epoch))
+            return torch.cat([perm, perm[:self.n_samples*self.num_replicas - self.n_total]])[self.rank::self.num_replicas]
+        return torch.randperm(self.n_samples, generator=self.generator)
+
+    def batch_indices(self):
+        # the batches of one epoch as sample indices (shuffled) or slices, read with fetch()
+        n_batches = len(self)
+        if self.shuffle:
+            perm = self._permutation()
+            return [perm[i*self.batch_size:(i+1)*self.batch_size] for i in range(n_batches)]
+        return [slice(i*self.batch_size, (i+1)*self.batch_size) for i in range(n_batches)]
+
+    def fetch(self, index):
+        if isinstance(index, slice):
+            return tuple(t[index] for t in self.tensors)
+        return tuple(t.index_select(0, index.to(t.device)) for t in self.tensors)
+
+    def __iter__(self):
+        n_batches = len(self)
+        if self.shuffle:
+            perm = self._permutation()
+            # one copy of the permutation per device the tensors live on
+            perms = {t.device: perm.to(t.device) for t in self.tensors}
+            for i in range(n_batches):
+                yield tuple(t.index_select(0, perms[t.device][i*self.batch_size:(i+1)*self.batch_size])
+                            for t in self.tensors)
+        else:
+            for i in range(n_batches):
+                yield tuple(t[i*self.batch_size:(i+1)*self.batch_size] for t in self.tensors)
+
+
+class Prefetcher(object):
+    """
+    Batches of a TensorBatchLoader prepared ahead of the training step.
+
+    n_workers threads read the next depth batches (fetch, e.g. page faults of
+    a memory map), copy them to device (through pinned memory for CUDA) and
+    apply transform(*batch) (e.g. the normalizer encode), while the caller
+    runs the current step. At most depth batches are in flight, so the memory
+    of the prefetched batches is bounded; they are yielded in loader order.
+
+    stall is the time the caller waited for a batch during the last epoch
+    (seconds): close to zero when the data keeps up with the training, a large
+    part of the epoch time when the training is I/O bound.
+    """
+    def __init__(self, loader, transform=None, device=None, n_workers=2, depth=4):
+        self.loader = loader
+        self.transform = transform
+        self.device = device
+        self.n_workers = n_workers
+        self.depth = depth
+        self.stall = 0.0
+
+    def set_epoch(self, epoch):
+        self.loader.set_epoch(epoch)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _prepare(self, index):
+        batch = self.loader.fetch(index)
+        if isinstance(index, slice) and (self.device is None or torch.device(self.device).type == 'cpu'):
+            # a slice is a view, copied so that the samples are read here and not during the step
+            batch = tuple(t.clone() for t in batch)
+        elif self.device is not None:
+            if torch.device(self.device).type == 'cuda':
+                batch = tuple(t if t.is_cuda else t.pin_memory() for t in batch)
+            batch = tuple(t.to(self.device, non_blocking=True) for t in batch)
+        if self.transform is not None:
+            batch = self.transform(*batch)
+        return batch
+
+    def __iter__(self):
+        self.stall = 0.0
+        indices = iter(self.loader.batch_indices())
+        pending = deque()
+        with ThreadPoolExecutor(self.n_workers) as pool:
+            for index in islice(indices, self.depth):
+                pending.append(pool.submit(self._prepare, index))
+            while pending:
+                start = default_timer()
+                batch = pending.popleft().result()
+                self.stall += default_timer() - start
+                for index in islice(indices, 1):
+                    pending.append(pool.submit(self._prepare, index))
+                yield batch
+
+
+class ChunkedDataset(object):
+    """
+    Samples stored in a sequence of .npy chunk files, read as one array of
+    len(dataset) samples without loading it.
+
+    Every chunk is opened with np.load(mmap_mode='r') (in a thread pool), the
+    samples of all chunks share one index space. select() returns a view of
+    a range of samples, downsampled along the grid axis (axis 1), and
+    indexing a dataset reads only the requested samples, as float32. With
+    periodic=True the first grid point is repeated at the end (n points ->
+    n + 1, as the KS data) before downsampling.
+    """
+    def __init__(self, files, periodic=False, n_threads=8):
+        self.n_threads = n_threads
+        with ThreadPoolExecutor(n_threads) as pool:
+            self.chunks = list(pool.map(lambda f: np.load(f, mmap_mode='r'), files))
+        if len(set(c.shape[1:] for c in self.chunks)) != 1:
+            raise ValueError('all chunks must have the same sample shape')
+        self.offsets = np.cumsum([0] + [c.shape[0] for c in self.chunks])
+        self.rows = np.arange(self.offsets[-1])
+        n_points = self.chunks[0].shape[1]
+        self.cols = np.arange(n_points + 1) % n_points if periodic else np.arange(n_points)
+
+    def select(self, start=None, stop=None, downsample=1):
+        # view of the samples start:stop (negative values count from the end), every downsample-th grid point
+        view = object.__new__(ChunkedDataset)
+        view.n_threads, view.chunks, view.offsets = self.n_threads, self.chunks, self.offsets
+        view.rows = self.rows[start:stop]
+        view.cols = self.cols[::downsample]
+        return view
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def shape(self):
+        return (len(self.rows), len(self.cols)) + self.chunks[0].shape[2:]
+
+    def _read(self, c, rows, out, mask):
+        local = rows[mask] - self.offsets[c]
+        if np.all(np.diff(local) == 1):
+            # contiguous samples, a slice of the map
+            src = self.chunks[c][local[0]:local[-1]+1]
+        else:
+            src = self.chunks[c][local]
+        out[mask] = np.take(src, self.cols, axis=1)
+
+    def __getitem__(self, key):
+        rows = self.rows[key]
+        if np.ndim(rows) == 0:
+            return self[np.atleast_1d(key)][0]
+        out = np.empty((len(rows),) + self.shape[1:], dtype=np.float32)
+        chunk_ids = np.searchsorted(self.offsets, rows, side='right') - 1
+        with ThreadPoolExecutor(self.n_threads) as pool:
+            list(pool.map(lambda c: self._read(c, rows, out, chunk_ids == c), np.unique(chunk_ids)))
+        return out
+
+    def numpy(self):
+        return self[:]
@@ -0,0 +1,69 @@
+import os
+import torch
+import torch.distributed as dist
+
+from .normalizer import UnitGaussianNormalizer, StreamingGaussianNormalizer
+from .checkpoint import to_cpu
+
+
+def init_distributed(backend='gloo'):
+    '''
+    join the process group started by torchrun (RANK, WORLD_SIZE, MASTER_ADDR,
+    MASTER_PORT in the environment), returns (rank, world_size)
+    '''
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return dist.get_rank(), dist.get_world_size()
+
+
+def local_device():
+    '''
+    device of this process: the GPU LOCAL_RANK (made the current CUDA device) when
+    CUDA is available, torchrun starting one process per GPU of a node, else the cpu
+    '''
+    if torch.cuda.is_available():
+        local_rank = int(os.environ.get('LOCAL_RANK', 0))
+        torch.cuda.set_device(local_rank)
+        return torch.device('cuda', local_rank)
+    return torch.device('cpu')
+
+
+def all_reduce_sum(tensor):
+    # in place sum over all ranks
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def shared_normalizer(x, dim, rank, src=0, grid_channels=None):
+    '''
+    UnitGaussianNormalizer fitted on rank src only, its statistics are broadcast
+    so that every rank encodes the data with exactly the same mean and std
+    grid_channels: StreamingGaussianNormalizer of x and the grid of the model instead
+    '''
+    # the other ranks only need an instance to load the statistics into
+    if grid_channels is None:
+        normalizer = UnitGaussianNormalizer(x if rank == src else x[:1], dim=dim)
+    else:
+        normalizer = StreamingGaussianNormalizer(dim=dim)
+        if rank == src:
+            normalizer.fit(x, grid_channels=grid_channels)
+    state = [normalizer.state_dict() if rank == src else None]
+    dist.broadcast_object_list(state, src)
+    normalizer.load_state_dict(state[0])
+    return normalizer
+
+
+def merged_normalizer(normalizer):
+    '''
+    StreamingGaussianNormalizer of the data of all ranks, each rank having fitted
+    its own shard: the states are gathered and merged in rank order, so every
+    rank ends with the same statistics
+    '''
+    states = [None] * dist.get_world_size()
+    dist.all_gather_object(states, to_cpu(normalizer.state_dict()))
+    merged = StreamingGaussianNormalizer(dim=normalizer.dim, eps=normalizer.eps)
+    for state in states:
+        shard = StreamingGaussianNormalizer()
+        shard.load_state_dict(state)
+        merged.merge(shard)
+    return merged
@@ -0,0 +1,120 @@
+import copy
+import math
+import queue
+import threading
+import torch
+
+from .losses import LpMetrics
+
+
+def evaluate(model, loader, device, y_normalizer=None, metrics=None):
+    '''
+    add the test errors of model over loader to metrics (kept on device, no sync)
+    '''
+    if metrics is None:
+        metrics = LpMetrics(d=1, p=2, device=device)
+    with torch.no_grad():
+        for x, y in loader:
+            x, y = x.to(device), y.to(device)
+            batch_size_ = x.shape[0]
+            out = model(x) #.reshape(batch_size_,  -1)
+
+            if y_normalizer is not None:
+                out = y_normalizer.decode(out)
+                y = y_normalizer.decode(y)
+
+            metrics.update(out.view(batch_size_,-1), y.view(batch_size_,-1))
+    return metrics
+
+
+def is_eval_epoch(ep, epochs, eval_every=1, eval_at=()):
+    # every eval_every epochs, at the epochs listed in eval_at, and always at the last epoch
+    return (ep % eval_every == 0) or (ep in eval_at) or (ep == epochs - 1)
+
+
+def fill_losses(losses, fill='nan'):
+    '''
+    losses of the skipped epochs are NaN, fill='hold' replaces them by the last
+    evaluated value (NaN before the first evaluation)
+    '''
+    if fill == 'nan':
+        return losses
+    elif fill == 'hold':
+        held, filled = math.nan, []
+        for loss in losses:
+            held = held if math.isnan(loss) else loss
+            filled.append(held)
+        return filled
+    else:
+        raise ValueError(f'{fill} is not supported')
+
+
+class AsyncEvaluator(object):
+    """
+    Test set evaluation in a background thread.
+
+    submit() snapshots the weights of the training model (device copies,
+    ordered on the stream before the next optimizer step) and returns
+    immediately; the worker loads the snapshot into its own copy of the model
+    and scores it while training continues. At most max_pending snapshots
+    wait in the queue, further submit() calls block, which bounds the memory
+    of the snapshots when evaluation is slower than training.
+    """
+    def __init__(self, model, loader, device, y_normalizer=None, max_pending=2):
+        self.model = copy.deepcopy(model).eval()
+        for p in self.model.parameters():
+            p.requires_grad_(False)
+        self.loader = loader
+        self.device = device
+        self.y_normalizer = y_normalizer
+        # epoch -> (mean rel error, mean abs error)
+        self.results = {}
+        self.error = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, ep, model):
+        if self.error is not None:
+            raise self.error
+        snapshot = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        self._queue.put((ep, snapshot))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    ep, snapshot = item
+                    self.model.load_state_dict(snapshot)
+                    means = evaluate(self.model, self.loader, self.device, self.y_normalizer).means()
+                    with self._lock:
+                        self.results[ep] = means
+            except Exception as e:
+                self.error = e
+            finally:
+                self._queue.task_done()
+
+    def latest(self):
+        # (epoch, (mean rel error, mean abs error)) of the last finished evaluation, or None
+        with self._lock:
+            if not self.results:
+                return None
+            ep = max(self.results)
+            return ep, self.results[ep]
+
+    def finished(self):
+        # copy of the results so far, {epoch: (mean rel error, mean abs error)}
+        with self._lock:
+            return dict(self.results)
+
+    def close(self):
+        # wait for the pending snapshots, returns all results
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return dict(self.results)
@@ -2,18 +2,33 @@ import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint as checkpoint_layer
 from .basics import SpectralConv1d
-from .utils import _get_act, add_padding, remove_padding
+from .spectral import spatial_sizes
+from .utils import _get_act, add_padding, remove_padding, _get_checkpoint_layers, get_pad_nums, linear_in, linear_out, _get_grid_channels, add_grid_channels
 
 
 class FNN1d(nn.Module):
+    # defaults for modules pickled before the options existed
+    checkpoint_layers = ()
+    pad_policy = 'ratio'
+    channels_last = False
+    grid_channels = None
+
     def __init__(self,
                  modes, width=32,
                  layers=None,
                  fc_dim=128,
                  in_dim=2, out_dim=1,
                  act='gelu',
-                 pad_ratio=0):
+                 pad_ratio=0,
+                 contraction='einsum',
+                 transform='fft',
+                 lean=False,
+                 checkpoint=None,
+                 pad_policy='ratio',
+                 channels_last=False,
+                 grid_channels=None):
         super(FNN1d, self).__init__()
 
         """
@@ -36,15 +51,21 @@ class FNN1d(nn.Module):
         else:
             self.layers = layers
         self.pad_ratio = pad_ratio
+        self.pad_policy = pad_policy
+        self.channels_last = channels_last
+        # None or one (low, high) per spatial axis, the grid coordinates are the last in_dim input channels
+        self.grid_channels = _get_grid_channels(grid_channels, 1)
         self.fc_dim = fc_dim
         
         self.fc0 = nn.Linear(in_dim, layers[0])  # input channel is 2: (a(x), x)
 
         self.sp_convs = nn.ModuleList([SpectralConv1d(
-            in_size, out_size, num_modes) for in_size, out_size, num_modes in zip(layers, layers[1:], self.modes1)])
+            in_size, out_size, num_modes, contraction=contraction, transform=transform, lean=lean, channels_last=channels_last)
+            for in_size, out_size, num_modes in zip(layers, layers[1:], self.modes1)])
 
         self.ws = nn.ModuleList([nn.Conv1d(in_size, out_size, 1)
                                  for in_size, out_size in zip(layers, layers[1:])])
+        self.checkpoint_layers = _get_checkpoint_layers(checkpoint, len(self.ws))
         
         # if fc_dim = 0, we do not have nonlinear layer
         if fc_dim > 0:
@@ -55,6 +76,19 @@ class FNN1d(nn.Module):
             
         self.act = _get_act(act)
 
+    def _fourier_layer(self, i, x):
+        # i-th integral operator u' = act((W + K)(u))
+        x1 = self.sp_convs[i](x)
+        if self.channels_last:
+            # the 1x1 convolution ws[i] as a Linear over the channel axis
+            x2 = F.linear(x, self.ws[i].weight.squeeze(-1), self.ws[i].bias)
+        else:
+            x2 = self.ws[i](x)
+        x = x1 + x2
+        if self.act is not None and i != len(self.ws) - 1:
+            x = self.act(x)
+        return x
+
     def forward(self, x):
         """
         Input shape (of x):     (batch, nx_in,  channels_in)
@@ -65,24 +99,28 @@ class FNN1d(nn.Module):
         """
         
         length = len(self.ws)
-        x = self.fc0(x)
-        x = x.permute(0, 2, 1)
-        pad_nums = [math.floor(self.pad_ratio * x.shape[-1])]
+        x = add_grid_channels(x, self.grid_channels, getattr(self, 'grid_mean', None), getattr(self, 'grid_std', None))
+        # x_scale, x_shift, y_scale, y_shift: normalizers folded by utils.fold_normalizers
+        x = linear_in(self.fc0, x, getattr(self, 'x_scale', None), getattr(self, 'x_shift', None))
+        if not self.channels_last:
+            x = x.permute(0, 2, 1)
+        pad_nums = get_pad_nums(spatial_sizes(x, self.channels_last), self.pad_ratio, self.pad_policy)
         
         # add padding
-        x = add_padding(x, pad_nums=pad_nums)
+        x = add_padding(x, pad_nums=pad_nums, channels_last=self.channels_last)
 
-        for i, (speconv, w) in enumerate(zip(self.sp_convs, self.ws)):
-            x1 = speconv(x)
-            x2 = w(x)
-            x = x1 + x2
-            if self.act is not None and i != length - 1:
-                x = self.act(x)
+        for i in range(length):
+            if i in self.checkpoint_layers and torch.is_grad_enabled():
+                # recompute the layer in backward instead of keeping its activations
+                x = checkpoint_layer(self._fourier_layer, i, x, use_reentrant=False)
+            else:
+                x = self._fourier_layer(i, x)
                 
         # remove padding
-        x = remove_padding(x, pad_nums=pad_nums)
+        x = remove_padding(x, pad_nums=pad_nums, channels_last=self.channels_last)
         
-        x = x.permute(0, 2, 1)
+        if not self.channels_last:
+            x = x.permute(0, 2, 1)
         
         # if fc_dim = 0, we do not have nonlinear layer
         fc_dim = self.fc_dim if hasattr(self, 'fc_dim') else 1
@@ -92,7 +130,7 @@ class FNN1d(nn.Module):
             if self.act is not None:
                 x = self.act(x)
             
-        x = self.fc2(x)
+        x = linear_out(self.fc2, x, getattr(self, 'y_scale', None), getattr(self, 'y_shift', None))
         
         
         return x
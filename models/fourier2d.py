@@ -2,16 +2,30 @@ import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint as checkpoint_layer
 from .basics import SpectralConv2d
-from .utils import _get_act, add_padding, remove_padding
+from .spectral import spatial_sizes
+from .utils import _get_act, add_padding, remove_padding, _get_checkpoint_layers, get_pad_nums, linear_in, linear_out, _get_grid_channels, add_grid_channels
 
 
 class FNN2d(nn.Module):
+    # defaults for modules pickled before the options existed
+    checkpoint_layers = ()
+    pad_policy = 'ratio'
+    channels_last = False
+    grid_channels = None
+
     def __init__(self, modes1, modes2, width=64, 
                  layers=None, fc_dim=128,
                  in_dim=3, out_dim=1,
                  act='gelu',
-                 pad_ratio=0):
+                 pad_ratio=0,
+                 contraction='einsum',
+                 lean=False,
+                 checkpoint=None,
+                 pad_policy='ratio',
+                 channels_last=False,
+                 grid_channels=None):
         super(FNN2d, self).__init__()
 
         """
@@ -36,17 +50,22 @@ class FNN2d(nn.Module):
         else:
             self.layers = layers
         self.pad_ratio = pad_ratio
+        self.pad_policy = pad_policy
+        self.channels_last = channels_last
+        # None or one (low, high) per spatial axis, the grid coordinates are the last in_dim input channels
+        self.grid_channels = _get_grid_channels(grid_channels, 2)
         self.fc_dim = fc_dim
         
         self.fc0 = nn.Linear(in_dim, layers[0])
 
         self.sp_convs = nn.ModuleList([SpectralConv2d(
-            in_size, out_size, mode1_num, mode2_num)
+            in_size, out_size, mode1_num, mode2_num, contraction=contraction, lean=lean, channels_last=channels_last)
             for in_size, out_size, mode1_num, mode2_num
             in zip(self.layers, self.layers[1:], self.modes1, self.modes2)])
 
         self.ws = nn.ModuleList([nn.Conv1d(in_size, out_size, 1)
                                  for in_size, out_size in zip(self.layers, self.layers[1:])])
+        self.checkpoint_layers = _get_checkpoint_layers(checkpoint, len(self.ws))
         
         if fc_dim > 0:
             self.fc1 = nn.Linear(layers[-1], fc_dim)
@@ -56,6 +75,19 @@ class FNN2d(nn.Module):
             
         self.act = _get_act(act)
 
+    def _fourier_layer(self, i, x):
+        # i-th integral operator u' = act((W + K)(u))
+        x1 = self.sp_convs[i](x)
+        if self.channels_last:
+            # the 1x1 convolution ws[i] as a Linear over the channel axis
+            x2 = F.linear(x, self.ws[i].weight.squeeze(-1), self.ws[i].bias)
+        else:
+            x2 = self.ws[i](x.view(x.shape[0], self.layers[i], -1)).view(x.shape[0], self.layers[i+1], *x.shape[2:])
+        x = x1 + x2
+        if self.act is not None and i != len(self.ws) - 1:
+            x = self.act(x)
+        return x
+
     def forward(self, x):
         '''
         Args:
@@ -64,26 +96,28 @@ class FNN2d(nn.Module):
             - x: (batch size, x_grid, y_grid, 1)
         '''
         length = len(self.ws)
-        batchsize = x.shape[0]
         
 
-        x = self.fc0(x)
-        x = x.permute(0, 3, 1, 2)
-        pad_nums = [math.floor(self.pad_ratio * x.shape[-2]), math.floor(self.pad_ratio * x.shape[-1])]
-        x = add_padding(x, pad_nums=pad_nums)
+        x = add_grid_channels(x, self.grid_channels, getattr(self, 'grid_mean', None), getattr(self, 'grid_std', None))
+        # x_scale, x_shift, y_scale, y_shift: normalizers folded by utils.fold_normalizers
+        x = linear_in(self.fc0, x, getattr(self, 'x_scale', None), getattr(self, 'x_shift', None))
+        if not self.channels_last:
+            x = x.permute(0, 3, 1, 2)
+        pad_nums = get_pad_nums(spatial_sizes(x, self.channels_last), self.pad_ratio, self.pad_policy)
+        x = add_padding(x, pad_nums=pad_nums, channels_last=self.channels_last)
         
-        size_x, size_y = x.shape[-2], x.shape[-1]
         
-        for i, (speconv, w) in enumerate(zip(self.sp_convs, self.ws)):
-            x1 = speconv(x)
-            x2 = w(x.view(batchsize, self.layers[i], -1)).view(batchsize, self.layers[i+1], size_x, size_y)
-            x = x1 + x2
-            if self.act is not None and i != length - 1:
-                x = self.act(x)
+        for i in range(length):
+            if i in self.checkpoint_layers and torch.is_grad_enabled():
+                # recompute the layer in backward instead of keeping its activations
+                x = checkpoint_layer(self._fourier_layer, i, x, use_reentrant=False)
+            else:
+                x = self._fourier_layer(i, x)
                 
-        x = remove_padding(x, pad_nums=pad_nums)
+        x = remove_padding(x, pad_nums=pad_nums, channels_last=self.channels_last)
         
-        x = x.permute(0, 2, 3, 1)
+        if not self.channels_last:
+            x = x.permute(0, 2, 3, 1)
         
         if self.fc_dim > 0:
             x = self.fc1(x)
@@ -91,7 +125,7 @@ class FNN2d(nn.Module):
                 x = self.act(x)
       
             
-        x = self.fc2(x)
+        x = linear_out(self.fc2, x, getattr(self, 'y_scale', None), getattr(self, 'y_shift', None))
         return x
 
     
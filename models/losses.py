@@ -198,6 +198,77 @@ class LpLoss(object):
         return self.rel(x, y)
 
 
+class LpMetrics(object):
+    '''
+    running sums of rel/abs Lp errors, kept on device
+
+    LpLoss.rel and LpLoss.abs each compute the difference norm, and reading
+    every batch loss with .item() blocks on the device. update() computes the
+    difference norm once for both metrics and adds the batch sums to a device
+    tensor; sums()/means()/errors() are the only places that synchronize.
+    With per_sample=True the per-sample errors are kept as well.
+    '''
+    def __init__(self, d=1, p=2, device=None, per_sample=False):
+        super(LpMetrics, self).__init__()
+
+        #Dimension and Lp-norm type are postive
+        assert d > 0 and p > 0
+
+        self.d = d
+        self.p = p
+        self.device = device
+        self.per_sample = per_sample
+        self.reset()
+
+    def reset(self):
+        # (sum of rel errors, sum of abs errors), accumulated in double precision
+        self.total = torch.zeros(2, dtype=torch.float64, device=self.device)
+        self.n = 0
+        self.rel_errors = []
+        self.abs_errors = []
+
+    def update(self, x, y):
+        '''
+        add the errors of a batch, returns the per-sample rel errors
+        (still attached to the graph, loss = metrics.update(out, y).sum())
+        '''
+        num_examples = x.size()[0]
+        x, y = x.reshape(num_examples,-1), y.reshape(num_examples,-1)
+
+        #Assume uniform mesh, as in LpLoss.abs
+        h = 1.0 / (x.size()[1] - 1.0)
+
+        diff_norms = torch.norm(x - y, self.p, 1)
+        y_norms = torch.norm(y, self.p, 1)
+        rel_norms = diff_norms/y_norms
+
+        with torch.no_grad():
+            abs_norms = (h**(self.d/self.p))*diff_norms
+            self.total += torch.stack([rel_norms.sum(), abs_norms.sum()]).to(self.total)
+            if self.per_sample:
+                self.rel_errors.append(rel_norms.detach())
+                self.abs_errors.append(abs_norms)
+        self.n += num_examples
+
+        return rel_norms
+
+    def sums(self):
+        # device tensor (rel sum, abs sum), stack several of them to read them with a single sync
+        return self.total
+
+    def means(self):
+        rel_sum, abs_sum = self.total.tolist()
+        return rel_sum/self.n, abs_sum/self.n
+
+    def errors(self):
+        '''
+        per-sample (rel, abs) errors as numpy arrays, requires per_sample=True
+        '''
+        assert self.per_sample
+        errors = torch.stack([torch.cat(self.rel_errors), torch.cat(self.abs_errors)]).cpu().numpy()
+        return errors[0], errors[1]
+
+
 def FDM_Burgers(u, D=1, v=1/100):
     batchsize = u.size(0)
     nt = u.size(1)
@@ -2,6 +2,9 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
+from .checkpoint import atomic_save, to_cpu
+from .utils import add_grid_channels
+
 
 class UnitGaussianNormalizer(object):
     def __init__(self, x, dim = [], eps=1.0e-5):
@@ -35,13 +38,16 @@ class UnitGaussianNormalizer(object):
         x += mean
         
     
+    def state_dict(self):
+        return {'mean': self.mean, 'std': self.std, 'eps': self.eps}
+
+    def load_state_dict(self, state):
+        self.mean, self.std, self.eps = state['mean'], state['std'], state['eps']
+
     def to(self, device):
-        if device == torch.device('cuda:0'):
-            self.mean = self.mean.cuda()
-            self.std = self.std.cuda()
-        else:
-            self.mean = self.mean.cpu()
-            self.std = self.std.cpu()
+        # any device, torch.device('cuda') used to fall through to the cpu branch
+        self.mean = self.mean.to(device)
+        self.std = self.std.to(device)
         
 #     def cuda(self):
 #         self.mean = self.mean.cuda()
@@ -49,4 +55,116 @@ class UnitGaussianNormalizer(object):
 
 #     def cpu(self):
 #         self.mean = self.mean.cpu()
-#         self.std = self.std.cpu()
\ No newline at end of file
+#         self.std = self.std.cpu()
+
+
+def normalizer_from_state(state):
+    # UnitGaussianNormalizer with the statistics of state_dict() of any normalizer
+    normalizer = UnitGaussianNormalizer.__new__(UnitGaussianNormalizer)
+    normalizer.load_state_dict(state)
+    return normalizer
+
+
+class StreamingGaussianNormalizer(UnitGaussianNormalizer):
+    """
+    UnitGaussianNormalizer whose statistics are accumulated batch by batch,
+    for training sets that do not fit in memory (memory-mapped, chunked).
+
+    partial_fit() merges the count, mean and sum of squared deviations (M2)
+    of each batch with the parallel formulas of Chan et al., in float64:
+        n = n_a + n_b,  delta = mean_b - mean_a
+        mean = mean_a + delta * n_b / n
+        M2 = M2_a + M2_b + delta^2 * n_a * n_b / n
+    so the result does not depend on how the data is split, and merge()
+    combines normalizers fitted on different chunks or processes. The std is
+    the unbiased one, as torch.std. save()/load() keep the merge state, so
+    the statistics of a data set are computed once.
+
+    fit(x, grid_channels=...) adds the grid a model generates (FNN grid_channels)
+    to each batch, the statistics are those of the fields and the grid together,
+    as when the data stored the grid; channels() splits them.
+    """
+    def __init__(self, dim = [], eps=1.0e-5):
+        # dim: the reduced axes as in UnitGaussianNormalizer, [] reduces all of them
+        self.dim = list(dim)
+        self.eps = eps
+        self.count = 0
+        self.n_channels, self.channel_reduced = None, False
+        self.mean = self.std = None
+        self._mean = self._m2 = None
+
+    def _merge(self, count, mean, m2):
+        if self.count == 0:
+            self.count, self._mean, self._m2 = count, mean, m2
+        else:
+            mean, m2 = mean.to(self._mean.device), m2.to(self._mean.device)
+            n = self.count + count
+            delta = mean - self._mean
+            self._mean = self._mean + delta * (count / n)
+            self._m2 = self._m2 + m2 + delta**2 * (self.count * count / n)
+            self.count = n
+        self.mean = self._mean.float()
+        self.std = torch.sqrt(self._m2 / max(self.count - 1, 1)).float()
+        return self
+
+    def partial_fit(self, x):
+        # add the samples of the batch x (tensor or array, e.g. a slice of a memory map)
+        x = x.double() if isinstance(x, torch.Tensor) else torch.from_numpy(np.asarray(x, dtype=np.float64))
+        dims = self.dim if len(self.dim) > 0 else list(range(x.ndim))
+        if 0 not in [d % x.ndim for d in dims]:
+            # the statistics of batches of different sizes could not be merged
+            raise ValueError(f'the samples are streamed along axis 0, which must be one of dim = {self.dim}')
+        self.n_channels = x.shape[-1]
+        self.channel_reduced = x.ndim - 1 in [d % x.ndim for d in dims]
+        count = int(np.prod([x.shape[d] for d in dims]))
+        mean = torch.mean(x, dims, keepdim=True)
+        m2 = torch.sum((x - mean)**2, dims)
+        return self._merge(count, mean.reshape(m2.shape), m2)
+
+    def fit(self, x, batch_size=1024, grid_channels=None):
+        # partial_fit over x[i:i+batch_size], only one batch of x in memory at a time
+        # grid_channels: the grid of the model added to each batch (utils.add_grid_channels)
+        for i in range(0, x.shape[0], batch_size):
+            batch = x[i:i+batch_size]
+            if grid_channels is not None:
+                batch = batch if isinstance(batch, torch.Tensor) else torch.from_numpy(np.asarray(batch, dtype=np.float32))
+                batch = add_grid_channels(batch, tuple(tuple(float(v) for v in c) for c in grid_channels))
+            self.partial_fit(batch)
+        return self
+
+    def channels(self, start, stop=None):
+        # UnitGaussianNormalizer of the channels start:stop, e.g. the fields and the grid of fit(x, grid_channels)
+        state = self.state_dict()
+        if not self.channel_reduced:
+            state['mean'], state['std'] = self.mean[..., start:stop], self.std[..., start:stop]
+        return normalizer_from_state(state)
+
+    def merge(self, other):
+        # statistics of the union of the data seen by self and other
+        if other.count > 0:
+            self._merge(other.count, other._mean, other._m2)
+        return self
+
+    def state_dict(self):
+        state = super(StreamingGaussianNormalizer, self).state_dict()
+        state.update({'dim': self.dim, 'count': self.count, 'mean64': self._mean, 'm2': self._m2,
+                      'n_channels': self.n_channels, 'channel_reduced': self.channel_reduced})
+        return state
+
+    def load_state_dict(self, state):
+        super(StreamingGaussianNormalizer, self).load_state_dict(state)
+        self.dim, self.count, self._mean, self._m2 = state['dim'], state['count'], state['mean64'], state['m2']
+        self.n_channels, self.channel_reduced = state.get('n_channels'), state.get('channel_reduced', False)
+
+    def to(self, device):
+        super(StreamingGaussianNormalizer, self).to(device)
+        self._mean, self._m2 = self._mean.to(device), self._m2.to(device)
+
+    def save(self, path):
+        atomic_save(to_cpu(self.state_dict()), path)
+
+    @classmethod
+    def load(cls, path, map_location='cpu'):
+        normalizer = cls()
+        normalizer.load_state_dict(torch.load(path, map_location=map_location))
+        return normalizer
@@ -0,0 +1,660 @@
+import itertools
+import math
+import string
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+
+import torch
+
+
+################################################################
+# retained Fourier corners
+################################################################
+#
+# A d-dimensional rfftn spectrum of shape (n_1, ..., n_{d-1}, n_d//2 + 1) keeps
+# the low (:m) and the high (-m:) modes of the first d-1 axes and only the low
+# modes of the last (real-to-complex) axis, i.e. 2^(d-1) corner blocks.
+#
+# The fused path gathers all corners into one block of shape
+#     (batch, channel, 2*m_1, ..., 2*m_{d-1}, m_d)
+# where along each of the first d-1 axes the low modes come first and the
+# high modes second, contracts the block with the mode-major weights of the
+# same layout in a single kernel, and scatters the result back.
+
+
+def corner_slices(modes):
+    """Slices of the retained corners, in the order of weights1, weights2, ...
+
+    Corners are ordered by the number of axes taking their high modes, then
+    lexicographically, which is the order used by SpectralConv2d/3d/4d.
+    """
+    ndim = len(modes)
+    corners = []
+    for n_high in range(ndim):
+        for high in itertools.combinations(range(ndim - 1), n_high):
+            corners.append(tuple(slice(-m, None) if j in high else slice(None, m) for j, m in enumerate(modes)))
+    return corners
+
+
+@lru_cache(maxsize=None)
+def _block_corner_order(ndim):
+    # corner index (in weights order) of each sub-block of the gathered block,
+    # the sub-blocks being enumerated as (low/high, ..., low/high) bits
+    corners = [high for n_high in range(ndim) for high in itertools.combinations(range(ndim - 1), n_high)]
+    return [corners.index(tuple(j for j, bit in enumerate(bits) if bit))
+            for bits in itertools.product((0, 1), repeat=ndim - 1)]
+
+
+@lru_cache(maxsize=64)
+def _corner_index(sizes, modes, device):
+    # broadcastable index tensors for the first d-1 axes, followed by the slice of the last axis
+    ndim = len(modes)
+    index = []
+    for j in range(ndim - 1):
+        n, m = sizes[j], modes[j]
+        shape = [1] * (ndim - 1)
+        shape[j] = 2 * m
+        index.append(torch.cat([torch.arange(m), torch.arange(n - m, n)]).view(shape).to(device))
+    return tuple(index) + (slice(None, modes[-1]),)
+
+
+def _overlapping(sizes, modes):
+    return any(2 * m > n for n, m in zip(sizes, modes))
+
+
+def gather_modes(x_ft, modes):
+    """(batch, channel, n_1, ..., n_d//2+1) spectrum -> (batch, channel, 2*m_1, ..., m_d) block"""
+    index = _corner_index(tuple(x_ft.shape[2:-1]), tuple(modes), x_ft.device)
+    return x_ft[(slice(None), slice(None)) + index]
+
+
+def split_corners(block, modes):
+    """Views of the corners of a gathered block, in the order of weights1, weights2, ..."""
+    ndim = len(modes)
+    shape = list(block.shape[:2])
+    for m in modes[:-1]:
+        shape += [2, m]
+    shape.append(modes[-1])
+    block = block.reshape(shape)
+
+    corners = []
+    for n_high in range(ndim):
+        for high in itertools.combinations(range(ndim - 1), n_high):
+            index = (slice(None), slice(None))
+            for j in range(ndim - 1):
+                index += (1 if j in high else 0, slice(None))
+            corners.append(block[index])
+    return corners
+
+
+def scatter_modes(out_ft, block, modes):
+    """Write a gathered block back into the retained corners of out_ft"""
+    sizes = tuple(out_ft.shape[2:-1])
+    if _overlapping(sizes, modes):
+        # the corners overlap when 2*m > n; assign them one after the other so
+        # that later corners win, exactly as the per-corner path does
+        for sl, corner in zip(corner_slices(modes), split_corners(block, modes)):
+            out_ft[(slice(None), slice(None)) + sl] = corner
+    else:
+        index = _corner_index(sizes, tuple(modes), out_ft.device)
+        out_ft[(slice(None), slice(None)) + index] = block
+    return out_ft
+
+
+def pack_weights(weights, modes, mode_major=False):
+    """Stack the corner weights (in_channel, out_channel, m_1, ..., m_d) into the
+    (in_channel, out_channel, 2*m_1, ..., 2*m_{d-1}, m_d) layout of a gathered block,
+    or with mode_major=True into (2*m_1 * ... * 2*m_{d-1} * m_d, in_channel, out_channel)
+    """
+    ndim = len(modes)
+    if ndim == 1:
+        w = weights[0]
+        return w.permute(2, 0, 1).contiguous() if mode_major else w
+
+    w = torch.stack([weights[c] for c in _block_corner_order(ndim)])
+    in_channels, out_channels = w.shape[1], w.shape[2]
+    w = w.view((2,) * (ndim - 1) + (in_channels, out_channels) + tuple(modes))
+    # (2, ..., 2, i, o, m_1, ..., m_d) -> (i, o, 2, m_1, ..., 2, m_{d-1}, m_d), or
+    #                                  -> (2, m_1, ..., 2, m_{d-1}, m_d, i, o) for mode_major
+    perm = []
+    for j in range(ndim - 1):
+        perm += [j, ndim + 1 + j]
+    perm.append(2 * ndim)
+    if mode_major:
+        return w.permute(perm + [ndim - 1, ndim]).reshape(-1, in_channels, out_channels)
+    perm = [ndim - 1, ndim] + perm
+    return w.permute(perm).reshape((in_channels, out_channels) + tuple(2 * m for m in modes[:-1]) + (modes[-1],))
+
+
+def corner_weights(weights, modes):
+    """Views (in_channel, out_channel, m_1, ..., m_d) of the corners of mode-major weights
+    (2*m_1 * ... * 2*m_{d-1} * m_d, in_channel, out_channel), in the order of weights1, weights2, ...
+    (the inverse of pack_weights(..., mode_major=True))
+    """
+    ndim = len(modes)
+    shape = ()
+    for m in modes[:-1]:
+        shape += (2, m)
+    w = weights.view(shape + (modes[-1],) + tuple(weights.shape[1:]))
+
+    perm = [ndim, ndim + 1] + list(range(ndim))
+    corners = []
+    for n_high in range(ndim):
+        for high in itertools.combinations(range(ndim - 1), n_high):
+            index = ()
+            for j in range(ndim - 1):
+                index += (1 if j in high else 0, slice(None))
+            corners.append(w[index].permute(perm))
+    return corners
+
+
+@lru_cache(maxsize=None)
+def _mul_equation(ndim):
+    axes = string.ascii_lowercase[-ndim:]
+    return "bi{0},io{0}->bo{0}".format(axes)
+
+
+def compl_mul(a, b):
+    # (batch, in_channel, x, ...), (in_channel, out_channel, x, ...) -> (batch, out_channel, x, ...)
+    return torch.einsum(_mul_equation(a.dim() - 2), a, b)
+
+
+@lru_cache(maxsize=None)
+def _mode_major_equation(ndim):
+    axes = string.ascii_lowercase[-ndim:]
+    return "bi{0},{0}io->bo{0}".format(axes)
+
+
+def mode_major_mul(a, w):
+    # (batch, in_channel, x, ...), (x * ..., in_channel, out_channel) -> (batch, out_channel, x, ...)
+    return torch.einsum(_mode_major_equation(a.dim() - 2), a, w.view(tuple(a.shape[2:]) + tuple(w.shape[1:])))
+
+
+################################################################
+# channel mixing backends
+################################################################
+#
+# The spectral layers store their weights mode-major, as one
+#     (2*m_1 * ... * 2*m_{d-1} * m_d, in_channel, out_channel)
+# tensor in the order of the gathered block, which every backend contracts as
+# stored (weights1, weights2, ... are views of it, see corner_weights).
+#
+# einsum : torch.einsum over (batch, in_channel, modes) x (modes, in_channel, out_channel),
+#          a batched complex GEMM over the modes
+# bmm    : a single real batched GEMM, the real and imaginary parts of the input
+#          stacked as rows [x_r; x_i] against the (modes, in_channel, 2*out_channel)
+#          real view of the weights, whose columns interleave w_r and w_i
+# gauss  : three real batched GEMMs (Gauss' trick) on the real and imaginary views
+#          x_r w_r - x_i w_i = t1 - t2,  x_r w_i + x_i w_r = t3 - t1 - t2
+#          with t3 = (x_r + x_i)(w_r + w_i), w_r + w_i being built per call
+# auto   : the fastest of the above, measured once per problem size
+#
+# Lists of corner weights (the factorized layers of core.py) are packed
+# mode-major first, except for einsum with gradients, which contracts every
+# corner against its own weight.
+
+
+CONTRACTIONS = ['einsum', 'bmm', 'gauss']
+
+
+class PackedWeightCache(object):
+    """
+    Packed forms of weights, reused while the weights do not change: the
+    mode-major stack of a list of corner weights, and w_r + w_i for gauss.
+
+    With gradients disabled (evaluation, validation), the weights only change
+    when they are updated in place (optimizer step, load_state_dict, to), so a
+    packed form is stored with the (data pointer, version counter) of every
+    weight it is built from and weak references to them, and rebuilt as soon
+    as one of them differs. With gradients enabled the packed form is part of
+    the graph and is built once per forward call. Entries are evicted least
+    recently used first once max_bytes is exceeded, packed forms larger than
+    max_bytes are never cached, so max_bytes=0 disables the cache.
+    """
+    def __init__(self, max_bytes=2**30):
+        self.max_bytes = max_bytes
+        self._packed = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(packed):
+        return packed.numel() * packed.element_size()
+
+    def get(self, weights, modes, form, build):
+        if torch.is_grad_enabled():
+            return build()
+
+        key = (form, tuple(modes), tuple(id(w) for w in weights))
+        versions = tuple((w.data_ptr(), w._version) for w in weights)
+        with self._lock:
+            entry = self._packed.pop(key, None)
+            if entry is not None:
+                refs, entry_versions, packed = entry
+                if entry_versions == versions and all(r() is w for r, w in zip(refs, weights)):
+                    self._packed[key] = entry
+                    return packed
+                self._nbytes -= self._size(packed)
+
+        packed = build()
+        nbytes = self._size(packed)
+        if nbytes > self.max_bytes:
+            return packed
+        with self._lock:
+            # entries of weights that no longer exist (e.g. rebuilt from factors on every call)
+            for dead in [k for k, (refs, _, _) in self._packed.items() if any(r() is None for r in refs)]:
+                self._nbytes -= self._size(self._packed.pop(dead)[2])
+            while self._packed and self._nbytes + nbytes > self.max_bytes:
+                _, (_, _, old) = self._packed.popitem(last=False)
+                self._nbytes -= self._size(old)
+            self._packed[key] = (tuple(weakref.ref(w) for w in weights), versions, packed)
+            self._nbytes += nbytes
+        return packed
+
+    def clear(self):
+        with self._lock:
+            self._packed.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+
+# shared by all spectral layers
+packed_weights = PackedWeightCache()
+
+
+def _bmm_real(x, w):
+    # (M, b, i) x (M, i, o) complex -> (M, b, o) complex with one real bmm of the rows [x_r; x_i] (M, 2b, i)
+    # and the real view (M, i, 2o) of w
+    M, b, i = x.shape
+    o = w.shape[-1]
+    x = torch.view_as_real(x).permute(0, 3, 1, 2).reshape(M, 2*b, i)
+    out = torch.bmm(x, torch.view_as_real(w).reshape(M, i, 2*o)).view(M, 2, b, o, 2)
+    # x_r w_r - x_i w_i, x_r w_i + x_i w_r
+    return torch.complex(out[:, 0, ..., 0] - out[:, 1, ..., 1], out[:, 0, ..., 1] + out[:, 1, ..., 0])
+
+
+def _gauss_sum(w):
+    # w_r + w_i of complex weights
+    w = torch.view_as_real(w)
+    return w[..., 0] + w[..., 1]
+
+
+def _bmm_gauss(x, w, w_s):
+    # (M, b, i) x (M, i, o) complex, with w_s = w_r + w_i -> (M, b, o) complex with three real bmm
+    x_r, x_i = x.real.contiguous(), x.imag.contiguous()
+    t1 = torch.bmm(x_r, w.real)
+    t2 = torch.bmm(x_i, w.imag)
+    t3 = torch.bmm(x_r + x_i, w_s)
+    return torch.complex(t1 - t2, t3 - t1 - t2)
+
+
+def _contract_corners(block, weights, modes):
+    # one einsum per corner of the gathered block against its own weight, written into the output block
+    out = torch.empty((block.shape[0], weights[0].shape[1]) + tuple(block.shape[2:]), dtype=block.dtype, device=block.device)
+    for k, (corner, w) in enumerate(zip(split_corners(block, modes), weights)):
+        # views of out taken after the previous writes, which made out part of the graph
+        split_corners(out, modes)[k].copy_(compl_mul(corner, w))
+    return out
+
+
+def _contract(block, weights, modes, contraction, cache=True):
+    # weights: mode-major tensor, or list of corner weights
+    def packed(form, tensors, build):
+        return packed_weights.get(tensors, modes, form, build) if cache else build()
+
+    if not isinstance(weights, torch.Tensor):
+        corners = weights
+        if contraction == 'einsum' and len(modes) == 1:
+            return compl_mul(block, corners[0])
+        if contraction == 'einsum' and torch.is_grad_enabled():
+            # a packed copy of the weights would be saved for backward, and its gradient built
+            return _contract_corners(block, corners, modes)
+        weights = packed('mode_major', corners, lambda: pack_weights(corners, modes, mode_major=True))
+
+    if contraction == 'einsum':
+        return mode_major_mul(block, weights)
+
+    batchsize, in_channels = block.shape[:2]
+    x = block.reshape(batchsize, in_channels, -1).permute(2, 0, 1)
+    if contraction == 'bmm':
+        out = _bmm_real(x, weights)
+    elif contraction == 'gauss':
+        out = _bmm_gauss(x, weights, packed('gauss', [weights], lambda: _gauss_sum(weights)))
+    else:
+        raise ValueError(f'{contraction} is not supported')
+    return out.permute(1, 2, 0).reshape((batchsize, out.shape[-1]) + tuple(block.shape[2:]))
+
+
+# problem size -> fastest contraction on this machine
+_tuned_contractions = {}
+
+
+def tune_contraction(block, weights, modes, n_repeat=3):
+    """Time every contraction on this problem size and return the fastest (cached)"""
+    shapes = tuple(weights.shape) if isinstance(weights, torch.Tensor) else (len(weights),) + tuple(weights[0].shape)
+    key = (tuple(block.shape), shapes, block.dtype, block.device)
+    if key not in _tuned_contractions:
+        timings = {}
+        with torch.no_grad():
+            for contraction in CONTRACTIONS:
+                # what runs on every training call is timed: the packing of a list of corner
+                # weights and w_r + w_i of gauss, mode-major weights are used as stored
+                _contract(block, weights, modes, contraction, cache=False)
+                if block.is_cuda:
+                    torch.cuda.synchronize(block.device)
+                start = time.perf_counter()
+                for _ in range(n_repeat):
+                    _contract(block, weights, modes, contraction, cache=False)
+                if block.is_cuda:
+                    torch.cuda.synchronize(block.device)
+                timings[contraction] = time.perf_counter() - start
+        _tuned_contractions[key] = min(timings, key=timings.get)
+    return _tuned_contractions[key]
+
+
+def contract(block, weights, modes, contraction='einsum'):
+    """(batch, in_channel, 2*m_1, ..., m_d) block x weights -> (batch, out_channel, 2*m_1, ..., m_d)
+
+    weights: mode-major (2*m_1 * ... * m_d, in_channel, out_channel), or list of corner weights
+    """
+    if contraction == 'auto':
+        contraction = tune_contraction(block, weights, modes)
+    return _contract(block, weights, modes, contraction)
+
+
+def set_contraction(model, contraction):
+    """Select the channel mixing backend of every spectral layer of a model"""
+    if contraction not in CONTRACTIONS + ['auto']:
+        raise ValueError(f'{contraction} is not supported')
+    for module in model.modules():
+        if hasattr(module, 'contraction'):
+            module.contraction = contraction
+    return model
+
+
+def spectral_mul(x_ft, weights, modes, out_ft, fused=True, contraction='einsum'):
+    """Multiply the retained corners of x_ft by their weights and write them into out_ft
+
+    x_ft    : (batch, in_channel, n_1, ..., n_d//2+1) spectrum
+    weights : mode-major weights (2*m_1 * ... * 2*m_{d-1} * m_d, in_channel, out_channel),
+              or list of 2^(d-1) corner weights (in_channel, out_channel, m_1, ..., m_d)
+    out_ft  : (batch, out_channel, n_1, ..., n_d//2+1) spectrum, modified in place
+
+    fused=True gathers all corners, contracts them in a single batched kernel
+    (see contract for the backends) and scatters them back; fused=False issues
+    one einsum per corner.
+    """
+    if fused:
+        block = gather_modes(x_ft, modes)
+        scatter_modes(out_ft, contract(block, weights, modes, contraction), modes)
+    else:
+        if isinstance(weights, torch.Tensor):
+            weights = corner_weights(weights, modes)
+        for sl, w in zip(corner_slices(modes), weights):
+            index = (slice(None), slice(None)) + sl
+            out_ft[index] = compl_mul(x_ft[index], w)
+    return out_ft
+
+
+################################################################
+# truncated DFT by matrix multiplication
+################################################################
+#
+# With n points and m << n retained modes, rfft + irfft compute and invert a
+# full spectrum of which only m modes are used. The truncated transforms are
+# (rows, n) x (n, 2m) and (rows, 2m) x (2m, n) real GEMMs instead, with the
+# real and imaginary parts of each mode interleaved.
+
+# flop rate of a GEMM relative to an FFT of the same data
+GEMM_SPEEDUP = 4.0
+# fewer transformed rows (batch x channels) than this leave the GEMM memory bound
+DFT_MIN_ROWS = 8
+
+
+@lru_cache(maxsize=32)
+def partial_dft_matrices(n, modes, dtype, device):
+    """Forward (n, 2*modes) and inverse (2*modes, n) truncated real DFT matrices,
+    matching torch.fft.rfft(x)[..., :modes] and torch.fft.irfft(x_ft, n)
+    """
+    if modes > n // 2 + 1:
+        raise ValueError(f'{modes} modes exceed the {n // 2 + 1} modes of a {n}-point rfft')
+    k = torch.arange(modes, dtype=torch.float64)
+    theta = 2 * math.pi * torch.outer(torch.arange(n, dtype=torch.float64), k) / n
+    forward = torch.stack([torch.cos(theta), -torch.sin(theta)], dim=-1).reshape(n, 2*modes)
+
+    # irfft counts every mode twice (k and -k), except the mean and the Nyquist mode,
+    # and drops their imaginary parts (sin vanishes on the grid for both)
+    c = torch.full((modes,), 2.0, dtype=torch.float64)
+    c[0] = 1.0
+    if n % 2 == 0 and modes == n // 2 + 1:
+        c[-1] = 1.0
+    inverse = torch.stack([c * torch.cos(theta) / n, -c * torch.sin(theta) / n], dim=-1)
+    inverse = inverse.permute(1, 2, 0).reshape(2*modes, n)
+    return forward.to(device=device, dtype=dtype), inverse.to(device=device, dtype=dtype)
+
+
+def use_partial_dft(n, modes, rows):
+    """Whether the truncated DFT GEMMs beat rfft + irfft for rows signals of n points keeping modes modes
+
+    An FFT costs ~2.5 n log2(n) flops per real signal and direction, the GEMM
+    4 n modes flops, at a GEMM_SPEEDUP times higher rate.
+    """
+    if modes > n // 2 + 1 or rows < DFT_MIN_ROWS:
+        return False
+    return 4 * modes <= GEMM_SPEEDUP * 2.5 * math.log2(n)
+
+
+def choose_transform(transform, n, modes, rows):
+    """Resolve transform = fft, dft or auto into fft or dft"""
+    if transform == 'auto':
+        return 'dft' if use_partial_dft(n, modes, rows) else 'fft'
+    if transform not in ['fft', 'dft']:
+        raise ValueError(f'{transform} is not supported')
+    return transform
+
+
+def dft_mul(x, weights, modes, contraction='einsum'):
+    """1D spectral layer with truncated DFT matrices: (batch, in_channel, n) -> (batch, out_channel, n)"""
+    m = modes[0]
+    forward, inverse = partial_dft_matrices(x.size(-1), m, x.dtype, x.device)
+    x_ft = torch.view_as_complex(torch.matmul(x, forward).view(*x.shape[:-1], m, 2))
+    out_ft = contract(x_ft, weights, modes, contraction)
+    return torch.matmul(torch.view_as_real(out_ft).reshape(*out_ft.shape[:-1], 2*m), inverse)
+
+
+################################################################
+# output spectrum workspace
+################################################################
+
+
+class SpectrumWorkspace(object):
+    """
+    Zero-initialized output spectra, reused across forward calls.
+
+    Every spectral layer writes the same retained-mode slabs of a buffer of a
+    given shape and leaves the high modes zero, so a buffer keyed by shape,
+    dtype, device, layout and the written modes only has to be zeroed once. Buffers are
+    kept per thread (an evaluation thread never shares one with training) and
+    evicted least recently used first once max_bytes is exceeded; buffers larger
+    than max_bytes are never cached, so max_bytes=0 disables the workspace.
+    Threads are keyed by their Thread object, whose identifier, unlike
+    threading.get_ident(), is never reused by a later thread, and the buffers of
+    threads that have finished are dropped with the next allocation.
+
+    Autograd: each call returns a fresh detached tensor on the cached storage.
+    The writes into it start a new history, so two forward calls never chain
+    their graphs, and since the detached tensor shares the version counter of
+    the storage, any backward that had saved a previous spectrum would raise
+    instead of silently reading overwritten values (irfftn and the slab
+    assignment save none).
+    """
+    def __init__(self, max_bytes=2**31):
+        self.max_bytes = max_bytes
+        self._buffers = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def zeros(self, shape, dtype, device, modes, channels_last=False):
+        shape = tuple(shape)
+        nbytes = torch.Size(shape).numel() * torch.empty((), dtype=dtype).element_size()
+        if nbytes > self.max_bytes:
+            return torch.zeros(shape, dtype=dtype, device=device)
+
+        key = (threading.current_thread(), shape, dtype, torch.device(device), tuple(modes), channels_last)
+        with self._lock:
+            buf = self._buffers.pop(key, None)
+            if buf is None:
+                for old_key in [k for k in self._buffers if not k[0].is_alive()]:
+                    old = self._buffers.pop(old_key)
+                    self._nbytes -= old.numel() * old.element_size()
+                while self._buffers and self._nbytes + nbytes > self.max_bytes:
+                    _, old = self._buffers.popitem(last=False)
+                    self._nbytes -= old.numel() * old.element_size()
+                buf = torch.zeros(shape, dtype=dtype, device=device)
+                self._nbytes += nbytes
+            self._buffers[key] = buf
+        return buf.detach()
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+
+# shared by all spectral layers
+workspace = SpectrumWorkspace()
+
+
+################################################################
+# channels-last layout
+################################################################
+#
+# A channels-last layer keeps its activations as (batch, n_1, ..., n_d, channel):
+# the FFTs run over axes 1..d and the spectra are (batch, n_1, ..., n_d//2+1, channel).
+# The corner gather, contraction and scatter work on the channels-first view
+# movedim(-1, 1) of such a spectrum, which is a stride permutation, not a copy.
+
+
+def spatial_dims(x, channels_last=False):
+    return list(range(1, x.dim() - 1)) if channels_last else list(range(2, x.dim()))
+
+
+def spatial_sizes(x, channels_last=False):
+    return tuple(x.shape[1:-1]) if channels_last else tuple(x.shape[2:])
+
+
+def channels_first(x, channels_last=False):
+    """(batch, channel, ...) view of a channels-last tensor"""
+    return x.movedim(-1, 1) if channels_last else x
+
+
+def spectrum_shape(batchsize, channels, sizes, channels_last=False):
+    """Shape of the rfftn spectrum of a (batch, channel, *sizes) signal in the given layout"""
+    freqs = tuple(sizes[:-1]) + (sizes[-1]//2 + 1,)
+    return (batchsize,) + freqs + (channels,) if channels_last else (batchsize, channels) + freqs
+
+
+################################################################
+# memory-lean autograd of a spectral layer
+################################################################
+#
+# rfftn -> gather corners -> mix -> scatter -> irfftn is linear in x apart from
+# the mixing, so backward only needs the gathered input block. Autograd of the
+# plain sequence keeps the full x_ft and out_ft spectra of every layer instead.
+#
+# Adjoints (c = multiplicity of a mode of the real-to-complex axis in the full
+# spectrum: 1 for the zero and the Nyquist mode, 2 otherwise):
+#     irfftn(., norm) : grad_out_ft = c * rfftn(grad, norm=dual)
+#     rfftn(., norm)  : grad_x      = irfftn(grad_x_ft / c, norm=dual)
+# restricted to the retained corners, with dual(backward) = forward and vice versa.
+
+
+_DUAL_NORM = {'backward': 'forward', 'forward': 'backward', 'ortho': 'ortho'}
+
+
+@lru_cache(maxsize=64)
+def _hermitian_multiplicity(n, m, device):
+    c = torch.full((m,), 2.0, device=device)
+    c[0] = 1.0
+    if n % 2 == 0 and m > n // 2:
+        c[n // 2] = 1.0
+    return c
+
+
+class LeanSpectralFunction(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x, modes, norm, mix, channels_last, *params):
+        dims, sizes = spatial_dims(x, channels_last), spatial_sizes(x, channels_last)
+        # contiguous: in 1d the gathered block is a slice that would keep x_ft alive
+        block = gather_modes(channels_first(torch.fft.rfftn(x, dim=dims, norm=norm), channels_last), modes).contiguous()
+        out_block = mix(block)
+        out_ft = workspace.zeros(spectrum_shape(x.shape[0], out_block.shape[1], sizes, channels_last),
+                                 out_block.dtype, x.device, modes, channels_last=channels_last)
+        scatter_modes(channels_first(out_ft, channels_last), out_block, modes)
+
+        ctx.save_for_backward(block)
+        ctx.params = params
+        ctx.modes, ctx.norm, ctx.mix, ctx.channels_last, ctx.sizes = modes, norm, mix, channels_last, sizes
+        return torch.fft.irfftn(out_ft, s=sizes, dim=dims, norm=norm)
+
+    @staticmethod
+    def backward(ctx, grad):
+        block, = ctx.saved_tensors
+        modes, sizes, channels_last, dual = ctx.modes, ctx.sizes, ctx.channels_last, _DUAL_NORM[ctx.norm]
+        dims = spatial_dims(grad, channels_last)
+        c = _hermitian_multiplicity(sizes[-1], modes[-1], grad.device)
+
+        grad_out = gather_modes(channels_first(torch.fft.rfftn(grad, dim=dims, norm=dual), channels_last), modes) * c
+
+        # recompute the mixing of the saved block, the only non-linear-in-x step
+        need_params = ctx.needs_input_grad[5:]
+        params = [p for p, need in zip(ctx.params, need_params) if need]
+        with torch.enable_grad():
+            block = block.detach().requires_grad_()
+            out_block = ctx.mix(block)
+        grads = list(torch.autograd.grad(out_block, [block] + params, grad_out, allow_unused=True))
+
+        grad_x = None
+        if ctx.needs_input_grad[0]:
+            grad_x_ft = torch.zeros(spectrum_shape(grad.shape[0], block.shape[1], sizes, channels_last),
+                                    dtype=block.dtype, device=grad.device)
+            scatter_modes(channels_first(grad_x_ft, channels_last), grads[0] / c, modes)
+            grad_x = torch.fft.irfftn(grad_x_ft, s=sizes, dim=dims, norm=dual)
+
+        grad_params = [grads.pop(1) if need else None for need in need_params]
+        return (grad_x, None, None, None, None, *grad_params)
+
+
+def lean_spectral(x, modes, mix, params, norm='backward', channels_last=False):
+    """irfftn(scatter(mix(gather(rfftn(x))))) keeping only the gathered input block for backward
+
+    x      : (batch, in_channel, n_1, ..., n_d) real input, or (batch, n_1, ..., n_d, in_channel)
+             with channels_last=True
+    mix    : function of the (batch, in_channel, 2*m_1, ..., m_d) block returning the
+             (batch, out_channel, 2*m_1, ..., m_d) block, recomputed in backward
+    params : the parameters mix depends on, which receive gradients
+
+    Overlapping corners (2*m > n) are not invertible by a gather, and go through
+    plain autograd.
+    """
+    modes = tuple(modes)
+    sizes = spatial_sizes(x, channels_last)
+    if _overlapping(sizes[:-1], modes):
+        dims = spatial_dims(x, channels_last)
+        x_ft = torch.fft.rfftn(x, dim=dims, norm=norm)
+        out_block = mix(gather_modes(channels_first(x_ft, channels_last), modes))
+        out_ft = torch.zeros(spectrum_shape(x.shape[0], out_block.shape[1], sizes, channels_last),
+                             dtype=out_block.dtype, device=x.device)
+        scatter_modes(channels_first(out_ft, channels_last), out_block, modes)
+        return torch.fft.irfftn(out_ft, s=sizes, dim=dims, norm=norm)
+    return LeanSpectralFunction.apply(x, modes, norm, mix, channels_last, *params)
@@ -4,6 +4,9 @@ from .core import FactorizedSpectralConv2d, JointFactorizedSpectralConv1d, Facto
 
 
 class FactorizedFNO3d(nn.Module):
+    # default for modules pickled before the option existed
+    channels_last = False
+
     def __init__(self, modes_height, modes_width,  modes_depth, width, fc_channels=256, n_layers=4,
                 joint_factorization=True, non_linearity=F.gelu,
                 rank=1.0, factorization='cp', fixed_rank_modes=False,
@@ -11,7 +14,9 @@ class FactorizedFNO3d(nn.Module):
                 verbose=True, fft_contraction='complex',
                 fft_norm='backward',
                 mlp=False,
-                decomposition_kwargs=dict()):
+                decomposition_kwargs=dict(),
+                implementation='reconstructed',
+                channels_last=False):
         super().__init__()
         self.modes_height = modes_height
         self.modes_width = modes_width
@@ -29,6 +34,8 @@ class FactorizedFNO3d(nn.Module):
         self.decomposition_kwargs = decomposition_kwargs
         self.fft_norm = fft_norm
         self.verbose = verbose
+        # (batch, height, width, ..., channel) activations inside the model, no permutes
+        self.channels_last = channels_last
     
         if Block is None:
             Block = FactorizedSpectralConv3d
@@ -45,6 +52,8 @@ class FactorizedFNO3d(nn.Module):
                                factorization=factorization, 
                                fixed_rank_modes=fixed_rank_modes, 
                                decomposition_kwargs=decomposition_kwargs,
+                               implementation=implementation,
+                               channels_last=channels_last,
                                mlp=mlp,
                                n_layers=n_layers)
         else:
@@ -54,6 +63,8 @@ class FactorizedFNO3d(nn.Module):
                                               factorization=factorization, 
                                               fixed_rank_modes=fixed_rank_modes, 
                                               decomposition_kwargs=decomposition_kwargs,
+                                              implementation=implementation,
+                                              channels_last=channels_last,
                                               mlp=mlp,
                                               n_layers=1) for _ in range(n_layers)])
         self.linears = nn.ModuleList([nn.Conv3d(self.width, self.width, 1) for _ in range(n_layers)])
@@ -62,17 +73,27 @@ class FactorizedFNO3d(nn.Module):
         self.fc1 = nn.Linear(self.width, fc_channels)
         self.fc2 = nn.Linear(fc_channels, 1)
 
+    def _linear(self, i, x):
+        # pointwise linears[i], as a Linear over the channel axis of channels last activations
+        if self.channels_last:
+            return F.linear(x, self.linears[i].weight.flatten(1), self.linears[i].bias)
+        return self.linears[i](x)
+
     def forward(self, x, super_res=1):
         #grid = self.get_grid(x.shape, x.device)
         #x = torch.cat((x, grid), dim=-1)
         #x = self.fc0(x)
         #x = x.permute(0, 3, 1, 2)
 
-        x = x.permute(0,2,3,4,1)
-        x = self.fc0(x)
-        x = x.permute(0,4,1,2,3)
+        if self.channels_last:
+            x = self.fc0(x.movedim(1, -1))
+            x = F.pad(x, [0, 0, 0, self.domain_padding])
+        else:
+            x = x.permute(0,2,3,4,1)
+            x = self.fc0(x)
+            x = x.permute(0,4,1,2,3)
 
-        x = F.pad(x, [0, self.domain_padding])
+            x = F.pad(x, [0, self.domain_padding])
 
         for i in range(self.n_layers):
             if super_res > 1 and i == (self.n_layers - 1):
@@ -81,13 +102,16 @@ class FactorizedFNO3d(nn.Module):
                 super_res = 1
 
             x1 = self.convs[i](x) #, super_res=super_res)
-            x2 = self.linears[i](x)
+            x2 = self._linear(i, x)
             x = x1 + x2
             if i < (self.n_layers - 1):
                 x = self.non_linearity(x)
 
-        x = x[..., :-self.domain_padding]
-        x = x.permute(0, 2, 3, 4, 1)
+        if self.channels_last:
+            x = x[..., :-self.domain_padding, :]
+        else:
+            x = x[..., :-self.domain_padding]
+            x = x.permute(0, 2, 3, 4, 1)
         x = self.fc1(x)
         x = self.non_linearity(x)
         x = self.fc2(x)
@@ -96,13 +120,18 @@ class FactorizedFNO3d(nn.Module):
 
 
 class FactorizedFNO2d(nn.Module):
+    # default for modules pickled before the option existed
+    channels_last = False
+
     def __init__(self, modes_height, modes_width,  width, fc_channels=256, n_layers=4,
                 joint_factorization=True, non_linearity=F.gelu,
                 rank=1.0, factorization='cp', fixed_rank_modes=False,
                 domain_padding=9, in_channels=3, Block=None,
                 verbose=True, fft_contraction='complex',
                 fft_norm='backward',
-                decomposition_kwargs=dict()):
+                decomposition_kwargs=dict(),
+                implementation='reconstructed',
+                channels_last=False):
         super().__init__()
         """
         input: the solution of the coefficient function and locations (a(x, y), x, y)
@@ -125,6 +154,8 @@ class FactorizedFNO2d(nn.Module):
         self.decomposition_kwargs = decomposition_kwargs
         self.fft_norm = fft_norm
         self.verbose = verbose
+        # (batch, height, width, ..., channel) activations inside the model, no permutes
+        self.channels_last = channels_last
     
         if Block is None:
             Block = FactorizedSpectralConv2d
@@ -141,6 +172,8 @@ class FactorizedFNO2d(nn.Module):
                                factorization=factorization, 
                                fixed_rank_modes=fixed_rank_modes, 
                                decomposition_kwargs=decomposition_kwargs,
+                               implementation=implementation,
+                               channels_last=channels_last,
                                n_layers=n_layers)
         else:
             self.convs = nn.ModuleList([Block(self.width, self.width, self.modes_height,
@@ -150,6 +183,8 @@ class FactorizedFNO2d(nn.Module):
                                               factorization=factorization, 
                                               fixed_rank_modes=fixed_rank_modes, 
                                               decomposition_kwargs=decomposition_kwargs,
+                                              implementation=implementation,
+                                              channels_last=channels_last,
                                               n_layers=1) for _ in range(n_layers)])
         self.linears = nn.ModuleList([nn.Conv2d(self.width, self.width, 1) for _ in range(n_layers)])
         
@@ -157,17 +192,27 @@ class FactorizedFNO2d(nn.Module):
         self.fc1 = nn.Linear(self.width, fc_channels)
         self.fc2 = nn.Linear(fc_channels, 1)
 
+    def _linear(self, i, x):
+        # pointwise linears[i], as a Linear over the channel axis of channels last activations
+        if self.channels_last:
+            return F.linear(x, self.linears[i].weight.flatten(1), self.linears[i].bias)
+        return self.linears[i](x)
+
     def forward(self, x, super_res=1):
         #grid = self.get_grid(x.shape, x.device)
         #x = torch.cat((x, grid), dim=-1)
         #x = self.fc0(x)
         #x = x.permute(0, 3, 1, 2)
 
-        x = x.permute(0,2,3,1)
-        x = self.fc0(x)
-        x = x.permute(0,3,1,2)
+        if self.channels_last:
+            x = self.fc0(x.movedim(1, -1))
+            x = F.pad(x, [0, 0, 0, self.domain_padding, 0, self.domain_padding])
+        else:
+            x = x.permute(0,2,3,1)
+            x = self.fc0(x)
+            x = x.permute(0,3,1,2)
 
-        x = F.pad(x, [0, self.domain_padding, 0, self.domain_padding])
+            x = F.pad(x, [0, self.domain_padding, 0, self.domain_padding])
 
         for i in range(self.n_layers):
             if super_res > 1 and i == (self.n_layers - 1):
@@ -176,13 +221,16 @@ class FactorizedFNO2d(nn.Module):
                 super_res = 1
 
             x1 = self.convs[i](x) #, super_res=super_res)
-            x2 = self.linears[i](x)
+            x2 = self._linear(i, x)
             x = x1 + x2
             if i < (self.n_layers - 1):
                 x = self.non_linearity(x)
 
-        x = x[..., :-self.domain_padding, :-self.domain_padding]
-        x = x.permute(0, 2, 3, 1)
+        if self.channels_last:
+            x = x[..., :-self.domain_padding, :-self.domain_padding, :]
+        else:
+            x = x[..., :-self.domain_padding, :-self.domain_padding]
+            x = x.permute(0, 2, 3, 1)
         x = self.fc1(x)
         x = self.non_linearity(x)
         x = self.fc2(x)
@@ -200,10 +248,14 @@ class FactorizedFNO2d(nn.Module):
 
     
 class FactorizedFNO1d(nn.Module):
+    # default for modules pickled before the option existed
+    channels_last = False
+
     def __init__(self, modes, width, in_channels=2, out_channels=1, n_layers=4, 
                  lifting=None, projection=None, joint_factorization=True,  scale='auto', 
                  non_linearity=nn.GELU, rank=1.0, factorization='tucker', bias=True, 
-                 fixed_rank_modes=False, fft_norm='forward', decomposition_kwargs=dict()):
+                 fixed_rank_modes=False, fft_norm='forward', decomposition_kwargs=dict(), implementation='reconstructed',
+                 channels_last=False):
         super().__init__()
 
         if isinstance(width, int):
@@ -226,9 +278,17 @@ class FactorizedFNO1d(nn.Module):
         self.fno_layers = JointFactorizedSpectralConv1d(modes, width, n_layers=n_layers, joint_factorization=joint_factorization,
                                                         in_channels=init_width, scale=scale, non_linearity=non_linearity,
                                                         rank=rank, factorization=factorization, bias=bias, fixed_rank_modes=fixed_rank_modes, 
-                                                        fft_norm=fft_norm, decomposition_kwargs=decomposition_kwargs)
+                                                        fft_norm=fft_norm, decomposition_kwargs=decomposition_kwargs,
+                                                        implementation=implementation, channels_last=channels_last)
+        # (batch, x, channel) activations inside the model, no permutes
+        self.channels_last = channels_last
                                                         
     def forward(self, x, s=None):
+        if self.channels_last:
+            x = self.lifting(x.movedim(1, -1))
+            x = self.fno_layers(x, s=s)
+            return self.projection(x).movedim(-1, 1)
+
         #Lifting
         x = x.permute(0,2,1)
         x = self.lifting(x)
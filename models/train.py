@@ -1,15 +1,25 @@
 import math
+import queue
+import resource
+import contextlib
+import multiprocessing as mp
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import operator
 from functools import reduce
+from timeit import default_timer
 from .basics import SpectralConv1d
-from .utils import _get_act, add_padding, remove_padding
+from .spectral import choose_transform
+from .utils import _get_act, add_padding, remove_padding, get_pad_nums, fold_normalizers, normalize_grid_channels
 
 from .adam import Adam
-from .losses import LpLoss
-from .normalizer import UnitGaussianNormalizer
+from .losses import LpLoss, LpMetrics
+from .normalizer import UnitGaussianNormalizer, StreamingGaussianNormalizer
+from .data import TensorBatchLoader, Prefetcher
+from .evaluation import evaluate, is_eval_epoch, fill_losses, AsyncEvaluator
+from .checkpoint import CheckpointWriter, latest_checkpoint, get_rng_state, set_rng_state, to_cpu
+from .distributed import init_distributed, local_device, all_reduce_sum, shared_normalizer
 from .fourier1d import FNN1d
 from .fourier2d import FNN2d
 from .fourier3d import FNN3d
@@ -23,14 +33,25 @@ from .Galerkin import GkNN
 #                     list(p.size()+(2,) if p.is_complex() else p.size()))
 #     return c
 
-def FNN_cost(Nx, config, dim):
+# batch_size: samples per forward call of the layers (the micro-batch of one rank), which decides
+# transform = 'auto'; by default config['train']['micro_batch_size'] if it is a number, else
+# config['train']['batch_size'], i.e. a single process. A partial last batch may resolve differently.
+def FNN_cost(Nx, config, dim, batch_size=None):
     pad_ratio = config['model']['pad_ratio']
     modes = config['model']['modes']
     layers = config['model']['layers']
     fc_dim = config['model']['fc_dim']
     in_dim = config['model']['in_dim']
     out_dim = config['model']['out_dim']
-    Np = (Nx + math.floor(pad_ratio * Nx))**dim
+    pad_policy = config['model']['pad_policy'] if 'pad_policy' in config['model'].keys() else 'ratio'
+    Np = (Nx + get_pad_nums([Nx], pad_ratio, pad_policy)[0])**dim
+    # 1d layers may replace the FFTs by truncated DFT GEMMs (see spectral.choose_transform)
+    transform = config['model']['transform'] if 'transform' in config['model'].keys() else 'fft'
+    if batch_size is None:
+        train = config['train'] if 'train' in config.keys() else {}
+        batch_size = train['batch_size'] if 'batch_size' in train.keys() else 1
+        if 'micro_batch_size' in train.keys() and train['micro_batch_size'] != 'auto':
+            batch_size = min(train['micro_batch_size'], batch_size)
     
     cost_act = 1
     # lifting operator
@@ -39,8 +60,12 @@ def FNN_cost(Nx, config, dim):
         # number of modes in each direction
         mode = mode ** dim 
         df_in, df_out = layers[i], layers[i+1]
-        # fourier series transform, inverse fourier series transform, linear
-        cost += df_in*5*Np*math.log(Np)+df_out*5*Np*math.log(Np)+mode*df_out*(2*df_in-1) 
+        if dim == 1 and choose_transform(transform, Np, mode, batch_size*df_in) == 'dft':
+            # truncated fourier series transform and its inverse as (2 mode x Np) real matrix products, linear
+            cost += df_in*4*Np*mode+df_out*4*Np*mode+mode*df_out*(2*df_in-1)
+        else:
+            # fourier series transform, inverse fourier series transform, linear
+            cost += df_in*5*Np*math.log(Np)+df_out*5*Np*math.log(Np)+mode*df_out*(2*df_in-1) 
         # activation function
         if i != len(modes)-1:
             cost += df_out*Np*cost_act
@@ -54,8 +79,12 @@ def FNN_cost(Nx, config, dim):
         
     return cost
     
+# optional FNO settings, passed to FNN1d..FNN4d when present in config['model']
+FNO_OPTIONS = ['contraction', 'lean', 'checkpoint', 'pad_policy', 'channels_last', 'grid_channels']
+
 def construct_model(config, bases=None, wbases=None):
     dim = config['model']['dim']
+    options = {key: config['model'][key] for key in FNO_OPTIONS if key in config['model'].keys()}
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     #######################################################################
@@ -71,7 +100,9 @@ def construct_model(config, bases=None, wbases=None):
                 in_dim=config['model']['in_dim'], 
                 out_dim=config['model']['out_dim'],
                 act=config['model']['act'],
-                pad_ratio=config['model']['pad_ratio']).to(device)
+                pad_ratio=config['model']['pad_ratio'],
+                transform=(config['model']['transform'] if 'transform' in config['model'].keys() else 'fft'),
+                **options).to(device)
             
             
         elif dim == 2:
@@ -84,7 +115,8 @@ def construct_model(config, bases=None, wbases=None):
                         in_dim=config['model']['in_dim'], 
                         out_dim=config['model']['out_dim'],
                         act=config['model']['act'],
-                        pad_ratio=config['model']['pad_ratio']).to(device)
+                        pad_ratio=config['model']['pad_ratio'],
+                        **options).to(device)
             
         elif dim == 3:
             modes1 = (config['model']['modes1'] if 'modes1' in config['model'].keys() else config['model']['modes'])
@@ -98,7 +130,8 @@ def construct_model(config, bases=None, wbases=None):
                         in_dim=config['model']['in_dim'], 
                         out_dim=config['model']['out_dim'],
                         act=config['model']['act'],
-                        pad_ratio=config['model']['pad_ratio']).to(device)
+                        pad_ratio=config['model']['pad_ratio'],
+                        **options).to(device)
             
         elif dim == 4:
             modes1 = (config['model']['modes1'] if 'modes1' in config['model'].keys() else config['model']['modes'])
@@ -113,7 +146,8 @@ def construct_model(config, bases=None, wbases=None):
                         in_dim=config['model']['in_dim'], 
                         out_dim=config['model']['out_dim'],
                         act=config['model']['act'],
-                        pad_ratio=config['model']['pad_ratio']).to(device)
+                        pad_ratio=config['model']['pad_ratio'],
+                        **options).to(device)
                 
         else:
             print("FNO with Dim = ", dim, ", which has not been implemented.")
@@ -140,8 +174,133 @@ def construct_model(config, bases=None, wbases=None):
     return model 
 
 
+def _probe_step(config, input_shape, batch_size, n_repeat, result):
+    # training steps (forward, backward, Adam) of a fresh model, reports (peak bytes, samples/sec)
+    try:
+        torch.manual_seed(0)
+        model = construct_model(config)
+        device = next(model.parameters()).device
+        optimizer = Adam(model.parameters(), lr=1e-3)
+        x = torch.randn(batch_size, *input_shape, device=device)
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+        # one warm up step (Adam state), then n_repeat timed steps
+        for i in range(n_repeat + 1):
+            if i == 1:
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                start = default_timer()
+            optimizer.zero_grad()
+            model(x).sum().backward()
+            optimizer.step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = default_timer() - start
+        if device.type == 'cuda':
+            peak = torch.cuda.max_memory_allocated(device)
+        else:
+            # ru_maxrss is in kilobytes on Linux
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        result.put((peak, batch_size * n_repeat / elapsed))
+    except RuntimeError:
+        # out of memory
+        result.put(None)
+
+
+def probe_batch_size(config, input_shape, memory_limit, max_batch_size=4096, n_repeat=3, verbose=True):
+    '''
+    largest batch size of construct_model(config) whose training step fits memory_limit bytes,
+    input_shape = (n_x, ..., in_dim) is the shape of one sample (without the grid channels
+    the model generates itself when config['model'] sets grid_channels).
+
+    Every candidate runs real training steps in a fresh process, the peak is the
+    allocator peak on GPU and the peak resident set size on CPU (torch itself
+    included, the training data not); a process that fails or gets killed does
+    not fit. The batch size doubles until a step does not fit, then a binary
+    search between the last two sizes finds the largest one that does.
+    Returns (batch_size, peak bytes, samples/sec).
+    '''
+    ctx = mp.get_context('spawn')
+    tried = {}
+
+    def fits(batch_size):
+        result = ctx.Queue()
+        process = ctx.Process(target=_probe_step, args=(config, input_shape, batch_size, n_repeat, result))
+        process.start()
+        process.join()
+        try:
+            tried[batch_size] = result.get(timeout=1)
+        except queue.Empty:
+            tried[batch_size] = None
+        ok = tried[batch_size] is not None and tried[batch_size][0] <= memory_limit
+        if verbose:
+            if tried[batch_size] is None:
+                print("batch_size : ", batch_size, " failed")
+            else:
+                print("batch_size : ", batch_size, " peak : %.1fMB" % (tried[batch_size][0] / 2**20),
+                      " samples/sec : %.1f" % tried[batch_size][1], "" if ok else " over the limit")
+        return ok
+
+    if not fits(1):
+        raise ValueError(f'a batch of one sample does not fit memory_limit = {memory_limit} bytes')
+    low, high = 1, None
+    while high is None and low < max_batch_size:
+        if fits(min(2 * low, max_batch_size)):
+            low = min(2 * low, max_batch_size)
+        else:
+            high = min(2 * low, max_batch_size)
+    # low fits, high does not
+    while high is not None and high - low > 1:
+        mid = (low + high) // 2
+        if fits(mid):
+            low = mid
+        else:
+            high = mid
+
+    return (low,) + tried[low]
+
+
+def given_normalizer(config, key):
+    # config['train'][key]: None, a normalizer, or the path of a StreamingGaussianNormalizer.save
+    normalizer = config['train'][key] if key in config['train'].keys() else None
+    if isinstance(normalizer, str):
+        normalizer = StreamingGaussianNormalizer.load(normalizer)
+    return normalizer
+
+
+def saved_bytes_per_sample(model, x):
+    '''
+    bytes autograd keeps for the backward pass of model(x) (parameters excluded,
+    each storage counted once), plus the output, per sample of x
+    '''
+    params = set(p.data_ptr() for p in model.parameters())
+    saved = {}
+    def pack(t):
+        if t.data_ptr() not in params:
+            saved[t.data_ptr()] = max(saved.get(t.data_ptr(), 0), t.numel() * t.element_size())
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        out = model(x)
+    return (sum(saved.values()) + out.numel() * out.element_size()) / x.shape[0]
+
+
+def micro_batch_size_for_budget(model, x, memory_budget, batch_size):
+    '''
+    largest micro-batch (at most batch_size) of samples like x that fits memory_budget bytes:
+    the weights, their gradients and the two Adam moments, plus twice the saved activations
+    of every sample (the activations and their gradients during the backward pass)
+    '''
+    static = 4 * sum(p.numel() * p.element_size() for p in model.parameters())
+    per_sample = 2 * saved_bytes_per_sample(model, x)
+    micro_batch_size = int((memory_budget - static) // per_sample)
+    if micro_batch_size < 1:
+        raise ValueError(f'a single sample does not fit memory_budget = {memory_budget} bytes')
+    return min(micro_batch_size, batch_size)
+
+
 # x_train, y_train, x_test, y_test are [n_data, n_x, n_channel] arrays
-def FNN_train(x_train, y_train, x_test, y_test, config, model, save_model_name="./FNO_model"):
+# resume_from: checkpoint file written by a previous run, or True for the latest checkpoint of save_model_name
+def FNN_train(x_train, y_train, x_test, y_test, config, model, save_model_name="./FNO_model", resume_from=None):
     n_train, n_test = x_train.shape[0], x_test.shape[0]
     train_rel_l2_losses = []
     test_rel_l2_losses = []
@@ -149,32 +308,132 @@ def FNN_train(x_train, y_train, x_test, y_test, config, model, save_model_name="
     normalization_x, normalization_y, normalization_dim = config["train"]["normalization_x"], config["train"]["normalization_y"], config["train"]["normalization_dim"]
     dim = len(x_train.shape) - 2 # n_train, size, n_channel
     
-    cost = FNN_cost(x_train.shape[1], config, dim)
-    
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    # data parallel training, one process per rank started by torchrun; config['train']['batch_size']
+    # stays the global batch size (a multiple of world_size), every rank runs batch_size / world_size
+    # samples of it, on the GPU LOCAL_RANK when CUDA is available
+    distributed = config['train']['distributed'] if 'distributed' in config['train'].keys() else False
+    backend = config['train']['backend'] if 'backend' in config['train'].keys() else 'gloo'
+    rank, world_size = init_distributed(backend) if distributed else (0, 1)
+    if config['train']['batch_size'] % world_size != 0:
+        raise ValueError(f"batch_size = {config['train']['batch_size']} is not a multiple of the {world_size} ranks")
+    batch_size = config['train']['batch_size'] // world_size
+    if distributed:
+        device = local_device()
+        model.to(device)
+
+    if resume_from is True:
+        resume_from = latest_checkpoint(save_model_name)
+    # our own checkpoint, it pickles the numpy and python RNG states (refused by weights_only=True)
+    state = torch.load(resume_from, map_location='cpu', weights_only=False) if resume_from is not None else None
+
+    # fold_normalizer: the encode of x and the decode of y become part of fc0 and fc2 of the model,
+    # the data stays raw and the saved model maps raw inputs to raw outputs
+    fold_normalizer = config['train']['fold_normalizer'] if 'fold_normalizer' in config['train'].keys() else False
+    # x_normalizer, y_normalizer: statistics computed beforehand (e.g. cache.cached_normalizer),
+    # used instead of fitting them on x_train, y_train
+    # prefetch: number of batches prepared ahead by prefetch_workers threads (read, copied to device and
+    # encoded), the data is then encoded batch by batch instead of all at once (0: no prefetching)
+    prefetch = config['train']['prefetch'] if 'prefetch' in config['train'].keys() else 0
+    prefetch_workers = config['train']['prefetch_workers'] if 'prefetch_workers' in config['train'].keys() else 2
+    encode_batches = prefetch > 0 and not fold_normalizer
+    # models generating their grid (grid_channels): the x statistics are fitted on the fields and the
+    # grid together, as when the data stored the grid, the fields are encoded with their channels
+    # (x_encoder) and the model encodes the grid with the others (normalize_grid_channels)
+    grid_channels = getattr(model, 'grid_channels', None)
         
     if normalization_x:
-        x_normalizer = UnitGaussianNormalizer(x_train, dim=normalization_dim)
-        x_train = x_normalizer.encode(x_train)
-        x_test = x_normalizer.encode(x_test)
-        x_normalizer.to(device)
+        x_normalizer = given_normalizer(config, 'x_normalizer')
+        if x_normalizer is None and distributed and state is None:
+            x_normalizer = shared_normalizer(x_train, normalization_dim, rank, grid_channels=grid_channels)
+        elif x_normalizer is None and grid_channels is not None:
+            x_normalizer = StreamingGaussianNormalizer(dim=normalization_dim).fit(x_train, grid_channels=grid_channels)
+        elif x_normalizer is None:
+            x_normalizer = UnitGaussianNormalizer(x_train, dim=normalization_dim)
+        if state is not None:
+            x_normalizer.load_state_dict(state['x_normalizer'])
+        x_encoder = x_normalizer
+        if grid_channels is not None:
+            n_fields = x_train.shape[-1]
+            if getattr(x_normalizer, 'n_channels', None) != n_fields + len(grid_channels):
+                raise ValueError('the x normalizer of a model with grid_channels must be fitted on the fields and the grid, '
+                                 'StreamingGaussianNormalizer.fit(x, grid_channels=...)')
+            x_encoder = x_normalizer.channels(0, n_fields)
+            if not fold_normalizer:
+                normalize_grid_channels(model, x_normalizer.channels(n_fields))
+        if not fold_normalizer and not encode_batches:
+            x_train = x_encoder.encode(x_train)
+            x_test = x_encoder.encode(x_test)
+        x_encoder.to(device)
         
     if normalization_y:
-        y_normalizer = UnitGaussianNormalizer(y_train, dim=normalization_dim)
-        y_train = y_normalizer.encode(y_train)
-        y_test = y_normalizer.encode(y_test)
+        y_normalizer = given_normalizer(config, 'y_normalizer')
+        if y_normalizer is None and distributed and state is None:
+            y_normalizer = shared_normalizer(y_train, normalization_dim, rank)
+        elif y_normalizer is None:
+            y_normalizer = UnitGaussianNormalizer(y_train, dim=normalization_dim)
+        if state is not None:
+            y_normalizer.load_state_dict(state['y_normalizer'])
+        if not fold_normalizer and not encode_batches:
+            y_train = y_normalizer.encode(y_train)
+            y_test = y_normalizer.encode(y_test)
         y_normalizer.to(device)
 
+    # the statistics the data is encoded with, saved with the model for the validation scripts
+    model.normalizer_states = {'x': to_cpu(x_encoder.state_dict()) if normalization_x else None,
+                               'y': to_cpu(y_normalizer.state_dict()) if normalization_y else None}
 
-    train_loader = torch.utils.data.DataLoader(torch.utils.data.TensorDataset(x_train, y_train), 
-                                               batch_size=config['train']['batch_size'], shuffle=True)
-    test_loader = torch.utils.data.DataLoader(torch.utils.data.TensorDataset(x_test, y_test), 
-                                               batch_size=config['train']['batch_size'], shuffle=False)
+    if fold_normalizer:
+        fold_normalizers(model, x_normalizer if normalization_x else None, y_normalizer if normalization_y else None)
+    # outputs and targets are decoded before the loss, unless the model already does it
+    decoder = y_normalizer if normalization_y and not fold_normalizer else None
+
+
+    # tensor: TensorBatchLoader (one permutation per epoch, sliced batches), dataloader: torch DataLoader
+    loader = config['train']['loader'] if 'loader' in config['train'].keys() else 'tensor'
+    # with distributed, each rank loads its shard (shuffled: strided and padded, test: contiguous)
+    if loader == 'tensor':
+        train_loader = TensorBatchLoader(x_train, y_train, batch_size=batch_size, shuffle=True,
+                                         num_replicas=world_size, rank=rank)
+        test_loader = TensorBatchLoader(x_test, y_test, batch_size=batch_size, shuffle=False,
+                                        num_replicas=world_size, rank=rank)
+        train_sampler = train_loader
+    elif loader == 'dataloader':
+        train_dataset = torch.utils.data.TensorDataset(x_train, y_train)
+        test_dataset = torch.utils.data.TensorDataset(x_test, y_test)
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset, world_size, rank, shuffle=True) if distributed else None
+        if distributed:
+            chunk = math.ceil(n_test / world_size)
+            test_dataset = torch.utils.data.Subset(test_dataset, range(min(rank*chunk, n_test), min((rank+1)*chunk, n_test)))
+        train_loader = torch.utils.data.DataLoader(train_dataset, sampler=train_sampler,
+                                                   batch_size=batch_size, shuffle=(train_sampler is None))
+        test_loader = torch.utils.data.DataLoader(test_dataset, 
+                                                   batch_size=batch_size, shuffle=False)
+    else:
+        raise ValueError(f'{loader} is not supported')
+
+    if prefetch > 0:
+        if loader != 'tensor':
+            raise ValueError('prefetch is only supported with the tensor loader')
+        batch_x_encoder = x_encoder if encode_batches and normalization_x else None
+        batch_y_encoder = y_normalizer if encode_batches and normalization_y else None
+        def transform(x, y):
+            return (x if batch_x_encoder is None else batch_x_encoder.encode(x)), (y if batch_y_encoder is None else batch_y_encoder.encode(y))
+        train_loader = Prefetcher(train_loader, transform, device, prefetch_workers, prefetch)
+        test_loader = Prefetcher(test_loader, transform, device, prefetch_workers, prefetch)
+        train_sampler = train_loader
     
     
     # Load from checkpoint
+    # foreach: multi-tensor Adam step (torch._foreach_* over all parameters)
+    # factored, exp_avg_dtype (e.g. 'bfloat16'): memory-reduced Adam state
+    foreach = config['train']['foreach'] if 'foreach' in config['train'].keys() else False
+    factored = config['train']['factored'] if 'factored' in config['train'].keys() else False
+    exp_avg_dtype = getattr(torch, config['train']['exp_avg_dtype']) if 'exp_avg_dtype' in config['train'].keys() else None
     optimizer = Adam(model.parameters(), betas=(0.9, 0.999),
-                     lr=config['train']['base_lr'], weight_decay=config['train']['weight_decay'])
+                     lr=config['train']['base_lr'], weight_decay=config['train']['weight_decay'], foreach=foreach,
+                     factored=factored, exp_avg_dtype=exp_avg_dtype)
     
     if config['train']['scheduler'] == "MultiStepLR":
         scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer,
@@ -187,64 +446,147 @@ def FNN_train(x_train, y_train, x_test, y_test, config, model, save_model_name="
     else:
         print("Scheduler ", config['train']['scheduler'], " has not implemented.")
 
+    start_ep = 0
+    if state is not None:
+        model.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        scheduler.load_state_dict(state['scheduler'])
+        train_rel_l2_losses, test_rel_l2_losses, test_l2_losses = state['losses']
+        start_ep = state['epoch'] + 1
+
+    # state_dict checkpoints every save_every epochs, written in the background by rank 0, keep_last kept
+    save_every = config['train']['save_every'] if 'save_every' in config['train'].keys() else 10
+    keep_last = config['train']['keep_last'] if 'keep_last' in config['train'].keys() else 3
+    writer = CheckpointWriter(save_model_name, keep_last) if rank == 0 else None
+
+    # DistributedDataParallel broadcasts the weights of rank 0 and averages the gradients,
+    # evaluation and checkpoints use the module itself
+    if distributed:
+        train_model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    else:
+        train_model = model
+
     model.train()
-    myloss = LpLoss(d=1, p=2, size_average=False)
+    # running error sums stay on the device, read once per epoch
+    train_metrics = LpMetrics(d=1, p=2, device=device)
+    test_metrics = LpMetrics(d=1, p=2, device=device)
 
     epochs = config['train']['epochs']
 
+    # test set evaluation every eval_every epochs, at the epochs in eval_at and at the last epoch,
+    # the losses of the other epochs are NaN (eval_fill = 'nan') or the last evaluated value ('hold').
+    # eval_async scores a snapshot of the weights in a background thread while training continues
+    eval_every = config['train']['eval_every'] if 'eval_every' in config['train'].keys() else 1
+    eval_at = set(config['train']['eval_at']) if 'eval_at' in config['train'].keys() else set()
+    eval_fill = config['train']['eval_fill'] if 'eval_fill' in config['train'].keys() else 'nan'
+    eval_async = config['train']['eval_async'] if 'eval_async' in config['train'].keys() else False
+    if eval_fill not in ['nan', 'hold']:
+        raise ValueError(f'{eval_fill} is not supported')
+    if eval_async and distributed:
+        raise ValueError('eval_async is not supported with distributed')
+    evaluator = AsyncEvaluator(model, test_loader, device, decoder) if eval_async else None
+    if state is not None:
+        set_rng_state(state['rng'])
 
-    for ep in range(epochs):
-        train_rel_l2 = 0
+
+    # gradient accumulation: every (effective) batch of batch_size samples runs as micro-batches of
+    # micro_batch_size samples, an int or 'auto' (the largest that fits memory_budget bytes)
+    micro_batch_size = config['train']['micro_batch_size'] if 'micro_batch_size' in config['train'].keys() else batch_size
+    if micro_batch_size == 'auto':
+        micro_batch_size = micro_batch_size_for_budget(model, x_train[:1].to(device), config['train']['memory_budget'], batch_size)
+        if rank == 0:
+            print("micro_batch_size : ", micro_batch_size)
+    # the layers see micro-batches of the per-rank batch
+    cost = FNN_cost(x_train.shape[1], config, dim, min(micro_batch_size, batch_size))
+
+    for ep in range(start_ep, epochs):
+        t_epoch = default_timer()
+        train_metrics.reset()
+        if distributed:
+            train_sampler.set_epoch(ep)
 
         model.train()
-        for x, y in train_loader:
-            x, y = x.to(device), y.to(device)
+        for x_batch, y_batch in train_loader:
+            x_batch, y_batch = x_batch.to(device), y_batch.to(device)
 
-            batch_size_ = x.shape[0]
             optimizer.zero_grad()
-            out = model(x) #.reshape(batch_size_,  -1)
-            if normalization_y:
-                out = y_normalizer.decode(out)
-                y = y_normalizer.decode(y)
+            # the gradients of the micro-batch loss sums add up to the gradient of the batch loss sum,
+            # DDP reduces them once, after the last micro-batch
+            n_micro = math.ceil(x_batch.shape[0] / micro_batch_size)
+            for i, (x, y) in enumerate(zip(x_batch.split(micro_batch_size), y_batch.split(micro_batch_size))):
+                with train_model.no_sync() if distributed and i < n_micro - 1 else contextlib.nullcontext():
+                    batch_size_ = x.shape[0]
+                    out = train_model(x) #.reshape(batch_size_,  -1)
+                    if decoder is not None:
+                        out = decoder.decode(out)
+                        y = decoder.decode(y)
 
-            loss = myloss(out.view(batch_size_,-1), y.view(batch_size_,-1))
-            loss.backward()
+                    loss = train_metrics.update(out.view(batch_size_,-1), y.view(batch_size_,-1)).sum()
+                    # DDP averages the gradients over the ranks, the sum over the global batch is world_size times that
+                    (loss * world_size if distributed else loss).backward()
 
             optimizer.step()
-            train_rel_l2 += loss.item()
-
-        test_l2 = 0
-        test_rel_l2 = 0
-        with torch.no_grad():
-            for x, y in test_loader:
-                x, y = x.to(device), y.to(device)
-                batch_size_ = x.shape[0]
-                out = model(x) #.reshape(batch_size_,  -1)
-
-                if normalization_y:
-                    out = y_normalizer.decode(out)
-                    y = y_normalizer.decode(y)
-
-                test_rel_l2 += myloss(out.view(batch_size_,-1), y.view(batch_size_,-1)).item()
-                test_l2 += myloss.abs(out.view(batch_size_,-1), y.view(batch_size_,-1)).item()
-
 
+        evaluated = is_eval_epoch(ep, epochs, eval_every, eval_at)
+        if evaluated and evaluator is not None:
+            evaluator.submit(ep, model)
+        elif evaluated:
+            test_metrics.reset()
+            evaluate(model, test_loader, device, decoder, test_metrics)
 
 
         scheduler.step()
 
-        train_rel_l2/= n_train
-        test_l2 /= n_test
-        test_rel_l2/= n_test
+        # the only synchronization of the epoch, sums and sample counts over all ranks
+        # (the padded train shards count a few samples twice)
+        sums = torch.cat([train_metrics.sums(), test_metrics.sums(),
+                          train_metrics.sums().new_tensor([train_metrics.n, test_metrics.n])])
+        if distributed:
+            all_reduce_sum(sums)
+        train_rel_l2, _, test_rel_l2, test_l2, n_train_, n_test_ = sums.tolist()
+        if evaluated and evaluator is None:
+            test_l2 /= n_test_
+            test_rel_l2/= n_test_
+        else:
+            test_rel_l2, test_l2 = math.nan, math.nan
+            if evaluator is not None and evaluator.latest() is not None:
+                # printed below, the asynchronous results are stored after training
+                test_rel_l2, test_l2 = evaluator.latest()[1]
+        train_rel_l2/= n_train_
         
+
         train_rel_l2_losses.append(train_rel_l2)
-        test_rel_l2_losses.append(test_rel_l2)
-        test_l2_losses.append(test_l2)
+        test_rel_l2_losses.append(test_rel_l2 if evaluated and evaluator is None else math.nan)
+        test_l2_losses.append(test_l2 if evaluated and evaluator is None else math.nan)
     
 
-        if (ep %10 == 0) or (ep == epochs -1):
+        if ((ep %10 == 0) or (ep == epochs -1)) and rank == 0:
             print("Epoch : ", ep, " Rel. Train L2 Loss : ", train_rel_l2, " Rel. Test L2 Loss : ", test_rel_l2, " Test L2 Loss : ", test_l2)
-            torch.save(model, save_model_name)
+        if prefetch > 0 and rank == 0:
+            # time the training step waited for its batches, the data pipeline is the bottleneck when it is large
+            print("Epoch : ", ep, " Stall : %.3fs" % train_loader.stall, " Epoch time : %.3fs" % (default_timer() - t_epoch))
+
+        if ((ep % save_every == 0) or (ep == epochs -1)) and rank == 0:
+            losses = [list(train_rel_l2_losses), list(test_rel_l2_losses), list(test_l2_losses)]
+            if evaluator is not None:
+                for i, (test_rel_l2, test_l2) in evaluator.finished().items():
+                    losses[1][i], losses[2][i] = test_rel_l2, test_l2
+            writer.save(ep, {'epoch': ep, 'model': model.state_dict(), 'optimizer': optimizer.state_dict(),
+                             'scheduler': scheduler.state_dict(),
+                             'x_normalizer': x_normalizer.state_dict() if normalization_x else None,
+                             'y_normalizer': y_normalizer.state_dict() if normalization_y else None,
+                             'rng': get_rng_state(), 'losses': losses})
     
+    if rank == 0:
+        writer.close()
+        # the whole model, as loaded by the validation scripts
+        torch.save(model, save_model_name)
+
+    if evaluator is not None:
+        for ep, (test_rel_l2, test_l2) in evaluator.close().items():
+            test_rel_l2_losses[ep], test_l2_losses[ep] = test_rel_l2, test_l2
+        print("Epoch : ", epochs-1, " Rel. Test L2 Loss : ", test_rel_l2_losses[-1], " Test L2 Loss : ", test_l2_losses[-1])
+    test_rel_l2_losses = fill_losses(test_rel_l2_losses, eval_fill)
+    test_l2_losses = fill_losses(test_l2_losses, eval_fill)
     
     return train_rel_l2_losses, test_rel_l2_losses, test_l2_losses, cost
\ No newline at end of file
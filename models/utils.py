@@ -3,14 +3,19 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import operator
-from functools import reduce
+from functools import reduce, lru_cache
 import numpy as np
 
 
 
-def add_padding(x, pad_nums):
+def add_padding(x, pad_nums, channels_last=False):
 
-    if x.ndim == 3: #fourier1d
+    if channels_last: # (batch, x, ..., channel), the channel axis is not padded
+        pad = [0, 0]
+        for pad_num in reversed(pad_nums):
+            pad += [0, pad_num]
+        res = F.pad(x, pad, 'constant', 0)
+    elif x.ndim == 3: #fourier1d
         res = F.pad(x, [0, pad_nums[0]], 'constant', 0)
     elif x.ndim == 4: #fourier2d
         res = F.pad(x, [0, pad_nums[1], 0, pad_nums[0]], 'constant', 0)
@@ -24,9 +29,41 @@ def add_padding(x, pad_nums):
     return res
 
 
-def remove_padding(x, pad_nums):
+@lru_cache(maxsize=None)
+def next_fast_len(n):
+    # smallest 2^a 3^b 5^c 7^d >= n, the sizes pocketfft/MKL/cuFFT transform fastest
+    m = max(n, 1)
+    while True:
+        k = m
+        for p in (2, 3, 5, 7):
+            while k % p == 0:
+                k //= p
+        if k == 1:
+            return m
+        m += 1
+
+
+def get_pad_nums(sizes, pad_ratio, pad_policy='ratio'):
+    """
+    Number of padded points of each axis of sizes
+        ratio : floor(pad_ratio * n)
+        fast  : at least floor(pad_ratio * n), rounded up so that the padded
+                length is 2^a 3^b 5^c 7^d
+    """
+    pad_nums = [math.floor(pad_ratio * n) for n in sizes]
+    if pad_policy == 'fast':
+        pad_nums = [next_fast_len(n + p) - n for n, p in zip(sizes, pad_nums)]
+    elif pad_policy != 'ratio':
+        raise ValueError(f'{pad_policy} is not supported')
+    return pad_nums
+
+
+def remove_padding(x, pad_nums, channels_last=False):
     
-    if x.ndim == 3: #fourier1d
+    if channels_last: # (batch, x, ..., channel)
+        res = x[(slice(None),) + tuple(slice(None, None if pad_num == 0 else -pad_num) for pad_num in pad_nums)]
+
+    elif x.ndim == 3: #fourier1d
         res = x[..., :(None if pad_nums[0] == 0 else -pad_nums[0])]
         
     elif x.ndim == 4: #fourier2d
@@ -61,6 +98,111 @@ def _get_act(act):
         raise ValueError(f'{act} is not supported')
     return func
 
+def _get_checkpoint_layers(checkpoint, n_layers):
+    # Fourier layers recomputed in backward: None/False (none), True/'all', or a list of layer indices
+    if checkpoint is None or checkpoint is False:
+        return ()
+    if checkpoint is True or checkpoint == 'all':
+        return tuple(range(n_layers))
+    if isinstance(checkpoint, int):
+        checkpoint = [checkpoint]
+    layers = []
+    for i in checkpoint:
+        if not -n_layers <= i < n_layers:
+            raise ValueError(f'checkpoint layer {i} out of range for {n_layers} Fourier layers')
+        layers.append(i % n_layers)
+    return tuple(sorted(set(layers)))
+
+def normalizer_affine(normalizer, n_channels):
+    '''
+    per-channel (mean, std + eps) vectors of a UnitGaussianNormalizer, whose
+    statistics must be scalars (dim = []) or constant over the grid (shape
+    (1, ..., 1, n_channels)) to be folded into a Linear over the channel axis
+    '''
+    mean, std = normalizer.mean, normalizer.std + normalizer.eps
+    for t in [mean, std]:
+        if t.numel() != 1 and (t.numel() != n_channels or t.shape[-1] != n_channels):
+            raise ValueError('only scalar or per-channel normalizer statistics can be folded into the model')
+    return mean.reshape(-1).expand(n_channels).clone(), std.reshape(-1).expand(n_channels).clone()
+
+
+def fold_normalizers(model, x_normalizer=None, y_normalizer=None):
+    '''
+    fold the encode of the input into model.fc0 and the decode of the output into
+    model.fc2 (FNN1d-FNN4d): the model then maps raw inputs to raw outputs and
+    carries the statistics as buffers (x_scale, x_shift, y_scale, y_shift).
+    For a model generating its grid (grid_channels), x_normalizer covers all the
+    fc0 inputs, the fields followed by the grid (StreamingGaussianNormalizer.fit
+    with grid_channels), and the grid is encoded with its statistics as well.
+    '''
+    if x_normalizer is not None:
+        mean, std = normalizer_affine(x_normalizer, model.fc0.in_features)
+        model.register_buffer('x_scale', (1 / std).to(model.fc0.weight))
+        model.register_buffer('x_shift', (-mean / std).to(model.fc0.weight))
+    if y_normalizer is not None:
+        mean, std = normalizer_affine(y_normalizer, model.fc2.out_features)
+        model.register_buffer('y_scale', std.to(model.fc2.weight))
+        model.register_buffer('y_shift', mean.to(model.fc2.weight))
+    return model
+
+
+def normalize_grid_channels(model, normalizer):
+    '''
+    encode the grid generated by the model (grid_channels) with the statistics of
+    normalizer, the grid channels of the x normalizer (StreamingGaussianNormalizer.channels),
+    as the grid stored in the data was encoded: buffers grid_mean and grid_std (+ eps)
+    '''
+    model.register_buffer('grid_mean', normalizer.mean.to(model.fc0.weight))
+    model.register_buffer('grid_std', (normalizer.std + normalizer.eps).to(model.fc0.weight))
+    return model
+
+
+def _get_grid_channels(grid_channels, n_dims):
+    # None, or one (low, high) pair per spatial axis of the n_dims-dimensional grid
+    if grid_channels is None:
+        return None
+    grid_channels = tuple((float(low), float(high)) for low, high in grid_channels)
+    if len(grid_channels) != n_dims:
+        raise ValueError(f'grid_channels needs one (low, high) pair per axis, {len(grid_channels)} given for {n_dims} axes')
+    return grid_channels
+
+
+@lru_cache(maxsize=32)
+def _grid(sizes, grid_channels, device, dtype):
+    # (n_1, ..., n_d, d) coordinates np.linspace(low, high, n_i) of each axis, one tensor per resolution and device
+    axes = [torch.linspace(low, high, n, device=device, dtype=dtype) for n, (low, high) in zip(sizes, grid_channels)]
+    return torch.stack(torch.meshgrid(*axes, indexing='ij'), dim=-1)
+
+
+def add_grid_channels(x, grid_channels=None, mean=None, std=None):
+    '''
+    x (batch, n_1, ..., n_d, channel) -> (batch, n_1, ..., n_d, channel + d), the grid
+    coordinates of each axis added as the last channels. The coordinates are built at
+    the resolution of x and kept for the next batches, the data sets only store the fields.
+    mean, std: encode the coordinates as (grid - mean) / std (normalize_grid_channels)
+    '''
+    if grid_channels is None:
+        return x
+    grid = _grid(tuple(x.shape[1:-1]), grid_channels, x.device, x.dtype)
+    if mean is not None:
+        grid = (grid - mean) / std
+    return torch.cat([x, grid.expand(x.shape[0], *grid.shape)], dim=-1)
+
+
+def linear_in(linear, x, scale=None, shift=None):
+    # linear(x * scale + shift), the affine map folded into the weights
+    if scale is None:
+        return linear(x)
+    return F.linear(x, linear.weight * scale, linear.bias + linear.weight @ shift)
+
+
+def linear_out(linear, x, scale=None, shift=None):
+    # linear(x) * scale + shift, the affine map folded into the weights
+    if scale is None:
+        return linear(x)
+    return F.linear(x, linear.weight * scale[:, None], linear.bias * scale + shift)
+
+
 def count_params(model):
     c = 0
     for p in list(model.parameters()):
@@ -0,0 +1,68 @@
+import pytest
+import torch
+
+from models.adam import Adam, adam, _reduced_adam
+
+# The multi-tensor (foreach) path of Adam against the python loop of adam(),
+# step for step, on real and complex parameters in double precision (real only
+# with amsgrad, which the loop does not support on complex parameters), and the
+# update of the reduced state with full precision moments against adam().
+
+
+def parameters(complex=True, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    params = [torch.randn(3, 4, dtype=torch.double, generator=generator).requires_grad_(),
+              torch.randn(5, dtype=torch.double, generator=generator).requires_grad_()]
+    if complex:
+        params += [torch.randn(4, 2, 3, 2, dtype=torch.cdouble, generator=generator).requires_grad_(),
+                   torch.randn(6, 2, 2, dtype=torch.cdouble, generator=generator).requires_grad_()]
+    return params
+
+
+def run(n_steps=5, **options):
+    # parameters and optimizer state after n_steps steps with the same gradients
+    params = parameters(complex=not options.get('amsgrad', False))
+    optimizer = Adam(params, lr=1e-2, **options)
+    generator = torch.Generator().manual_seed(1)
+    for _ in range(n_steps):
+        for p in params:
+            p.grad = torch.randn(p.shape, dtype=p.dtype, generator=generator)
+        optimizer.step()
+    return params, [optimizer.state[p] for p in params]
+
+
+@pytest.mark.parametrize('weight_decay', [0, 0.1])
+@pytest.mark.parametrize('amsgrad', [False, True])
+def test_foreach_matches_loop(weight_decay, amsgrad):
+    params, states = run(weight_decay=weight_decay, amsgrad=amsgrad)
+    params_foreach, states_foreach = run(weight_decay=weight_decay, amsgrad=amsgrad, foreach=True)
+    for p, p_foreach in zip(params, params_foreach):
+        assert torch.allclose(p_foreach, p)
+    for state, state_foreach in zip(states, states_foreach):
+        for key in state:
+            if torch.is_tensor(state[key]):
+                assert torch.allclose(state_foreach[key], state[key])
+            else:
+                assert state_foreach[key] == state[key]
+
+
+@pytest.mark.parametrize('weight_decay', [0, 0.1])
+def test_reduced_full_state_matches_loop(weight_decay):
+    # _reduced_adam with the state of factored=False, exp_avg_dtype=None: a real view of the
+    # first moment in the precision of the parameter and the full (real) second moment
+    params, params_reduced = [p.detach() for p in parameters()], [p.detach() for p in parameters()]
+    real = [torch.view_as_real(p) if p.is_complex() else p for p in params_reduced]
+    exp_avgs, exp_avg_sqs = [torch.zeros_like(p) for p in params], [torch.zeros_like(p) for p in params]
+    exp_avgs_reduced = [torch.zeros_like(p) for p in real]
+    exp_avg_sqs_reduced = [torch.zeros(p.shape, dtype=r.dtype) for p, r in zip(params_reduced, real)]
+    options = dict(beta1=0.9, beta2=0.999, lr=1e-2, weight_decay=weight_decay, eps=1e-8)
+    generator = torch.Generator().manual_seed(1)
+    for step in range(1, 6):
+        grads = [torch.randn(p.shape, dtype=p.dtype, generator=generator) for p in params]
+        adam(params, grads, exp_avgs, exp_avg_sqs, [], [step] * len(params), amsgrad=False, **options)
+        _reduced_adam(params_reduced, grads, exp_avgs_reduced, exp_avg_sqs_reduced, [[] for p in params],
+                      [step] * len(params), **options)
+        for i, p in enumerate(params):
+            assert torch.allclose(params_reduced[i], p)
+            assert torch.allclose(exp_avgs_reduced[i], torch.view_as_real(exp_avgs[i]) if p.is_complex() else exp_avgs[i])
+            assert torch.allclose(exp_avg_sqs_reduced[i], exp_avg_sqs[i].real)
@@ -0,0 +1,50 @@
+import pytest
+import torch
+import tltorch
+
+from models.core import contract_factorized
+from models.spectral import contract
+
+# Contraction with the CP/Tucker factors against the contraction of the dense
+# reconstructed corner weights, in double precision: outputs, the gradient of
+# the block and the gradients of the factors.
+
+
+@pytest.mark.parametrize('factorization', ['cp', 'tucker'])
+@pytest.mark.parametrize('modes', [(3,), (2, 3), (2, 2, 3)])
+@pytest.mark.parametrize('rank', [0.2, 0.5, 1.0])
+def test_factorized_matches_dense(factorization, modes, rank):
+    torch.manual_seed(0)
+    n_corners = 2 ** (len(modes) - 1)
+    # two joint layers, the corners of the second one are contracted
+    weight = tltorch.FactorizedTensor.new((2 * n_corners, 2, 3) + modes, rank=rank, factorization=factorization,
+                                          dtype=torch.cdouble)
+    weight.normal_(0, 1)
+    block = torch.randn((2, 2) + tuple(2 * m for m in modes[:-1]) + (modes[-1],), dtype=torch.cdouble)
+    grad = torch.randn((2, 3) + block.shape[2:], dtype=torch.cdouble)
+    factors = list(weight.parameters())
+
+    results = []
+    for factorized in [False, True]:
+        block_ = block.clone().requires_grad_()
+        if factorized:
+            out = contract_factorized(block_, weight, n_corners, modes)
+        else:
+            dense = weight.to_tensor()
+            out = contract(block_, [dense[n_corners + k] for k in range(n_corners)], modes)
+        results.append([out] + list(torch.autograd.grad(out, [block_] + factors, grad)))
+    for expected, actual in zip(*results):
+        assert torch.allclose(actual, expected)
+
+
+@pytest.mark.parametrize('factorization', ['cp', 'tucker'])
+@pytest.mark.parametrize('modes', [(3,), (2, 3), (2, 2, 3)])
+def test_factorized_gradcheck(factorization, modes):
+    torch.manual_seed(0)
+    n_corners = 2 ** (len(modes) - 1)
+    weight = tltorch.FactorizedTensor.new((n_corners, 2, 3) + modes, rank=0.5, factorization=factorization,
+                                          dtype=torch.cdouble)
+    weight.normal_(0, 1)
+    block = torch.randn((2, 2) + tuple(2 * m for m in modes[:-1]) + (modes[-1],), dtype=torch.cdouble,
+                        requires_grad=True)
+    assert torch.autograd.gradcheck(lambda block: contract_factorized(block, weight, 0, modes), (block,))
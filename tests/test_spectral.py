@@ -0,0 +1,163 @@
+import threading
+import pytest
+import torch
+
+from models.basics import SpectralConv1d, SpectralConv2d, SpectralConv3d
+from models.spectral import contract, corner_weights, pack_weights, gather_modes, scatter_modes, split_corners, \
+    lean_spectral, spatial_dims, spatial_sizes, channels_first, spectrum_shape, _block_corner_order, CONTRACTIONS, \
+    workspace, SpectrumWorkspace
+
+# Small double precision checks of the paths that claim to match plain autograd
+# or the per-corner einsum: the lean autograd Function (gradcheck and the
+# gradients of the plain rfftn -> mix -> irfftn sequence) and the bmm/gauss
+# contractions. The cases cover 1D-4D, odd sizes, the Nyquist mode of the last
+# axis and overlapping corners (2*m > n). Training with the shared output
+# spectrum workspace has to give the gradients of training without it.
+
+CASES = [
+    # sizes, modes
+    ((9,),         (3,)),
+    ((8,),         (5,)),
+    ((7, 9),       (2, 3)),
+    ((5, 6),       (3, 4)),
+    ((5, 6, 7),    (2, 2, 3)),
+    ((4, 5, 3, 4), (2, 2, 1, 3)),
+    ((3, 4, 5, 4), (2, 1, 2, 2)),
+]
+
+
+def weights(modes, in_channels=2, out_channels=3, seed=0):
+    # mode-major weights (2*m_1 * ... * m_d, in_channel, out_channel)
+    generator = torch.Generator().manual_seed(seed)
+    n_modes = 2 ** (len(modes) - 1) * int(torch.tensor(modes).prod())
+    return torch.randn(n_modes, in_channels, out_channels, dtype=torch.cdouble, generator=generator)
+
+
+def plain_spectral(x, w, modes, norm='backward', channels_last=False):
+    # rfftn -> gather -> mix -> scatter -> irfftn through plain autograd
+    dims, sizes = spatial_dims(x, channels_last), spatial_sizes(x, channels_last)
+    x_ft = torch.fft.rfftn(x, dim=dims, norm=norm)
+    out_block = contract(gather_modes(channels_first(x_ft, channels_last), modes), w, modes)
+    out_ft = torch.zeros(spectrum_shape(x.shape[0], out_block.shape[1], sizes, channels_last), dtype=out_block.dtype)
+    scatter_modes(channels_first(out_ft, channels_last), out_block, modes)
+    return torch.fft.irfftn(out_ft, s=sizes, dim=dims, norm=norm)
+
+
+def lean(x, w, modes, norm='backward', channels_last=False):
+    return lean_spectral(x, modes, lambda block: contract(block, w, modes), [w], norm=norm, channels_last=channels_last)
+
+
+@pytest.mark.parametrize('sizes, modes', CASES)
+@pytest.mark.parametrize('norm', ['backward', 'ortho'])
+def test_lean_gradcheck(sizes, modes, norm):
+    x = torch.randn(2, 2, *sizes, dtype=torch.double, requires_grad=True)
+    w = weights(modes).requires_grad_()
+    assert torch.autograd.gradcheck(lambda x, w: lean(x, w, modes, norm), (x, w))
+
+
+@pytest.mark.parametrize('sizes, modes', CASES)
+@pytest.mark.parametrize('channels_last', [False, True])
+def test_lean_matches_autograd(sizes, modes, channels_last):
+    x = torch.randn(2, *sizes, 2, dtype=torch.double) if channels_last else torch.randn(2, 2, *sizes, dtype=torch.double)
+    w = weights(modes)
+    grad = torch.randn(x.shape[:-1] + (3,) if channels_last else (2, 3) + x.shape[2:], dtype=torch.double)
+
+    results = []
+    for spectral in [plain_spectral, lean]:
+        x_, w_ = x.clone().requires_grad_(), w.clone().requires_grad_()
+        out = spectral(x_, w_, modes, channels_last=channels_last)
+        results.append([out] + list(torch.autograd.grad(out, [x_, w_], grad)))
+    for expected, actual in zip(*results):
+        assert torch.allclose(actual, expected)
+
+
+@pytest.mark.parametrize('sizes, modes', CASES)
+@pytest.mark.parametrize('contraction', CONTRACTIONS)
+@pytest.mark.parametrize('packed', [True, False])
+def test_contraction_matches_corners(sizes, modes, contraction, packed):
+    # every backend, on mode-major weights (packed) and on a list of corner weights,
+    # against one einsum per corner
+    w = weights(modes)
+    block = torch.randn((2, 2) + tuple(2 * m for m in modes[:-1]) + (modes[-1],), dtype=torch.cdouble)
+    grad = torch.randn((2, 3) + block.shape[2:], dtype=torch.cdouble)
+
+    results = []
+    for reference in [True, False]:
+        block_, w_ = block.clone().requires_grad_(), w.clone().requires_grad_()
+        if reference:
+            out = join_corners([torch.einsum('bi...,io...->bo...', corner, c) for corner, c in
+                                zip(split_corners(block_, modes), corner_weights(w_, modes))], modes)
+        else:
+            out = contract(block_, w_ if packed else corner_weights(w_, modes), modes, contraction)
+        results.append([out] + list(torch.autograd.grad(out, [block_, w_], grad)))
+    for expected, actual in zip(*results):
+        assert torch.allclose(actual, expected)
+
+
+@pytest.mark.parametrize('sizes, modes', CASES[::2])
+@pytest.mark.parametrize('contraction', CONTRACTIONS)
+def test_contraction_gradcheck(sizes, modes, contraction):
+    w = weights(modes).requires_grad_()
+    block = torch.randn((2, 2) + tuple(2 * m for m in modes[:-1]) + (modes[-1],), dtype=torch.cdouble, requires_grad=True)
+    assert torch.autograd.gradcheck(lambda block, w: contract(block, w, modes, contraction), (block, w))
+
+
+def test_pack_weights_inverts_corner_weights():
+    for sizes, modes in CASES:
+        w = weights(modes)
+        assert torch.equal(pack_weights(corner_weights(w, modes), modes, mode_major=True), w)
+
+
+@pytest.mark.parametrize('Layer, sizes, modes', [(SpectralConv1d, (9,), (3,)),
+                                                  (SpectralConv2d, (7, 9), (2, 3)),
+                                                  (SpectralConv3d, (5, 6, 7), (2, 2, 3))])
+@pytest.mark.parametrize('lean', [False, True])
+def test_workspace_gradients(Layer, sizes, modes, lean):
+    # two training steps, with the workspace and with max_bytes=0 (no reuse)
+    max_bytes = workspace.max_bytes
+    results = []
+    try:
+        for budget in [2**31, 0]:
+            workspace.max_bytes = budget
+            workspace.clear()
+            torch.manual_seed(0)
+            layer = Layer(2, 3, *modes, lean=lean)
+            optimizer = torch.optim.SGD(layer.parameters(), lr=0.1)
+            generator = torch.Generator().manual_seed(1)
+            grads = []
+            for step in range(2):
+                optimizer.zero_grad()
+                layer(torch.randn(2, 2, *sizes, generator=generator)).square().sum().backward()
+                grads.append(layer.weights.grad.clone())
+                optimizer.step()
+            assert (workspace.nbytes > 0) == (budget > 0)
+            results.append(grads)
+    finally:
+        workspace.max_bytes = max_bytes
+        workspace.clear()
+    for expected, actual in zip(*results):
+        assert torch.equal(actual, expected)
+
+
+def test_workspace_drops_finished_threads():
+    cache = SpectrumWorkspace()
+    thread = threading.Thread(target=cache.zeros, args=((2, 3, 8), torch.cfloat, 'cpu', (3,)))
+    thread.start()
+    thread.join()
+    assert cache.nbytes == 2 * 3 * 8 * 8
+    cache.zeros((2, 3, 4), torch.cfloat, 'cpu', (3,))
+    assert cache.nbytes == 2 * 3 * 4 * 8
+
+
+def join_corners(corners, modes):
+    # (batch, channel, m_1, ..., m_d) corners, in the order of weights1, weights2, ... -> gathered block
+    ndim = len(modes)
+    out = torch.stack([corners[c] for c in _block_corner_order(ndim)])
+    shape = out.shape[1:]
+    out = out.view((2,) * (ndim - 1) + tuple(shape))
+    # (2, ..., 2, b, o, m_1, ..., m_d) -> (b, o, 2, m_1, ..., 2, m_{d-1}, m_d)
+    perm = [ndim - 1, ndim]
+    for j in range(ndim - 1):
+        perm += [j, ndim + 1 + j]
+    perm.append(2 * ndim)
+    return out.permute(perm).reshape(tuple(shape[:2]) + tuple(2 * m for m in modes[:-1]) + (modes[-1],))